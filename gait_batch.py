@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch runner that detects HS and TO events for many subjects on a process pool.
+
+Each (subject, sensor) pair is one task. Tasks load their own recording inside the
+worker, run the headless detector from gait_metrics and return a result dict, so the
+parent never holds the whole cohort and no figures are created.
+"""
+
+#%% Import Libraries
+
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import gait_bouts
+import gait_io
+import gait_metrics as gm
+import gait_profile
+
+
+#%% Define Parameters
+
+# detector settings for each sensor that has a detector
+configs = {
+    'chest_accel': gm.chest_accel_config,
+    'shank_gyro': gm.shank_gyro_config,
+    }
+
+# load arguments with bouts=True unless given, the bouts replace the crop
+bout_load_kwargs = {'crop_start_time': None, 'crop_stop_time': None}
+
+
+#%% Run One Task
+
+
+def run_task(subject, sensor, config=None, profile=False, bouts=False, **load_kwargs):
+    """
+    Loads one recording at config.fs (gait_io.load_recording, resampled only if
+    load_kwargs has resample=True) and detects its events. Exceptions are caught and
+    returned in the result so one bad subject does not stop the batch.
+
+    Parameters
+    ----------
+    subject : int
+        Subject number.
+    sensor : str
+        Key of configs, e.g. 'chest_accel' or 'shank_gyro'.
+    config : DetectorConfig, optional
+        Detector settings. The default is configs[sensor].
+    profile : bool, optional
+        Record the stage timings of this task (see gait_profile) in result['profile'].
+        The default is False.
+    bouts : bool, optional
+        Detect only in the walking bouts of the whole recording (gait_bouts) instead of
+        the crop. The crop then defaults to the whole recording. The default is False.
+    **load_kwargs
+        Passed to gait_io.load_recording (data_dir, crop_start_time, crop_stop_time,
+        resample). fs is always config.fs.
+
+    Returns
+    -------
+    result : dict
+        'subject', 'sensor', 'HS_inds', 'TO_inds' (None on failure), 'HS_time' and
+        'TO_time' (time of each event in seconds, which locates the events in the
+        recorded rows when the recording was resampled) and 'error' (None on success,
+        otherwise the formatted traceback), plus 'profile' (list of stage events) if
+        profile is True.
+
+    """
+    result = _empty_result(subject, sensor)
+    recorder = gait_profile.Recorder()
+    if profile:
+        gait_profile.enable(recorder)
+
+    try:
+        with gait_profile.stage('task', subject=subject, sensor=sensor):
+            if config is None:
+                config = configs[sensor]
+            if bouts:
+                load_kwargs = {**bout_load_kwargs, **load_kwargs}
+            data = gait_io.load_recording(subject, sensor, **{**load_kwargs, 'fs': config.fs})
+            if bouts:
+                result['HS_inds'], result['TO_inds'], _ = gait_bouts.detect_bout_events(data, config)
+            else:
+                result['HS_inds'], result['TO_inds'] = gm.detect_sensor_events(data, config)
+            time_s = data.iloc[:, 0].to_numpy()
+            result['HS_time'] = time_s[gm._event_indices(result['HS_inds'])]
+            result['TO_time'] = time_s[gm._event_indices(result['TO_inds'])]
+    except Exception:
+        result['error'] = traceback.format_exc()
+    finally:
+        if profile:
+            gait_profile.disable(recorder)
+            result['profile'] = recorder.events
+
+    return result
+
+
+def _empty_result(subject, sensor, error=None):
+    """
+    Returns the result dict of a task without events.
+    """
+    return {'subject': subject, 'sensor': sensor, 'HS_inds': None, 'TO_inds': None, 'HS_time': None,
+            'TO_time': None, 'error': error}
+
+
+#%% Process Pool
+
+
+def map_tasks(function, tasks, max_workers=None):
+    """
+    Runs function(*task) for every task on a process pool and returns the results in
+    task order. An exception in one task is returned as its error and does not stop
+    the other tasks.
+
+    Parameters
+    ----------
+    function : function
+        Module level function (must be picklable).
+    tasks : list of tuple
+        Arguments of each call.
+    max_workers : int, optional
+        Number of worker processes. None uses os.cpu_count(), 1 runs every task in
+        this process without a pool. The default is None.
+
+    Returns
+    -------
+    outputs : list of tuple
+        (result, error) of each task, error is None on success and otherwise the
+        formatted traceback (result is then None).
+
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    def run_inline(task):
+        try:
+            return function(*task), None
+        except Exception:
+            return None, traceback.format_exc()
+
+    if max_workers == 1 or len(tasks) <= 1:
+        return [run_inline(task) for task in tasks]
+
+    outputs = []
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+        futures = [executor.submit(function, *task) for task in tasks]
+
+        # collect in submission order, a crashed worker only fails its own tasks
+        for future in futures:
+            try:
+                outputs.append((future.result(), None))
+            except Exception:
+                outputs.append((None, traceback.format_exc()))
+
+    return outputs
+
+
+#%% Run Batch
+
+
+def run_batch(subject_range, sensors=tuple(configs), max_workers=None, sensor_configs=None, profile=False,
+              bouts=False, **load_kwargs):
+    """
+    Detects events for every subject and sensor on a process pool.
+
+    Parameters
+    ----------
+    subject_range : iterable of int
+        Subject numbers.
+    sensors : iterable of str, optional
+        Sensors to process. The default is ('chest_accel', 'shank_gyro').
+    max_workers : int, optional
+        Number of worker processes. None uses os.cpu_count(), 1 runs every task in
+        this process without a pool. The default is None.
+    sensor_configs : dict, optional
+        DetectorConfig per sensor, overriding configs. The default is None.
+    profile : bool, optional
+        Record the stage timings of every task in its result['profile'], e.g. to merge
+        them with gait_profile.Recorder.extend. The default is False.
+    bouts : bool, optional
+        Detect only in the walking bouts of each recording, see run_task. The default
+        is False.
+    **load_kwargs
+        Passed to gait_io.load_recording (data_dir, crop_start_time, crop_stop_time,
+        resample). Give resample=True to resample recordings at another rate to the
+        config rate.
+
+    Returns
+    -------
+    results : list of dict
+        One result of run_task per (subject, sensor), ordered by subject and then by
+        sensor as given, regardless of which task finished first.
+
+    """
+    tasks = [(subject, sensor) for subject in subject_range for sensor in sensors]
+    sensor_configs = {**configs, **(sensor_configs or {})}
+
+    # run_task takes keyword arguments, so bind them per task
+    outputs = map_tasks(partial(run_task, profile=profile, bouts=bouts, **load_kwargs),
+                        [(subject, sensor, sensor_configs.get(sensor)) for subject, sensor in tasks],
+                        max_workers)
+
+    results = []
+    for (subject, sensor), (result, error) in zip(tasks, outputs):
+        if error is not None:
+            result = _empty_result(subject, sensor, error)
+        results.append(result)
+
+    return results
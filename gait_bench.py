@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the detection pipeline on synthetic gait signals.
+
+synthetic_gait builds chest accel and shank gyro recordings with known HS and TO times:
+each signal is a carrier at the centre frequency of its detector's wavelet, modulated by
+an envelope that peaks at every HS and falls to zero at every TO. run_benchmark times
+each stage (load, wavelet, peak detection, cycle metrics, statistics), reports throughput
+and peak memory, and checks the detected events against the ground truth.
+
+Runs without a display:
+    python gait_bench.py --duration 3600 --repeat 3
+exits with status 1 if the recall of any detector falls below --min-recall or its
+precision below --min-precision.
+"""
+
+#%% Import Libraries
+
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from scipy.stats import pearsonr
+
+import gait_io
+import gait_metrics as gm
+
+
+#%% Synthetic Signals
+
+
+def _envelope(t, event_times, event_values):
+    """
+    Smooth (raised cosine) interpolation between the event values at the event times.
+    """
+    k = np.clip(np.searchsorted(event_times, t, side='right') - 1, 0, len(event_times) - 2)
+    u = np.clip((t - event_times[k]) / (event_times[k + 1] - event_times[k]), 0, 1)
+
+    return event_values[k] + (event_values[k + 1] - event_values[k]) * (1 - np.cos(np.pi * u)) / 2
+
+
+def _carrier_frequency(config):
+    """
+    Centre frequency (Hz) of the config's morlet wavelet at its detection scale.
+    """
+    return 5 * config.fs / (2 * np.pi * config.width)
+
+
+def synthetic_gait(duration=60, fs=125, stride_time=1.1, stance_fraction=0.6, noise=0.05,
+                   stride_jitter=0.02, seed=0):
+    """
+    Generates chest accel and shank gyro recordings with known HS and TO.
+
+    Parameters
+    ----------
+    duration : float, optional
+        Length of the recordings (seconds). The default is 60.
+    fs : float, optional
+        Sampling frequency (Hz). The default is 125.
+    stride_time : float, optional
+        Mean stride time (seconds). The default is 1.1.
+    stance_fraction : float, optional
+        Stance time as a fraction of the stride. The default is 0.6.
+    noise : float, optional
+        Standard deviation of the added noise, relative to the signal amplitude.
+        The default is 0.05.
+    stride_jitter : float, optional
+        Relative standard deviation of the stride time. The default is 0.02.
+    seed : int, optional
+        Seed of the random generator. The default is 0.
+
+    Returns
+    -------
+    recordings : dict
+        'chest_accel' and 'shank_gyro' DataFrames (time + 3 axes) and the ground truth
+        'shank_HS', 'shank_TO' (one foot) and 'chest_HS', 'chest_TO' (both feet), in seconds.
+
+    """
+    rng = np.random.default_rng(seed)
+    time_s = np.arange(int(duration * fs)) / fs
+
+    # HS of the shank foot, TO at the end of its stance, other foot half a stride later
+    n_strides = int(duration / stride_time) + 3
+    strides = stride_time * (1 + stride_jitter * rng.standard_normal(n_strides))
+    shank_HS = -stride_time + np.cumsum(strides)
+    shank_TO = shank_HS + stance_fraction * strides
+    other_HS = shank_HS + strides / 2
+    other_TO = other_HS + stance_fraction * strides
+
+    # chest sees the HS and TO of both feet
+    chest_events = np.concatenate([shank_HS, other_HS, shank_TO, other_TO])
+    chest_is_HS = np.concatenate([np.ones(2 * n_strides), np.zeros(2 * n_strides)])
+    order = np.argsort(chest_events)
+    chest_events = chest_events[order]
+    chest_is_HS = chest_is_HS[order]
+
+    shank_events = np.concatenate([shank_HS, shank_TO])
+    shank_is_HS = np.concatenate([np.ones(n_strides), np.zeros(n_strides)])
+    order = np.argsort(shank_events)
+    shank_events = shank_events[order]
+    shank_is_HS = shank_is_HS[order]
+
+    recordings = {}
+    for sensor, config, events, is_HS, amplitude, offset in [
+            ('chest_accel', gm.chest_accel_config, chest_events, chest_is_HS, 1.0, 1.0),
+            ('shank_gyro', gm.shank_gyro_config, shank_events, shank_is_HS, 200.0, 0.0)]:
+        envelope = _envelope(time_s, events, is_HS)
+        carrier = np.sin(2 * np.pi * _carrier_frequency(config) * time_s)
+        axes = amplitude * noise * rng.standard_normal((len(time_s), 3))
+        axes[:, config.column - 1] += offset + amplitude * envelope * carrier
+        recordings[sensor] = pd.DataFrame(np.column_stack([time_s, axes]), columns=['time', 'x', 'y', 'z'])
+
+    in_range = lambda times: times[(times >= 0) & (times < duration)]
+    recordings['shank_HS'] = in_range(shank_HS)
+    recordings['shank_TO'] = in_range(shank_TO)
+    recordings['chest_HS'] = in_range(np.sort(np.concatenate([shank_HS, other_HS])))
+    recordings['chest_TO'] = in_range(np.sort(np.concatenate([shank_TO, other_TO])))
+
+    return recordings
+
+
+#%% Stage Timing
+
+
+def _timed(stage_results, stage, n_samples, function, *args, trace=False, **kwargs):
+    """
+    Runs function once, recording its wall time. With trace, it is run a second time
+    under tracemalloc for the peak memory, since tracing slows down allocation and
+    would understate the throughput of the timed run.
+    """
+    start = time.perf_counter()
+    output = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    timings = stage_results.setdefault(stage, {'seconds': [], 'peak_bytes': []})
+    timings['seconds'].append(elapsed)
+    timings['samples'] = n_samples
+
+    if trace:
+        tracemalloc.start()
+        function(*args, **kwargs)
+        timings['peak_bytes'].append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return output
+
+
+def detection_accuracy(detected_times, true_times, tolerance):
+    """
+    Precision and recall of detected events against the ground truth (seconds).
+    """
+    n_matched = len(gm.match_events(detected_times, true_times, tolerance)[0])
+    precision = n_matched / len(detected_times) if len(detected_times) else 0.0
+    recall = n_matched / len(true_times) if len(true_times) else 0.0
+
+    return precision, recall
+
+
+#%% Run Benchmark
+
+
+def benchmark_configs(fs=125):
+    """
+    Returns the chest accel and shank gyro configs with the default detection widths
+    in seconds, as scales in samples at fs. Raises ValueError if a width does not fit
+    the wavelet scales at fs.
+    """
+    configs = {}
+    for default in (gm.chest_accel_config, gm.shank_gyro_config):
+        config = gm.DetectorConfig.from_width_seconds(default.sensor, default.column, default.width_seconds, fs=fs,
+                                                      prominence=default.prominence,
+                                                      mother_wavelet=default.mother_wavelet)
+        if abs(config.width_seconds - default.width_seconds) > 1 / fs:
+            raise ValueError(f'the {default.sensor} width of {default.width_seconds:.3f} s is outside the wavelet '
+                             f'scales at {fs:g} Hz')
+        configs[config.sensor] = config
+
+    return configs
+
+
+def run_benchmark(duration=600, fs=125, noise=0.05, repeat=3, tolerance=0.15, seed=0):
+    """
+    Times every stage of the pipeline on synthetic recordings and measures accuracy.
+    The detectors use benchmark_configs(fs), so the wavelet widths in seconds are the
+    same at every sampling frequency.
+
+    Parameters
+    ----------
+    duration : float, optional
+        Length of the synthetic recordings (seconds). The default is 600.
+    fs : float, optional
+        Sampling frequency (Hz). The default is 125.
+    noise : float, optional
+        Relative noise level. The default is 0.05.
+    repeat : int, optional
+        Runs of each stage, the fastest is reported. The default is 3.
+    tolerance : float, optional
+        Largest distance of a correct event from the ground truth (seconds).
+        The default is 0.15.
+    seed : int, optional
+        Seed of the generator. The default is 0.
+
+    Returns
+    -------
+    report : dict
+        'stages': per stage 'seconds' (best untraced run), 'samples_per_second' and
+        'peak_bytes' (separate traced run);
+        'accuracy': per sensor and event type 'precision' and 'recall'.
+
+    """
+    recordings = synthetic_gait(duration, fs, noise=noise, seed=seed)
+    configs = benchmark_configs(fs)
+    truth = {'chest_accel': ('chest_HS', 'chest_TO'), 'shank_gyro': ('shank_HS', 'shank_TO')}
+    n_samples = len(recordings['shank_gyro'])
+    stage_results = {}
+    accuracy = {}
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        for sensor in configs:
+            recordings[sensor].to_csv(gait_io.get_file_path(1, sensor, data_dir), index=False)
+
+        for run in range(repeat):
+            # peak memory from a separate traced run of each stage, on the first repeat
+            trace = run == 0
+            events = {}
+            for sensor, config in configs.items():
+                data = _timed(stage_results, 'load', n_samples, gait_io.load_recording, 1, sensor, data_dir=data_dir,
+                              crop_start_time=None, crop_stop_time=None, fs=fs, trace=trace)
+                signal_data = np.asarray(data.iloc[:, config.column])
+                cwt_row = _timed(stage_results, 'wavelet', n_samples, gm.wavelet_scale, signal_data, config.scale,
+                                 config.mother_wavelet, trace=trace)
+                events[sensor] = _timed(stage_results, 'peak detection', n_samples, gm.find_wavelet_events,
+                                        cwt_row, config.prominence, trace=trace)
+
+            cycles = _timed(stage_results, 'cycle metrics', n_samples, _cycle_stage, events, fs, trace=trace)
+            _timed(stage_results, 'statistics', n_samples, _statistics_stage, cycles, trace=trace)
+
+    for sensor, (HS_key, TO_key) in truth.items():
+        time_s = np.asarray(recordings[sensor].iloc[:, 0])
+        HS_inds, TO_inds = events[sensor]
+        for event, key, inds in [('HS', HS_key, HS_inds[0]), ('TO', TO_key, TO_inds[0])]:
+            precision, recall = detection_accuracy(time_s[inds], recordings[key], tolerance)
+            accuracy[f'{sensor} {event}'] = {'precision': precision, 'recall': recall}
+
+    stages = {}
+    for stage, timings in stage_results.items():
+        # each repeat runs a stage once per sensor for load / wavelet / peaks
+        per_run = np.reshape(timings['seconds'], (repeat, -1))
+        seconds = float(np.min(per_run.sum(axis=1)))
+        samples = timings['samples'] * per_run.shape[1]
+        stages[stage] = {'seconds': seconds, 'samples_per_second': samples / seconds if seconds else np.inf,
+                         'peak_bytes': int(np.max(timings['peak_bytes']))}
+
+    return {'stages': stages, 'accuracy': accuracy}
+
+
+def _cycle_stage(events, fs):
+    """
+    Pairs each sensor's events and matches the cycles between sensors.
+    """
+    accel_cycles = gm.pair_gait_events(*events['chest_accel'], fs=fs)
+    gyro_cycles = gm.pair_gait_events(*events['shank_gyro'], fs=fs)
+
+    return gm.match_cycles(accel_cycles, gyro_cycles, fs=fs)
+
+
+def _statistics_stage(cycles):
+    """
+    Correlates stance, swing and stride of the matched cycles.
+    """
+    accel_matched, gyro_matched = cycles
+    if len(accel_matched) < 2:
+        return {}
+
+    return {metric: pearsonr(accel_matched[metric], gyro_matched[metric])
+            for metric in ['stance', 'swing', 'stride']}
+
+
+#%% Command Line
+
+
+def print_report(report):
+    """
+    Prints the stage timings and accuracy of run_benchmark.
+    """
+    print(f'{"stage":<16}{"seconds":>10}{"samples/s":>14}{"peak MB":>10}')
+    for stage, result in report['stages'].items():
+        print(f'{stage:<16}{result["seconds"]:>10.4f}{result["samples_per_second"]:>14.3g}'
+              f'{result["peak_bytes"] / 1e6:>10.2f}')
+    print()
+    print(f'{"events":<16}{"precision":>10}{"recall":>10}')
+    for name, result in report['accuracy'].items():
+        print(f'{name:<16}{result["precision"]:>10.3f}{result["recall"]:>10.3f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the gait event pipeline on synthetic data.')
+    parser.add_argument('--duration', type=float, default=600, help='recording length (seconds)')
+    parser.add_argument('--fs', type=float, default=125, help='sampling frequency (Hz)')
+    parser.add_argument('--noise', type=float, default=0.05, help='relative noise level')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the fastest is reported')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='event tolerance (seconds)')
+    parser.add_argument('--min-recall', type=float, default=0.9, help='fail if any recall is lower')
+    parser.add_argument('--min-precision', type=float, default=0.9, help='fail if any precision is lower')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.duration, args.fs, args.noise, args.repeat, args.tolerance, args.seed)
+    print_report(report)
+
+    failed = [f'{name} recall' for name, result in report['accuracy'].items() if result['recall'] < args.min_recall]
+    failed += [f'{name} precision' for name, result in report['accuracy'].items()
+               if result['precision'] < args.min_precision]
+    if failed:
+        print(f'\nAccuracy regression: recall below {args.min_recall} or precision below {args.min_precision} for '
+              f'{", ".join(failed)}')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
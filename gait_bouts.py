@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Walking bout segmentation, so the wavelet detectors only run on gait.
+
+The first pass is cheap: the standard deviation of the detector column over sliding
+windows of a few seconds, every quarter second, computed for all windows at once from
+cumulative block sums. Windows above the sensor's threshold are walking; runs of
+walking separated by short pauses are merged, and bouts that are too short are dropped. detect_bout_events runs
+the HS/TO detector on each bout (with a margin, so the wavelet sees whole strides at
+the bout edges) and returns the events of the whole recording, which replaces the
+hard-coded crop of the walking section for long or free-living recordings.
+"""
+
+#%% Import Libraries
+
+from dataclasses import dataclass
+
+import numpy as np
+
+import gait_metrics as gm
+import gait_profile
+
+
+#%% Bout Configuration
+
+
+@dataclass(frozen=True)
+class BoutConfig:
+    """
+    Settings of the walking bout detector of one sensor.
+
+    Attributes
+    ----------
+    sensor : str
+        Data type, e.g. 'shank_gyro'.
+    column : int
+        Column of the recording with the signal (0 is time).
+    min_std : float
+        Rolling standard deviation above which a sample counts as walking (signal units).
+    window_seconds : float
+        Length of the sliding window (seconds).
+    step_seconds : float
+        Distance between windows, the time resolution of the bouts (seconds).
+    min_bout_seconds : float
+        Shorter bouts are dropped (seconds).
+    max_gap_seconds : float
+        Bouts separated by a shorter pause are merged (seconds).
+    pad_seconds : float
+        Margin of signal on each side of a bout given to the wavelet detector (seconds).
+        Events in the margin are dropped.
+
+    Every length is in seconds and converted to samples at the rate of the recording,
+    which detect_bout_events takes from the DetectorConfig.
+    """
+    sensor: str
+    column: int
+    min_std: float
+    window_seconds: float = 2.0
+    step_seconds: float = 0.25
+    min_bout_seconds: float = 5.0
+    max_gap_seconds: float = 2.0
+    pad_seconds: float = 2.0
+
+
+# CC chest accel in g, ML shank gyro in deg/s
+chest_accel_bouts = BoutConfig('chest_accel', column=gm.chest_accel_config.column, min_std=0.05)
+shank_gyro_bouts = BoutConfig('shank_gyro', column=gm.shank_gyro_config.column, min_std=20.0)
+bout_configs = {'chest_accel': chest_accel_bouts, 'shank_gyro': shank_gyro_bouts}
+
+# start (first sample) and stop (one past the last sample) of each bout
+bout_dtype = np.dtype([('start', np.int64), ('stop', np.int64)])
+
+
+#%% Bout Detection
+
+
+def window_std(signal_data, window, step):
+    """
+    Standard deviation of the signal over sliding windows, one window every step
+    samples. The signal is summed once per block of step samples (the last block may
+    be shorter), and the window sums are differences of the cumulative block sums, so
+    the cost is one pass over the signal whatever the window length. Windows at the
+    ends are cut to the signal.
+
+    Parameters
+    ----------
+    signal_data : array of float
+        Signal.
+    window : int
+        Window length (samples), rounded to whole blocks.
+    step : int
+        Block length (samples), the resolution of the result.
+
+    Returns
+    -------
+    std : array of float
+        Standard deviation of the window centred on each block, ceil(len / step) values.
+
+    """
+    x = np.asarray(signal_data, dtype=np.float64)
+    step = max(int(step), 1)
+    if len(x) == 0:
+        return np.zeros(0)
+
+    # centred on the overall mean, which keeps the cumulative sums small
+    x = x - x.mean()
+    block_starts = np.arange(0, len(x), step)
+    counts = np.concatenate([[0], np.cumsum(np.diff(np.append(block_starts, len(x))))])
+    sums = np.concatenate([[0.0], np.cumsum(np.add.reduceat(x, block_starts))])
+    squares = np.concatenate([[0.0], np.cumsum(np.add.reduceat(x * x, block_starts))])
+
+    # blocks [low, high) of the window around each block
+    blocks = max(int(round(window / step)), 1)
+    first = np.arange(len(block_starts)) - blocks // 2
+    low = np.clip(first, 0, len(block_starts))
+    high = np.clip(first + blocks, 0, len(block_starts))
+    n = counts[high] - counts[low]
+    window_sums = sums[high] - sums[low]
+    variance = (squares[high] - squares[low] - window_sums ** 2 / n) / n
+
+    return np.sqrt(np.maximum(variance, 0))
+
+
+def detect_bouts(signal_data, config=shank_gyro_bouts, fs=125):
+    """
+    Finds the walking bouts of one signal, to the resolution of config.step_seconds.
+
+    Parameters
+    ----------
+    signal_data : array of float
+        Detector column of the recording (e.g. ML shank gyro).
+    config : BoutConfig, optional
+        Bout settings. The default is shank_gyro_bouts.
+    fs : float, optional
+        Sampling frequency of the signal (Hz). The default is 125.
+
+    Returns
+    -------
+    bouts : structured array
+        Start and stop sample of each bout, see bout_dtype.
+
+    """
+    step = max(int(round(config.step_seconds * fs)), 1)
+
+    with gait_profile.stage('bouts', sensor=config.sensor, samples=len(signal_data)):
+        walking = window_std(signal_data, config.window_seconds * fs, step) >= config.min_std
+
+        # runs of walking blocks, in samples
+        edges = np.diff(np.concatenate([[0], walking.astype(np.int8), [0]]))
+        starts = np.flatnonzero(edges == 1) * step
+        stops = np.minimum(np.flatnonzero(edges == -1) * step, len(signal_data))
+
+        # merge runs separated by short pauses, then drop short bouts
+        separate = starts[1:] - stops[:-1] > config.max_gap_seconds * fs
+        first = np.ones(len(starts), dtype=bool)
+        first[1:] = separate
+        last = np.ones(len(stops), dtype=bool)
+        last[:-1] = separate
+        starts = starts[first]
+        stops = stops[last]
+        keep = stops - starts >= config.min_bout_seconds * fs
+
+        bouts = np.empty(np.count_nonzero(keep), dtype=bout_dtype)
+        bouts['start'] = starts[keep]
+        bouts['stop'] = stops[keep]
+
+    return bouts
+
+
+#%% Detection on Bouts
+
+
+def _concat_events(parts):
+    """
+    Joins find_peaks tuples of several bouts, already shifted to recording indices.
+    """
+    if not parts:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, {'prominences': np.zeros(0), 'left_bases': empty, 'right_bases': empty}
+
+    return (np.concatenate([inds for inds, _ in parts]),
+            {name: np.concatenate([properties[name] for _, properties in parts]) for name in parts[0][1]})
+
+
+def _shift_events(inds, offset, start, stop):
+    """
+    Moves a find_peaks tuple of a slice starting at offset to recording indices and
+    keeps the events in [start, stop).
+    """
+    indices = inds[0] + offset
+    keep = (indices >= start) & (indices < stop)
+    properties = {name: values[keep] + offset if name.endswith('bases') else values[keep]
+                  for name, values in inds[1].items()}
+
+    return indices[keep], properties
+
+
+def detect_bout_events(data, config=gm.shank_gyro_config, bout_config=None):
+    """
+    Detects the walking bouts of a whole recording and runs the HS/TO detector on the
+    bouts only. The input data is not modified.
+
+    Parameters
+    ----------
+    data : DataFrame, samples x columns array or gait_data.Recording
+        Whole recording, column 0 is time (seconds), e.g. gait_io.load_recording(...,
+        crop_start_time=None, crop_stop_time=None).
+    config : DetectorConfig, optional
+        HS/TO detector settings. The default is gm.shank_gyro_config.
+    bout_config : BoutConfig, optional
+        Bout settings. The default is bout_configs[config.sensor].
+
+    Returns
+    -------
+    HS_inds : tuple of size 2
+        As signal.find_peaks, HS indices of the whole recording and their properties.
+    TO_inds : tuple of size 2
+        TO indices and properties.
+    bouts : structured array
+        Walking bouts, see bout_dtype.
+
+    """
+    if bout_config is None:
+        bout_config = bout_configs[config.sensor]
+
+    _, signal_data = gm._recording_arrays(data, config.column)
+    _, bout_signal = gm._recording_arrays(data, bout_config.column)
+    # bout lengths in samples at the detector rate
+    bouts = detect_bouts(bout_signal, bout_config, config.fs)
+    pad = int(round(bout_config.pad_seconds * config.fs))
+
+    HS_parts = []
+    TO_parts = []
+    for start, stop in bouts.tolist():
+        low, high = max(start - pad, 0), min(stop + pad, len(signal_data))
+        with gait_profile.stage('wavelet', sensor=config.sensor, samples=high - low):
+            HS_inds, TO_inds = gm.detect_events(signal_data[low:high], config.scale, config.prominence,
+                                                config.mother_wavelet)
+        HS_parts.append(_shift_events(HS_inds, low, start, stop))
+        TO_parts.append(_shift_events(TO_inds, low, start, stop))
+
+    return _concat_events(HS_parts), _concat_events(TO_parts), bouts
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line entry point of the gait event pipeline:
+    python gait_cli.py detect RawData/s1_shank_gyro.csv --sensor shank_gyro
+    python gait_cli.py metrics RawData/s1_shank_gyro.csv --sensor shank_gyro --summary
+    python gait_cli.py stats --store-dir results --update --subjects 1 2 3
+
+Only argparse is imported at startup, and each command imports the modules it needs
+when it runs. detect and metrics read one csv file with numpy and never load pandas,
+matplotlib or statsmodels; stats reads the result store (gait_store) and computes the
+agreement statistics (gait_stats). The same work is available as functions.
+"""
+
+#%% Import Libraries
+
+import argparse
+import sys
+
+
+#%% Define Parameters
+
+# sensors with a detector, see gait_batch.configs
+detector_sensors = ('chest_accel', 'shank_gyro')
+
+
+#%% Per-File Commands
+
+
+def _detector_config(sensor, config=None):
+    """
+    Returns config, or the default DetectorConfig of sensor if config is None.
+    """
+    import gait_metrics as gm
+
+    if config is not None:
+        return config
+
+    return {'chest_accel': gm.chest_accel_config, 'shank_gyro': gm.shank_gyro_config}[sensor]
+
+
+def read_recording(path, crop_start_time=None, crop_stop_time=None, fs=125, resample=False):
+    """
+    Reads the rows of one csv recording between crop_start_time and crop_stop_time
+    into a samples x columns array (column 0 is time), with the same load step as
+    gait_io.load_recording: the crop is converted to rows at the rate of the first
+    timestamps, and the rows are checked against fs and resampled only if asked.
+
+    Parameters
+    ----------
+    path : str
+        Path of the csv file (one header line).
+    crop_start_time : float, optional
+        Start of the section in seconds. The default is None (first row).
+    crop_stop_time : float, optional
+        End of the section in seconds. The default is None (last row).
+    fs : float, optional
+        Expected sampling frequency. The default is 125.
+    resample : bool, optional
+        Resample the rows to fs if they are at another rate or irregular, see
+        gait_preprocess.prepare_recording. The default is False.
+
+    Returns
+    -------
+    data : samples x columns array of float
+        Rows of the recording (on the new time grid if resampled).
+
+    """
+    import numpy as np
+
+    import gait_preprocess
+
+    head_time = None
+    if crop_start_time is not None or crop_stop_time is not None:
+        head_time = np.loadtxt(path, delimiter=',', skiprows=1, max_rows=gait_preprocess.rate_rows, usecols=0,
+                               ndmin=1)
+    start, stop = gait_preprocess.crop_rows(head_time, crop_start_time, crop_stop_time, fs)
+    data = np.loadtxt(path, delimiter=',', skiprows=1 + start, max_rows=None if stop is None else stop - start,
+                      ndmin=2)
+
+    return gait_preprocess.prepare_recording(data, fs, resample)[0]
+
+
+def detect_file(path, sensor, config=None, bouts=False, **read_kwargs):
+    """
+    Detects the HS and TO events of one csv recording.
+
+    Parameters
+    ----------
+    path : str
+        Path of the csv file.
+    sensor : str
+        'chest_accel' or 'shank_gyro'.
+    config : DetectorConfig, optional
+        Detector settings. The default is the config of sensor in gait_batch.configs.
+    bouts : bool, optional
+        Find the walking bouts first and detect on the bouts only (gait_bouts), in
+        place of a manual crop. The default is False.
+    **read_kwargs
+        Passed to read_recording (crop_start_time, crop_stop_time, fs, resample).
+
+    Returns
+    -------
+    data : samples x columns array of float
+        Rows of the recording (resampled rows if read_kwargs has resample=True).
+    HS : array of int
+        HS row indices in data.
+    TO : array of int
+        TO row indices.
+
+    """
+    import gait_metrics as gm
+
+    config = _detector_config(sensor, config)
+    # expected rate of the recording, the detector rate unless fs is given
+    fs = read_kwargs.pop('fs', config.fs)
+    data = read_recording(path, fs=fs, **read_kwargs)
+    if bouts:
+        import gait_bouts
+
+        HS_inds, TO_inds, _ = gait_bouts.detect_bout_events(data, config)
+    else:
+        HS_inds, TO_inds = gm.detect_sensor_events(data, config)
+
+    return data, gm._event_indices(HS_inds), gm._event_indices(TO_inds)
+
+
+def file_metrics(path, sensor, config=None, bouts=False, **read_kwargs):
+    """
+    Detects the events of one csv recording and pairs them into gait cycles.
+
+    Returns
+    -------
+    cycle_table : structured array
+        Cycles of the recording, see gm.paired_cycle_dtype.
+
+    """
+    import gait_metrics as gm
+
+    config = _detector_config(sensor, config)
+    _, HS, TO = detect_file(path, sensor, config, bouts, **read_kwargs)
+
+    return gm.pair_gait_events(HS, TO, fs=config.fs)
+
+
+#%% Statistics Command
+
+
+def store_agreement(store_dir='results', sensors=('shank_gyro', 'chest_accel'), subject_range=None, update=False,
+                    n_boot=1000, per_subject=False, **load_kwargs):
+    """
+    Computes the agreement of the cycles of two sensors from the result store.
+
+    Parameters
+    ----------
+    store_dir : str, optional
+        Folder of the result store. The default is 'results'.
+    sensors : tuple of str, optional
+        The two sensors to compare. The default is ('shank_gyro', 'chest_accel').
+    subject_range : iterable of int, optional
+        Subjects to use. The default is None (every subject in the store).
+    update : bool, optional
+        Bring the store up to date first (gait_store.update_store, needs subject_range).
+        The default is False.
+    n_boot : int, optional
+        Bootstrap resamples of the confidence intervals. The default is 1000.
+    per_subject : bool, optional
+        Also return one row per subject. The default is False (pooled rows only).
+    **load_kwargs
+        Passed to gait_io.load_recording by update_store (data_dir, crop_start_time, ...).
+
+    Returns
+    -------
+    agreement : structured array
+        Rows of gait_stats.cycle_agreement.
+    errors : dict
+        Tracebacks of the update, keyed by (subject, sensor).
+
+    """
+    import gait_stats
+    import gait_store
+
+    errors = {}
+    if update:
+        _, errors = gait_store.update_store(subject_range, sensors, store_dir, **load_kwargs)
+
+    # explicit configs, so reading the store does not import gait_batch (and pandas)
+    cycles_a, cycles_b = [gait_store.load_cycles(sensor, _detector_config(sensor), subject_range, store_dir)
+                          for sensor in sensors]
+    matched_a, matched_b = gait_stats.match_subject_cycles(cycles_a, cycles_b)
+
+    return gait_stats.cycle_agreement(matched_a, matched_b, n_boot=n_boot, per_subject=per_subject), errors
+
+
+#%% Output
+
+
+def _write_table(table, output=None):
+    """
+    Writes a structured array as csv to the file output, or to stdout if output is None.
+    """
+    formats = [{'b': '%d', 'i': '%d', 'f': '%.10g'}.get(table.dtype[name].kind, '%s') for name in table.dtype.names]
+    lines = [','.join(table.dtype.names)]
+    lines += [','.join(fmt % value for fmt, value in zip(formats, row)) for row in table.tolist()]
+
+    if output is None:
+        sys.stdout.write('\n'.join(lines) + '\n')
+        return
+
+    with open(output, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def _run_detect(args):
+    import numpy as np
+
+    data, HS, TO = detect_file(args.file, args.sensor, bouts=args.bouts, crop_start_time=args.start,
+                               crop_stop_time=args.stop, resample=args.resample)
+    table = np.zeros(len(HS) + len(TO), dtype=[('event', 'U2'), ('index', np.int64), ('time', np.float64)])
+    table['event'] = ['HS'] * len(HS) + ['TO'] * len(TO)
+    table['index'] = np.concatenate([HS, TO])
+    table['time'] = data[table['index'], 0]
+    _write_table(table[np.argsort(table['index'], kind='stable')], args.output)
+
+    return 0
+
+
+def _run_metrics(args):
+    import numpy as np
+
+    cycle_table = file_metrics(args.file, args.sensor, bouts=args.bouts, crop_start_time=args.start,
+                               crop_stop_time=args.stop, resample=args.resample)
+    _write_table(cycle_table, args.output)
+
+    if args.summary:
+        valid = cycle_table[cycle_table['valid']]
+        for name in ('stance', 'swing', 'stride'):
+            values = valid[name][np.isfinite(valid[name])]
+            print(f'{name}: {values.mean():.3f} +/- {values.std():.3f} s over {len(values)} cycles'
+                  if len(values) else f'{name}: no valid cycles', file=sys.stderr)
+
+    return 0
+
+
+def _run_stats(args):
+    load_kwargs = {} if args.data_dir is None else {'data_dir': args.data_dir}
+    agreement, errors = store_agreement(args.store_dir, tuple(args.sensors), args.subjects, args.update,
+                                        args.n_boot, args.per_subject, **load_kwargs)
+    for (subject, sensor), error in errors.items():
+        print(f'subject {subject} {sensor} failed:\n{error}', file=sys.stderr)
+
+    names = ('subject', 'metric', 'n', 'pearson_r', 'pearson_low', 'pearson_high', 'pearson_p', 'bias',
+             'loa_lower', 'loa_upper', 'icc')
+    _write_table(agreement[list(names)], args.output)
+
+    return 1 if errors else 0
+
+
+#%% Command Line
+
+
+def build_parser():
+    """
+    Returns the argument parser of the detect, metrics and stats commands.
+    """
+    parser = argparse.ArgumentParser(prog='gait-events', description='Detect gait events and compare sensors.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name, help_text in [('detect', 'print the HS and TO events of one csv recording'),
+                            ('metrics', 'print the gait cycles (stance, swing, stride) of one csv recording')]:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('file', help='csv recording, column 0 is time')
+        command.add_argument('--sensor', choices=detector_sensors, required=True)
+        command.add_argument('--start', type=float, default=None, help='crop start (seconds)')
+        command.add_argument('--stop', type=float, default=None, help='crop stop (seconds)')
+        command.add_argument('--bouts', action='store_true', help='detect only in the walking bouts found automatically')
+        command.add_argument('--resample', action='store_true', help='resample to the detector rate if needed')
+        command.add_argument('--output', default=None, help='csv file to write (default: stdout)')
+        if name == 'metrics':
+            command.add_argument('--summary', action='store_true', help='print mean durations to stderr')
+
+    command = commands.add_parser('stats', help='agreement of two sensors from the result store')
+    command.add_argument('--store-dir', default='results')
+    command.add_argument('--sensors', nargs=2, choices=detector_sensors, default=['shank_gyro', 'chest_accel'])
+    command.add_argument('--subjects', nargs='+', type=int, default=None,
+                         help='subject numbers (default: every subject in the store)')
+    command.add_argument('--update', action='store_true', help='update the store first (needs --subjects)')
+    command.add_argument('--data-dir', default=None, help='folder of the csv files for --update')
+    command.add_argument('--n-boot', type=int, default=1000, help='bootstrap resamples')
+    command.add_argument('--per-subject', action='store_true', help='also print one row per subject')
+    command.add_argument('--output', default=None, help='csv file to write (default: stdout)')
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'stats' and args.update and args.subjects is None:
+        parser.error('--update needs --subjects')
+
+    return {'detect': _run_detect, 'metrics': _run_metrics, 'stats': _run_stats}[args.command](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact containers for subject recordings, detected events and gait cycles.
+
+A Recording keeps the time column in float64 and the sensor axes as one contiguous
+float32 array (axes x samples), instead of a DataFrame of float64 columns. Events and
+Cycles keep int64 indices and float64 durations in named fields. The containers use
+__slots__, and every function here builds new arrays or views without modifying the
+DataFrames or arrays it is given.
+"""
+
+#%% Import Libraries
+
+from dataclasses import dataclass, replace
+
+import numpy as np
+import pandas as pd
+
+import gait_bouts
+import gait_io
+import gait_metrics as gm
+
+
+#%% Recordings
+
+
+@dataclass(frozen=True, eq=False)
+class Recording:
+    """
+    One sensor recording of one subject.
+
+    Attributes
+    ----------
+    subject : int
+        Subject number.
+    sensor : str
+        Data type, e.g. 'chest_accel'.
+    time : array of float64
+        Time of each sample (seconds).
+    values : 2D array of float32
+        Sensor axes x samples, each axis contiguous.
+    columns : tuple of str
+        Names of the time column and of each axis.
+    """
+    __slots__ = ('subject', 'sensor', 'time', 'values', 'columns')
+    subject: int
+    sensor: str
+    time: np.ndarray
+    values: np.ndarray
+    columns: tuple
+
+    @classmethod
+    def from_frame(cls, data, subject, sensor, dtype=np.float32):
+        """
+        Builds a recording from a DataFrame whose first column is time. The DataFrame
+        is not modified.
+        """
+        time_s = np.ascontiguousarray(data.iloc[:, 0], dtype=np.float64)
+        values = np.ascontiguousarray(np.asarray(data.iloc[:, 1:], dtype=dtype).T)
+
+        return cls(subject, sensor, time_s, values, tuple(str(column) for column in data.columns))
+
+    def __len__(self):
+        return len(self.time)
+
+    def column(self, index):
+        """
+        Returns one column as an array (no copy), numbered as in the csv files and
+        DetectorConfig.column: 0 is time, 1 to 3 are the axes.
+        """
+        if index == 0:
+            return self.time
+
+        return self.values[index - 1]
+
+    def to_frame(self):
+        """
+        Returns the recording as a DataFrame with the original column names.
+        """
+        data = pd.DataFrame(self.values.T, columns=list(self.columns[1:]))
+        data.insert(0, self.columns[0], self.time)
+
+        return data
+
+
+#%% Events and Cycles
+
+
+@dataclass(frozen=True, eq=False)
+class Events:
+    """
+    HS and TO sample indices of one recording.
+
+    Attributes
+    ----------
+    sensor : str
+        Data type the events were detected on.
+    HS : array of int64
+        HS indices, sorted.
+    TO : array of int64
+        TO indices, sorted.
+    """
+    __slots__ = ('sensor', 'HS', 'TO')
+    sensor: str
+    HS: np.ndarray
+    TO: np.ndarray
+
+    @classmethod
+    def from_detector(cls, sensor, HS_inds, TO_inds):
+        """
+        Builds the events from the find_peaks tuples (or index arrays) of the detectors.
+        """
+        return cls(sensor, np.sort(gm._event_indices(HS_inds)), np.sort(gm._event_indices(TO_inds)))
+
+    def times(self, recording):
+        """
+        Returns the HS and TO times (seconds) in recording.
+        """
+        return recording.time[self.HS], recording.time[self.TO]
+
+
+@dataclass(frozen=True, eq=False)
+class Cycles:
+    """
+    Gait cycles of one recording, one element per cycle in every field.
+
+    Attributes
+    ----------
+    HS : array of int64
+        HS starting each cycle.
+    TO : array of int64
+        TO of each cycle (-1 if none).
+    next_HS : array of int64
+        HS ending each cycle.
+    stance : array of float64
+        Stance time (seconds).
+    swing : array of float64
+        Swing time (seconds).
+    stride : array of float64
+        Stride time (seconds).
+    valid : array of bool
+        Cycles that passed the pairing checks.
+    """
+    __slots__ = ('HS', 'TO', 'next_HS', 'stance', 'swing', 'stride', 'valid')
+    HS: np.ndarray
+    TO: np.ndarray
+    next_HS: np.ndarray
+    stance: np.ndarray
+    swing: np.ndarray
+    stride: np.ndarray
+    valid: np.ndarray
+
+    @classmethod
+    def from_table(cls, cycle_table):
+        """
+        Builds the cycles from a cycle table of gm.pair_gait_events or gm.get_cycle_metrics.
+        Tables without a 'valid' field count every cycle as valid.
+        """
+        valid = cycle_table['valid'] if 'valid' in cycle_table.dtype.names else np.ones(len(cycle_table), bool)
+
+        return cls(*(np.ascontiguousarray(cycle_table[name]) for name in ('HS', 'TO', 'next_HS', 'stance',
+                                                                            'swing', 'stride')),
+                   np.ascontiguousarray(valid))
+
+    @classmethod
+    def from_events(cls, events, fs=125, **kwargs):
+        """
+        Pairs the events by time (see gm.pair_gait_events).
+        """
+        return cls.from_table(gm.pair_gait_events(events.HS, events.TO, fs=fs, **kwargs))
+
+    def __len__(self):
+        return len(self.HS)
+
+    def to_table(self):
+        """
+        Returns the cycles as a structured array, see gm.paired_cycle_dtype (n_TO is 1
+        for cycles with a TO and 0 otherwise).
+        """
+        cycle_table = np.zeros(len(self), dtype=gm.paired_cycle_dtype)
+        for name in ('HS', 'TO', 'next_HS', 'stance', 'swing', 'stride', 'valid'):
+            cycle_table[name] = getattr(self, name)
+        cycle_table['n_TO'] = self.TO >= 0
+
+        return cycle_table
+
+
+#%% Subjects
+
+
+@dataclass(frozen=True, eq=False)
+class SubjectData:
+    """
+    Recordings, events and cycles of one subject, keyed by sensor.
+    """
+    __slots__ = ('subject', 'recordings', 'events', 'cycles')
+    subject: int
+    recordings: dict
+    events: dict
+    cycles: dict
+
+
+def load_subject_data(subject, data_types=gait_io.data_types, dtype=np.float32, sensor_configs=None, **load_kwargs):
+    """
+    Loads every recording of one subject into Recording containers.
+
+    Parameters
+    ----------
+    subject : int
+        Subject number.
+    data_types : list of str, optional
+        Data types to load. The default is gait_io.data_types.
+    dtype : dtype, optional
+        Dtype of the sensor axes. The default is np.float32.
+    sensor_configs : dict, optional
+        DetectorConfig per data type. Data types with a config are loaded at config.fs,
+        the others at the fs of load_kwargs. The default is None.
+    **load_kwargs
+        Passed to gait_io.load_recording (data_dir, crop_start_time, crop_stop_time, fs,
+        resample, cache_dir).
+
+    Returns
+    -------
+    subject_data : SubjectData
+        Recordings of the subject, without events or cycles.
+
+    """
+    sensor_configs = sensor_configs or {}
+    recordings = {}
+    for file_type in data_types:
+        file_kwargs = dict(load_kwargs)
+        if file_type in sensor_configs:
+            file_kwargs['fs'] = sensor_configs[file_type].fs
+        recordings[file_type] = Recording.from_frame(gait_io.load_recording(subject, file_type, dtype=dtype,
+                                                                            **file_kwargs), subject, file_type, dtype)
+
+    return SubjectData(subject, recordings, {}, {})
+
+
+def detect_subject(subject_data, sensor_configs, bouts=False, **pairing_kwargs):
+    """
+    Detects the events of every configured sensor and pairs them into cycles.
+
+    Parameters
+    ----------
+    subject_data : SubjectData
+        Recordings of the subject. Not modified.
+    sensor_configs : dict
+        DetectorConfig per sensor, e.g. gait_batch.configs.
+    bouts : bool, optional
+        Detect only in the walking bouts of each recording (gait_bouts), for recordings
+        loaded whole. The default is False.
+    **pairing_kwargs
+        Passed to gm.pair_gait_events (e.g. stride_tolerance).
+
+    Returns
+    -------
+    subject_data : SubjectData
+        Copy of subject_data (sharing the recordings) with the events and cycles of
+        every sensor in sensor_configs.
+
+    """
+    events = dict(subject_data.events)
+    cycles = dict(subject_data.cycles)
+    for sensor, config in sensor_configs.items():
+        recording = subject_data.recordings[sensor]
+        if bouts:
+            HS_inds, TO_inds, _ = gait_bouts.detect_bout_events(recording, config)
+        else:
+            HS_inds, TO_inds = gm.detect_sensor_events(recording, config)
+        events[sensor] = Events.from_detector(sensor, HS_inds, TO_inds)
+        cycles[sensor] = Cycles.from_events(events[sensor], fs=config.fs, **pairing_kwargs)
+
+    return replace(subject_data, events=events, cycles=cycles)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fusion detector that uses every axis of every recorded sensor.
+
+All axes of all recordings are stacked into one (channels x samples) array and
+transformed in one batched FFT pass, each channel at the detection scale of its body
+location. Each channel's wavelet magnitude is standardized, shifted to line up with
+the reference channel (the column of the reference DetectorConfig) and weighted by
+its correlation with it, so channels that carry the same gait events reinforce each
+other, while noise axes and channels at another rhythm (the chest sees both feet)
+get no weight. HS and TO are the peaks and troughs of the fused trace, and the
+confidence of each event is the share of channel weight that has its own peak or
+trough there.
+
+With only the reference channel, the fused detector gives the same events as
+gm.detect_sensor_events with the reference config.
+"""
+
+#%% Import Libraries
+
+from dataclasses import dataclass
+
+import numpy as np
+from scipy import fft, signal
+
+import gait_data
+import gait_metrics as gm
+import gait_profile
+
+
+#%% Fusion Configuration
+
+
+@dataclass(frozen=True)
+class FusionConfig:
+    """
+    Settings of the fusion detector.
+
+    Attributes
+    ----------
+    reference : DetectorConfig
+        Detector whose channel the others are aligned and weighted against. Its
+        prominence is converted to the units of the fused trace.
+    sensor_scales : tuple of (str, int)
+        Scalogram row used for the channels of each sensor.
+    max_lag_seconds : float
+        Largest shift of a channel against the reference (seconds).
+    min_weight : float
+        Channels whose squared correlation with the reference is lower are ignored.
+    tolerance_seconds : float
+        Largest distance of a channel peak from a fused event that still supports it.
+    """
+    reference: gm.DetectorConfig = gm.shank_gyro_config
+    sensor_scales: tuple = (('chest_accel', gm.chest_accel_config.scale), ('chest_gyro', gm.chest_accel_config.scale),
+                            ('shank_accel', gm.shank_gyro_config.scale), ('shank_gyro', gm.shank_gyro_config.scale))
+    max_lag_seconds: float = 0.1
+    min_weight: float = 0.1
+    tolerance_seconds: float = 0.05
+
+    def scale(self, sensor):
+        """
+        Scalogram row of the channels of one sensor (the reference scale if not listed).
+        """
+        return dict(self.sensor_scales).get(sensor, self.reference.scale)
+
+
+fusion_config = FusionConfig()
+
+
+#%% Channel Stack
+
+
+def stack_channels(recordings):
+    """
+    Stacks every axis of every recording into one float32 array.
+
+    Parameters
+    ----------
+    recordings : dict
+        gait_data.Recording or DataFrame (column 0 is time) keyed by sensor. Recordings
+        of different lengths are cut to the shortest.
+
+    Returns
+    -------
+    stack : channels x samples array of float32
+        Axes of every recording, in the order of recordings.
+    channels : list of tuple
+        (sensor, column) of each row, column numbered as in DetectorConfig.column.
+    time_s : array of float
+        Time of each sample of the first recording (seconds).
+
+    """
+    recordings = {sensor: data if isinstance(data, gait_data.Recording) else
+                  gait_data.Recording.from_frame(data, None, sensor) for sensor, data in recordings.items()}
+    n = min(len(recording) for recording in recordings.values())
+
+    stack = np.concatenate([recording.values[:, :n] for recording in recordings.values()]).astype(np.float32)
+    channels = [(sensor, column) for sensor, recording in recordings.items()
+                for column in range(1, recording.values.shape[0] + 1)]
+
+    return stack, channels, next(iter(recordings.values())).time[:n]
+
+
+def wavelet_channels(stack, channel_scales, mother_wavelet=gm.morlet2):
+    """
+    Magnitude of the wavelet transform of every channel at its own scale, with one
+    batched FFT of the whole stack. Row c gives the same values as
+    gm.wavelet_scale(stack[c], channel_scales[c], mother_wavelet).
+
+    Parameters
+    ----------
+    stack : channels x samples array of float
+        Signals to transform.
+    channel_scales : array of int
+        Scalogram row of each channel.
+    mother_wavelet : function, optional
+        Mother wavelet. The default is gm.morlet2.
+
+    Returns
+    -------
+    magnitudes : channels x samples array of float
+        Wavelet magnitude of every channel.
+
+    """
+    n = stack.shape[1]
+    channel_scales = np.asarray(channel_scales)
+    kernels = {scale: gm.wavelet_kernel(scale, n, mother_wavelet) for scale in np.unique(channel_scales)}
+    n_fft = fft.next_fast_len(n + max(len(kernel) for kernel in kernels.values()) - 1)
+
+    spectra = fft.fft(stack.astype(np.float64), n_fft, axis=1)
+    magnitudes = np.empty(stack.shape)
+    for scale, kernel in kernels.items():
+        rows = np.flatnonzero(channel_scales == scale)
+        full = fft.ifft(spectra[rows] * fft.fft(kernel, n_fft), axis=1)
+        # same alignment as signal.convolve(..., mode='same')
+        start = (len(kernel) - 1) // 2
+        magnitudes[rows] = np.abs(full[:, start:start + n])
+
+    return magnitudes
+
+
+#%% Channel Fusion
+
+
+def _standardize(magnitudes):
+    """
+    Zero mean, unit standard deviation of every row (constant rows become zero).
+    """
+    centered = magnitudes - magnitudes.mean(axis=1, keepdims=True)
+    std = magnitudes.std(axis=1, keepdims=True)
+
+    return np.divide(centered, std, out=np.zeros_like(centered), where=std > 0), std[:, 0]
+
+
+def fuse_channels(magnitudes, reference, max_lag):
+    """
+    Aligns every standardized channel to the reference channel and weights it by its
+    correlation with it.
+
+    Parameters
+    ----------
+    magnitudes : channels x samples array of float
+        Wavelet magnitude of every channel.
+    reference : int
+        Row of the reference channel.
+    max_lag : int
+        Largest shift of a channel (samples).
+
+    Returns
+    -------
+    aligned : channels x samples array of float
+        Standardized channels, shifted by their lag and multiplied by the sign of
+        their correlation with the reference.
+    correlations : array of float
+        Correlation of each aligned channel with the reference (1 for the reference).
+    lags : array of int
+        Shift of each channel, a positive lag means the channel is late.
+    scales : array of float
+        Standard deviation of each channel's magnitude.
+
+    """
+    z, scales = _standardize(magnitudes)
+    n_channels, n = z.shape
+
+    # cross-correlation with the reference at the lags -max_lag..max_lag only, as one
+    # matrix product with the shifted copies of the reference (column j is lag max_lag - j)
+    padded = np.pad(z[reference], max_lag)
+    shifted = np.lib.stride_tricks.sliding_window_view(padded, 2 * max_lag + 1)[:n]
+    window = z @ shifted / n
+    lag_range = max_lag - np.arange(2 * max_lag + 1)
+
+    best = np.argmax(np.abs(window), axis=1)
+    lags = lag_range[best]
+    correlations = window[np.arange(n_channels), best]
+    lags[reference] = 0
+    correlations[reference] = 1.0
+
+    aligned = np.empty_like(z)
+    for c in range(n_channels):
+        # shift back by the lag, repeating the edge value
+        inds = np.clip(np.arange(n) + lags[c], 0, n - 1)
+        aligned[c] = np.sign(correlations[c]) * z[c, inds]
+
+    return aligned, np.abs(correlations), lags, scales
+
+
+def _support(channel_events, events, tolerance):
+    """
+    Returns True for each event that has a channel event within tolerance samples.
+    """
+    if len(channel_events) == 0 or len(events) == 0:
+        return np.zeros(len(events), dtype=bool)
+
+    right = np.clip(np.searchsorted(channel_events, events), 1, max(len(channel_events) - 1, 1))
+    nearest = np.minimum(np.abs(channel_events[right - 1] - events),
+                         np.abs(channel_events[np.minimum(right, len(channel_events) - 1)] - events))
+
+    return nearest <= tolerance
+
+
+#%% Fusion Detector
+
+
+def detect_fused_events(recordings, config=fusion_config, min_confidence=0.0, return_diagnostics=False):
+    """
+    Detects HS and TO from every axis of every recording of one subject.
+
+    Parameters
+    ----------
+    recordings : dict
+        gait_data.Recording or DataFrame keyed by sensor, e.g. subject_data.recordings.
+        Must include config.reference.sensor. Not modified.
+    config : FusionConfig, optional
+        Fusion settings. The default is fusion_config (shank gyro reference).
+    min_confidence : float, optional
+        Events with a lower confidence are dropped. The default is 0 (keep all).
+    return_diagnostics : bool, optional
+        Also return a dict with the channels, weights, lags and the fused trace.
+        The default is False.
+
+    Returns
+    -------
+    HS_inds : tuple of size 2
+        As signal.find_peaks: HS indices and properties, with a 'confidence' array
+        (share of channel weight with a peak within tolerance_seconds).
+    TO_inds : tuple of size 2
+        TO indices and properties, with a 'confidence' array.
+    diagnostics : dict
+        Only returned if return_diagnostics is True.
+
+    """
+    reference = config.reference
+    stack, channels, time_s = stack_channels(recordings)
+    if (reference.sensor, reference.column) not in channels:
+        raise ValueError(f'no {reference.sensor} column {reference.column} in the recordings')
+    reference_channel = channels.index((reference.sensor, reference.column))
+
+    with gait_profile.stage('fusion_wavelet', channels=len(channels), samples=stack.shape[1]):
+        magnitudes = wavelet_channels(stack, [config.scale(sensor) for sensor, _ in channels],
+                                      reference.mother_wavelet)
+
+    with gait_profile.stage('fusion_combine', channels=len(channels)):
+        aligned, correlations, lags, scales = fuse_channels(magnitudes, reference_channel,
+                                                            int(round(config.max_lag_seconds * reference.fs)))
+        weights = np.where(correlations ** 2 >= config.min_weight, correlations ** 2, 0.0)
+        fused = weights @ aligned / weights.sum()
+
+    # the reference prominence in the standardized units of the fused trace
+    prominence = reference.prominence / scales[reference_channel] if scales[reference_channel] > 0 else np.inf
+    with gait_profile.stage('find_peaks', sensor='fusion'):
+        HS_inds, TO_inds = gm.find_wavelet_events(fused, prominence)
+
+    # confidence: weight of the channels with their own peak / trough at each event
+    tolerance = config.tolerance_seconds * reference.fs
+    used = np.flatnonzero(weights)
+    for inds, sign in [(HS_inds, 1), (TO_inds, -1)]:
+        support = np.zeros(len(inds[0]))
+        for c in used:
+            channel_events = signal.find_peaks(sign * aligned[c], prominence=prominence)[0]
+            support += weights[c] * _support(channel_events, inds[0], tolerance)
+        inds[1]['confidence'] = support / weights.sum()
+
+    if min_confidence > 0:
+        HS_inds, TO_inds = [_select(inds, inds[1]['confidence'] >= min_confidence) for inds in (HS_inds, TO_inds)]
+
+    if not return_diagnostics:
+        return HS_inds, TO_inds
+
+    diagnostics = {'sensor': reference.sensor, 'time': time_s, 'signal': stack[reference_channel],
+                   'scale': reference.scale, 'cwt_row': magnitudes[reference_channel], 'fused': fused,
+                   'channels': channels, 'weights': weights, 'lags': lags, 'correlations': correlations}
+
+    return HS_inds, TO_inds, diagnostics
+
+
+def _select(inds, keep):
+    """
+    Keeps the events (and their properties) of a find_peaks tuple where keep is True.
+    """
+    return inds[0][keep], {name: values[keep] for name, values in inds[1].items()}
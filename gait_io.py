@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Loading of the subject recordings in RawData/s{subject}_{file_type}.csv.
+"""
+
+#%% Import Libraries
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import gait_preprocess
+import gait_profile
+
+
+#%% Define Parameters
+
+data_dir = 'RawData'    # folder with the subject csv files
+fs = 125    # sampling frequency
+data_types = ['chest_accel', 'chest_gyro', 'shank_accel', 'shank_gyro'] # types of data collected for each subject
+crop_start_time = 60 # seconds
+crop_stop_time = 75  # seconds
+cache_dir = None    # folder of the binary cache, None reads the csv files every time
+
+
+#%% File Paths
+
+
+def get_file_path(subject, file_type, data_dir=data_dir):
+    """
+    Returns the path of the csv file of one subject and data type.
+    """
+    return os.path.join(data_dir, f's{subject}_{file_type}.csv')
+
+
+def _column_dtypes(file_path, dtype):
+    """
+    Expands a single dtype to a per-column dict that keeps the time column in float64,
+    since timestamps lose precision in float32. Dicts and None are returned unchanged.
+    """
+    if dtype is None or isinstance(dtype, dict):
+        return dtype
+
+    # only the header line is parsed
+    columns = pd.read_csv(file_path, nrows=0).columns
+    column_dtypes = {column: dtype for column in columns[1:]}
+    column_dtypes[columns[0]] = np.float64
+
+    return column_dtypes
+
+
+#%% Binary Cache
+
+
+def _dtype_key(dtype):
+    """
+    Returns the requested dtypes as a string that does not depend on dict order.
+    """
+    if isinstance(dtype, dict):
+        return str(sorted((column, np.dtype(column_dtype).str) for column, column_dtype in dtype.items()))
+
+    return str(dtype if dtype is None else np.dtype(dtype).str)
+
+
+def _cache_group(file_path, dtype):
+    """
+    Returns a key shared by every version (size, mtime) of one source file read with
+    the same dtypes, so a new version replaces only the entries of its own group.
+    """
+    source = f'{os.path.abspath(file_path)}|{_dtype_key(dtype)}'
+
+    return hashlib.sha1(source.encode()).hexdigest()[:8]
+
+
+def _cache_key(file_path, dtype):
+    """
+    Returns a key that changes whenever the source file (path, size, mtime) or the
+    requested dtypes change.
+    """
+    stat = os.stat(file_path)
+    source = f'{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{_dtype_key(dtype)}'
+
+    return hashlib.sha1(source.encode()).hexdigest()[:16]
+
+
+def _write_cache(file_path, entry_dir, dtype):
+    """
+    Parses the csv file once and writes every column to its own .npy file in entry_dir.
+    The entry is written to a temporary folder and renamed, so concurrent workers never
+    see a half written entry.
+    """
+    with gait_profile.stage('read_csv', file=file_path):
+        data_file = pd.read_csv(file_path, dtype=_column_dtypes(file_path, dtype))
+
+    tmp_dir = f'{entry_dir}.tmp{os.getpid()}'
+    os.makedirs(tmp_dir, exist_ok=True)
+    for i, column in enumerate(data_file.columns):
+        np.save(os.path.join(tmp_dir, f'{i}.npy'), data_file[column].to_numpy())
+    with open(os.path.join(tmp_dir, 'columns.json'), 'w') as f:
+        json.dump([str(column) for column in data_file.columns], f)
+
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # another process wrote the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_cached(file_path, cache_dir, dtype=None):
+    """
+    Loads a whole recording from the binary cache, converting the csv file on first use.
+    Entries are keyed on the source path, size and mtime, so an edited csv file is
+    converted again and its old entry (same path and dtypes) removed. Entries of the
+    same file with other dtypes are kept.
+
+    Each column is stored as its own .npy file and memory-mapped, so the DataFrame and
+    its columns are views of the cache files (no parsing and no copy).
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the csv file.
+    cache_dir : str
+        Folder of the cache. Created if needed.
+    dtype : dtype or dict, optional
+        Column dtypes, as for load_recording. Part of the key. The default is None.
+
+    Returns
+    -------
+    data_file : DataFrame
+        Whole recording, backed by read-only memory maps.
+
+    """
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    group = f'{stem}-{_cache_group(file_path, dtype)}-'
+    entry_dir = os.path.join(cache_dir, f'{group}{_cache_key(file_path, dtype)}')
+
+    if not os.path.isdir(entry_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        # drop entries of older versions of this file with the same dtypes
+        for name in os.listdir(cache_dir):
+            if name.startswith(group) and '.tmp' not in name:
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        _write_cache(file_path, entry_dir, dtype)
+
+    with open(os.path.join(entry_dir, 'columns.json')) as f:
+        columns = json.load(f)
+    data = {column: np.load(os.path.join(entry_dir, f'{i}.npy'), mmap_mode='r')
+            for i, column in enumerate(columns)}
+
+    return pd.DataFrame(data, copy=False)
+
+
+def build_cache(subject_range, data_types=data_types, data_dir=data_dir, cache_dir=None, dtype=None):
+    """
+    Converts the csv files of every subject and data type to the binary cache ahead of
+    time. cache_dir defaults to {data_dir}/cache.
+
+    Returns
+    -------
+    paths : list of str
+        Csv files that are now cached.
+
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(data_dir, 'cache')
+
+    paths = []
+    for subject in subject_range:
+        for file_type in data_types:
+            file_path = get_file_path(subject, file_type, data_dir)
+            load_cached(file_path, cache_dir, dtype)
+            paths.append(file_path)
+
+    return paths
+
+
+#%% Load Recordings
+
+
+def load_recording(subject, file_type, data_dir=data_dir, crop_start_time=crop_start_time,
+                   crop_stop_time=crop_stop_time, fs=fs, resample=False, dtype=None, cache_dir=cache_dir):
+    """
+    Loads the walking section of one recording. This is the load step shared by every
+    entry point (gait_batch, gait_store, gait_plots reports, gait_data and
+    gait_pipeline):
+
+    1. The sampling rate is inferred from the timestamps of the first rows
+       (gait_preprocess.rate_rows).
+    2. The crop times are converted to rows at that rate (see gait_preprocess.crop_rows).
+       Rows before crop_start_time are skipped without being converted and reading
+       stops at crop_stop_time, so only the cropped rows are parsed.
+    3. The section is checked against fs and, only if resample is True, resampled to fs
+       (see gait_preprocess.prepare_recording).
+
+    Parameters
+    ----------
+    subject : int
+        Subject number.
+    file_type : str
+        One of data_types.
+    data_dir : str, optional
+        Folder with the csv files. The default is 'RawData'.
+    crop_start_time : float, optional
+        Start of the walking section in seconds. None reads from the first row. The default is 60.
+    crop_stop_time : float, optional
+        End of the walking section in seconds. None reads to the last row. The default is 75.
+    fs : float, optional
+        Expected sampling frequency, e.g. DetectorConfig.fs. The default is 125.
+    resample : bool, optional
+        Resample the section to fs if it is recorded at another rate or its timestamps
+        are irregular. If False, a recording at another rate raises ValueError and the
+        rows are returned as recorded. The default is False.
+    dtype : dtype or dict, optional
+        Column dtypes. A single dtype (e.g. np.float32) is applied to the sensor columns
+        and the time column is kept in float64. A dict is passed to pd.read_csv as is.
+        The default is None (float64 for every column).
+    cache_dir : str, optional
+        Folder of the binary cache (see load_cached). The default is the module level
+        cache_dir, None reads the csv file.
+
+    Returns
+    -------
+    cropped_data_file : DataFrame
+        Rows of the recording between crop_start_time and crop_stop_time, with a
+        RangeIndex starting at the first cropped row. If it was resampled, the rows of
+        the new time grid, with a RangeIndex starting at 0.
+
+    """
+    file_path = get_file_path(subject, file_type, data_dir)
+
+    if cache_dir is not None:
+        # slicing the memory-mapped recording reads only the cropped rows
+        with gait_profile.stage('load_cached', file=file_path):
+            data_file = load_cached(file_path, cache_dir, dtype)
+            head_time = data_file.iloc[:gait_preprocess.rate_rows, 0]
+            start, stop = gait_preprocess.crop_rows(head_time, crop_start_time, crop_stop_time, fs)
+            cropped_data_file = data_file.iloc[start:stop]
+    else:
+        with gait_profile.stage('read_csv', file=file_path):
+            # rows of the crop (header is line 0 of the file)
+            head_time = None
+            if crop_start_time is not None or crop_stop_time is not None:
+                head_time = pd.read_csv(file_path, usecols=[0], nrows=gait_preprocess.rate_rows).iloc[:, 0]
+            start, stop = gait_preprocess.crop_rows(head_time, crop_start_time, crop_stop_time, fs)
+            nrows = None if stop is None else stop - start
+            cropped_data_file = pd.read_csv(file_path, skiprows=range(1, start + 1), nrows=nrows,
+                                            dtype=_column_dtypes(file_path, dtype))
+
+        # same index as data_file.iloc[start:stop]
+        cropped_data_file.index = pd.RangeIndex(start, start + len(cropped_data_file))
+
+    with gait_profile.stage('prepare_recording', file=file_path):
+        prepared, _ = gait_preprocess.prepare_recording(cropped_data_file, fs, resample)
+
+    if prepared is cropped_data_file:
+        return cropped_data_file
+
+    # resampled in float64, back to the requested dtypes
+    return prepared.astype(cropped_data_file.dtypes.to_dict())
+
+
+def load_subject(subject, data_types=data_types, **load_kwargs):
+    """
+    Loads the walking section of every data type of one subject.
+
+    Parameters
+    ----------
+    subject : int
+        Subject number.
+    data_types : list of str, optional
+        Data types to load. The default is all four.
+    **load_kwargs
+        Passed to load_recording (data_dir, crop_start_time, crop_stop_time, fs, resample, dtype,
+        cache_dir).
+
+    Returns
+    -------
+    subject_data : dict
+        DataFrame of each data type, keyed by data type.
+
+    """
+    return {file_type: load_recording(subject, file_type, **load_kwargs) for file_type in data_types}
+
+
+#%% Long Recordings
+
+
+def iter_recording(subject, file_type, column, chunk_rows=125*3600, data_dir=data_dir, dtype=None,
+                   cache_dir=cache_dir):
+    """
+    Yields one column of a whole recording in consecutive blocks, for the chunked
+    detection mode (gait_stream.detect_chunks). Only one block is in memory at a time.
+
+    Parameters
+    ----------
+    subject : int
+        Subject number.
+    file_type : str
+        One of data_types.
+    column : int
+        Column to read (e.g. DetectorConfig.column).
+    chunk_rows : int, optional
+        Rows per block. The default is one hour at 125 Hz.
+    data_dir : str, optional
+        Folder with the csv files. The default is 'RawData'.
+    dtype : dtype, optional
+        Dtype of the column. The default is None (float64).
+    cache_dir : str, optional
+        Folder of the binary cache. If given, blocks are slices of the memory-mapped
+        column. The default is the module level cache_dir.
+
+    Yields
+    ------
+    block : array of float
+        Next chunk_rows values of the column.
+
+    """
+    file_path = get_file_path(subject, file_type, data_dir)
+
+    if cache_dir is not None:
+        signal_data = load_cached(file_path, cache_dir, dtype).iloc[:, column].to_numpy()
+        for start in range(0, len(signal_data), chunk_rows):
+            yield signal_data[start:start + chunk_rows]
+        return
+
+    for block in pd.read_csv(file_path, usecols=[column], chunksize=chunk_rows, dtype=dtype):
+        yield block.iloc[:, 0].to_numpy()
@@ -8,27 +8,158 @@ Created on Thu Apr 13 21:06:32 2023
 
 #%% Import Libraries
 
+from dataclasses import dataclass
+from functools import lru_cache
+
 import numpy as np
-from matplotlib import pyplot as plt
-from scipy import signal
+from scipy import fft, signal
 
+import gait_profile
 
-#%% Detect HS and TOs from Cranial-Caudal Chest Acceleration
 
+#%% Mother Wavelet
+
+
+def morlet2(M, s, w=5.0):
+    """
+    Complex Morlet wavelet with the same values as scipy.signal.morlet2, which SciPy
+    deprecated in 1.12 and removed in 1.15.
+
+    Parameters
+    ----------
+    M : int
+        Length of the wavelet.
+    s : float
+        Width of the wavelet.
+    w : float, optional
+        Omega0 of the wavelet. The default is 5.
 
-def get_chest_accel_events(data_chest_accel, subject_id):
+    Returns
+    -------
+    morlet : array of complex
+        Wavelet of length M.
+
+    """
+    x = np.arange(0, M) - (M - 1.0) / 2
+    x = x / s
+    wavelet = np.exp(1j * w * x) * np.exp(-0.5 * x**2) * np.pi**(-0.25)
     
+    return np.sqrt(1/s) * wavelet
+
+
+#%% Single-Scale Wavelet Engine
+
+# widths used for the scalograms; row `scale` of the transform has width scales[scale]
+scales = np.arange(1,65)
+
+
+@lru_cache(maxsize=256)
+def _cached_kernel(width, N, mother_wavelet):
     """
-    This function uses wavelet transformation to identify indices that indicate
-    heal strike and toe off events from chest acceleration walking data.
+    Builds the kernel of one width and length once, later calls reuse the read-only array.
+    """
+    wavelet_data = np.conj(mother_wavelet(N, width)[::-1])
+    wavelet_data.setflags(write=False)
+    
+    return wavelet_data
+
+
+def wavelet_kernel(scale, signal_length, mother_wavelet=morlet2):
+    """
+    Returns the convolution kernel signal.cwt uses for one row of the scalogram.
+    The kernel is 10 widths long, or as long as the signal if that is shorter.
+    Kernels are built once per width and length and shared by every later call.
 
     Parameters
     ----------
-    data_chest_accel : length of sample x 4 Array of float
-        Column 1: Time (seconds)
-        Column 2: Accel_x(g), Anterior-Posterior
-        Column 3: Accel_y (g), Cranial-Caudal
-        Column 4: Accel_z (g), Medial - Lateral 
+    scale : int
+        Row of the scalogram (width = scales[scale]).
+    signal_length : int
+        Length of the signal that will be convolved.
+    mother_wavelet : function, optional
+        Mother wavelet. The default is morlet2.
+
+    Returns
+    -------
+    wavelet_data : array of complex
+        Time reversed, conjugated wavelet.
+
+    """
+    width = int(scales[scale])
+    N = min(10 * width, int(signal_length))
+    
+    return _cached_kernel(width, N, mother_wavelet)
+
+
+def wavelet_scale(signal_data, scale, mother_wavelet=morlet2):
+    """
+    Computes the magnitude of a single row of the continuous wavelet transform.
+    Gives the same values as abs(signal.cwt(signal_data, mother_wavelet, widths=scales))[scale, :]
+    without convolving the other 63 widths.
+
+    Parameters
+    ----------
+    signal_data : array of float
+        Signal to transform.
+    scale : int
+        Row of the scalogram to compute (width = scales[scale]).
+    mother_wavelet : function, optional
+        Mother wavelet, called as mother_wavelet(M, width). The default is morlet2.
+
+    Returns
+    -------
+    cwt_row : array of float
+        Magnitude of the wavelet transform at the requested scale, same length as signal_data.
+
+    """
+    signal_data = np.asarray(signal_data)
+    wavelet_data = wavelet_kernel(scale, len(signal_data), mother_wavelet)
+    
+    # signal.convolve chooses FFT or direct convolution from the signal and kernel length
+    return abs(signal.convolve(signal_data, wavelet_data, mode='same'))
+
+
+def find_wavelet_events(cwt_row, prominence=0.19):
+    """
+    Picks HS and TO events from one row of the wavelet magnitude.
+    HS are the peaks and TO are the troughs of the row.
+
+    Parameters
+    ----------
+    cwt_row : array of float
+        Magnitude of the wavelet transform at the detection scale.
+    prominence : float, optional
+        Required prominence of peaks and troughs. The default is 0.19.
+
+    Returns
+    -------
+    HS_inds : tuple of size 2
+        Output of signal.find_peaks for the HS events.
+    TO_inds : tuple of size 2
+        Output of signal.find_peaks for the TO events.
+
+    """
+    HS_inds = signal.find_peaks(cwt_row, prominence = prominence)
+    TO_inds = signal.find_peaks(-cwt_row, prominence = prominence)
+    
+    return HS_inds, TO_inds
+
+
+def detect_events(signal_data, scale, prominence=0.19, mother_wavelet=morlet2):
+    """
+    Detects HS and TO events by computing only the wavelet scale used for peak picking.
+    Returns the same indices as running find_peaks on a row of the full 64-scale scalogram.
+
+    Parameters
+    ----------
+    signal_data : array of float
+        Signal to analyze (e.g. CC chest accel or ML shank gyro).
+    scale : int
+        Row of the scalogram used for peak picking (20 for chest accel, 25 for shank gyro).
+    prominence : float, optional
+        Required prominence of peaks and troughs. The default is 0.19.
+    mother_wavelet : function, optional
+        Mother wavelet. The default is morlet2.
 
     Returns
     -------
@@ -38,111 +169,400 @@ def get_chest_accel_events(data_chest_accel, subject_id):
         First tuple element is array of int representing the indices where TO is detected.
 
     """
-    scale = 20
+    cwt_row = wavelet_scale(signal_data, scale, mother_wavelet)
     
-    # Detect HSs
+    return find_wavelet_events(cwt_row, prominence)
+
+
+def scalogram(signal_data, mother_wavelet=morlet2, dtype=np.float32):
+    """
+    Computes the magnitude of the full 64-scale wavelet transform with cwt. Only needed
+    for the contour plots in gait_plots, detection uses wavelet_scale.
+
+    Parameters
+    ----------
+    signal_data : array of float
+        Signal to transform.
+    mother_wavelet : function, optional
+        Mother wavelet. The default is morlet2.
+    dtype : dtype, optional
+        Precision of the transform, see cwt. The default is np.float32.
+
+    Returns
+    -------
+    cwt : len(scales) x len(signal_data) array of float
+        Magnitude of the wavelet transform at every scale.
+
+    """
+    with gait_profile.stage('scalogram', samples=len(signal_data)):
+        return cwt(signal_data, mother_wavelet=mother_wavelet, dtype=dtype)
+
+
+#%% Batched Scalogram Engine
+
+# rows of the scalogram transformed together, which bounds the complex intermediate
+# arrays of cwt to _cwt_block_size rows
+_cwt_block_size = 8
+
+
+def _block_spectra(rows, signal_length, n_fft, mother_wavelet, dtype, workers=None):
+    """
+    FFT of the kernels of one block of rows, built when the block is transformed so
+    that no kernel spectra are kept between blocks or calls. Each kernel is rolled so
+    that sample 0 of the circular convolution is sample 0 of
+    signal.convolve(..., mode='same').
+    """
+    padded = np.zeros((len(rows), n_fft), dtype=dtype)
+    for i, scale in enumerate(rows):
+        wavelet_data = wavelet_kernel(scale, signal_length, mother_wavelet)
+        offset = (len(wavelet_data) - 1) // 2
+        padded[i, :len(wavelet_data) - offset] = wavelet_data[offset:]
+        padded[i, n_fft - offset:] = wavelet_data[:offset]
+    
+    return fft.fft(padded, axis=1, overwrite_x=True, workers=workers)
+
+
+def cwt_blocks(signal_data, rows=None, mother_wavelet=morlet2, magnitude=True, dtype=np.float32, workers=None):
+    """
+    Yields the rows of the continuous wavelet transform a block of _cwt_block_size
+    rows at a time, so a caller that reduces each block (e.g. pools it for a figure)
+    never holds the whole transform. The signal is transformed once; the kernel
+    spectra of each block are computed with the block. Parameters as for cwt.
+
+    Yields
+    ------
+    start : int
+        Position in rows of the first row of the block.
+    block : block rows x len(signal_data) array
+        Magnitude (dtype) or complex transform of the rows of the block.
+
+    """
+    signal_data = np.asarray(signal_data)
+    rows = tuple(range(len(scales))) if rows is None else tuple(int(row) for row in rows)
+    real_dtype = np.dtype(dtype)
+    complex_dtype = np.result_type(real_dtype, np.complex64)
+    n = len(signal_data)
+    
+    # long enough that the longest kernel does not wrap around
+    n_fft = fft.next_fast_len(n + max(len(wavelet_kernel(row, n, mother_wavelet)) for row in rows) - 1)
+    spectrum = fft.fft(signal_data.astype(real_dtype, copy=False), n_fft, workers=workers)
+    
+    for start in range(0, len(rows), _cwt_block_size):
+        block = _block_spectra(rows[start:start + _cwt_block_size], n, n_fft, mother_wavelet, complex_dtype, workers)
+        block *= spectrum
+        block = fft.ifft(block, axis=1, overwrite_x=True, workers=workers)[:, :n]
+        yield start, np.abs(block) if magnitude else block
+
+
+def cwt(signal_data, rows=None, mother_wavelet=morlet2, magnitude=True, dtype=np.float32, workers=None):
+    """
+    Computes rows of the continuous wavelet transform with one FFT of the signal, which
+    is multiplied by the spectra of the row kernels and inverse transformed a block of
+    rows at a time (see cwt_blocks). Gives the same values as
+    signal.cwt(signal_data, mother_wavelet, widths=scales)[rows] (up to the precision
+    of dtype), which convolves one width at a time in complex128.
+
+    Parameters
+    ----------
+    signal_data : array of float
+        Signal to transform.
+    rows : iterable of int, optional
+        Rows of the scalogram to compute (width = scales[row]). The default is None (all 64).
+    mother_wavelet : function, optional
+        Mother wavelet, called as mother_wavelet(M, width). The default is morlet2.
+    magnitude : bool, optional
+        Return the magnitude. Each block is reduced to its magnitude as soon as it is
+        transformed, so the complex transform of all rows is never stored.
+        The default is True.
+    dtype : dtype, optional
+        np.float32 (complex64 arithmetic) or np.float64 (complex128). The default is np.float32.
+    workers : int, optional
+        Threads used by scipy.fft. The default is None (one thread).
+
+    Returns
+    -------
+    cwt : len(rows) x len(signal_data) array
+        Magnitude (dtype) or complex transform (complex64 or complex128) of every row.
+
+    """
+    rows = None if rows is None else tuple(rows)
+    real_dtype = np.dtype(dtype)
+    output = np.empty((len(scales) if rows is None else len(rows), len(signal_data)),
+                      dtype=real_dtype if magnitude else np.result_type(real_dtype, np.complex64))
+    for start, block in cwt_blocks(signal_data, rows, mother_wavelet, magnitude, dtype, workers):
+        output[start:start + len(block)] = block
+    
+    return output
+
+
+#%% Detector Configuration
+
+
+@dataclass(frozen=True)
+class DetectorConfig:
+    """
+    Settings of one HS/TO detector. Configs are immutable and hashable, and the wavelet
+    kernel of a config is built once and reused for every subject and call.
+
+    Attributes
+    ----------
+    sensor : str
+        Data type the detector runs on, e.g. 'chest_accel'.
+    column : int
+        Column of the recording with the signal (0 is time).
+    scale : int
+        Row of the scalogram used for peak picking (width = scales[scale]).
+    prominence : float
+        Required prominence of the wavelet peaks and troughs.
+    fs : float
+        Sampling frequency (Hz).
+    mother_wavelet : function
+        Mother wavelet, called as mother_wavelet(M, width).
+    """
+    sensor: str
+    column: int
+    scale: int
+    prominence: float = 0.19
+    fs: float = 125
+    mother_wavelet: object = morlet2
     
-    # Step 1: Define your data (time and linear acceleration)
-    time_chest = data_chest_accel.iloc[:, 0] # time array from dictionary -- already in s
-    signal_accel = data_chest_accel.iloc[:, 2]     # cranial-caudal chest accel (y-direction)
+    @property
+    def width(self):
+        """
+        Width of the wavelet at the detection scale (samples).
+        """
+        return int(scales[self.scale])
     
-    # check for match
-    data_chest_accel.set_index(time_chest, inplace=True)
+    @property
+    def width_seconds(self):
+        """
+        Width of the wavelet at the detection scale (seconds).
+        """
+        return self.width / self.fs
     
-    # If you want to check the sampling freq:
-    time_s = time_chest  
-    dt = np.mean(np.diff(time_s)) # calculate the time difference 
-    fs = 1/dt            # calculate the sampling frequency 
+    @classmethod
+    def from_width_seconds(cls, sensor, column, width_seconds, fs=125, **kwargs):
+        """
+        Builds a config whose detection scale is given in seconds, rounded to the nearest
+        width in samples at fs.
+        """
+        width = int(np.clip(round(width_seconds * fs), scales[0], scales[-1]))
+        
+        return cls(sensor, column, int(np.flatnonzero(scales == width)[0]), fs=fs, **kwargs)
     
-    # for a better wavelet analysis, use only walking data. So either crop data here or when it is imported
-    plt.figure(subject_id, clear=True)
-    plt.plot(time_chest, signal_accel, label='raw_data')
-    plt.title(f'Chest Accel - Subject {subject_id}')
-    plt.ylabel('CC Accel. (g)')
-    plt.xlabel('Time (seconds)')
+    def kernel(self, signal_length):
+        """
+        Returns the (cached) convolution kernel for a signal of this length.
+        """
+        return wavelet_kernel(self.scale, signal_length, self.mother_wavelet)
+
+
+# cranial-caudal chest accel (y-direction), scale 20
+chest_accel_config = DetectorConfig('chest_accel', column=2, scale=20)
+# medial-lateral shank gyro, scale 25
+shank_gyro_config = DetectorConfig('shank_gyro', column=3, scale=25)
+
+
+def _recording_arrays(data, column):
+    """
+    Returns the time column and one signal column of a recording as arrays, from a
+    DataFrame or a samples x columns array (column 0 is time) or a gait_data.Recording,
+    without copying.
+    """
+    if isinstance(data, np.ndarray):
+        return data[:, 0], data[:, column]
     
-    # Step 2: Define a mother wavelet
-    mother_wavelet = signal.morlet2
+    import gait_data
     
-    # Step 3: Define a scale
-    scales = np.arange(1,65)  # range of scales (20)
+    if isinstance(data, gait_data.Recording):
+        return data.column(0), data.column(column)
     
-    # Step 4: Apply Cont. Wavelet Transformation
-    cwt_hs = abs(signal.cwt(signal_accel, mother_wavelet, widths=scales))   
- 
-    # Step 5: Plot Contour Plot to determine which scale is best 
-    fig_hs, ax_hs = plt.subplots()  
-    ax_hs.clear()
-    im_hs = ax_hs.contourf(np.arange(len(signal_accel)), scales, cwt_hs, cmap='viridis')
-    ax_hs.set_ylabel('Scale')
-    ax_hs.set_xlabel('Data Point')
-    ax_hs.set_title(f'Contour Plot for Accel Heel Strikes - Subject {subject_id}')
-    fig_hs.colorbar(im_hs)
-    fig_hs.tight_layout()
+    return np.asarray(data.iloc[:, 0]), np.asarray(data.iloc[:, column])
+
+
+def detect_sensor_events(data, config, return_diagnostics=False, chunk_size=None):
+    """
+    Identifies HS and TO indices from one recording with the settings in config,
+    without creating any figures. The input data is not modified.
     
-    # Step 6: Plot wavlet transformation ontop of raw accel signal 
-    # goal: select a scale that allows wavelet transform peaks to allign with heel strikes
-    plt.figure(subject_id)
-    plt.plot(time_chest, abs(cwt_hs[scale,:]), label = f'morlet scale {scale}')
-    plt.legend()
-    # The highest peaks from cwt_hs are associated HS as can be seen above
+    With chunk_size, the signal is processed in blocks of chunk_size samples (see
+    gait_stream.detect_chunks) so memory does not grow with the recording length.
+    The indices are the same as the in-memory path.
+
+    Parameters
+    ----------
+    data : length of sample x 4 Array of float, or gait_data.Recording
+        Recording, column 1 is time (seconds).
+    config : DetectorConfig
+        Detector settings.
+    return_diagnostics : bool, optional
+        If True, also return a dict with the time, signal and wavelet arrays used for
+        detection (see gait_plots). Not available with chunk_size. The default is False.
+    chunk_size : int, optional
+        Block length (samples) of the chunked mode. The default is None (whole signal).
+
+    Returns
+    -------
+    HS_inds : tuple of size 2
+        First tuple element is array of int representing the indices where HS is detected
+    TO_inds : tuple of size 2
+        First tuple element is array of int representing the indices where TO is detected.
+    diagnostics : dict
+        Only returned if return_diagnostics is True.
+
+    """
+    if chunk_size is not None:
+        if return_diagnostics:
+            raise ValueError('return_diagnostics is not available with chunk_size')
+        import gait_stream
+        
+        _, signal_data = _recording_arrays(data, config.column)
+        chunks = (signal_data[start:start + chunk_size] for start in range(0, len(signal_data), chunk_size))
+        
+        with gait_profile.stage('chunked_detection', sensor=config.sensor, chunk_size=chunk_size):
+            return gait_stream.detect_chunks(chunks, config)
+    
+    # Step 1: Define your data
+    time_data, signal_data = _recording_arrays(data, config.column) # time already in s
     
+    # Steps 2-4: wavelet transformation at the detection scale only
+    with gait_profile.stage('wavelet', sensor=config.sensor, samples=len(signal_data)):
+        cwt_row = wavelet_scale(signal_data, config.scale, config.mother_wavelet)
     
-    # Detect TOs
+    # Find Peaks for HS and Throughts for TO
+    # The highest peaks are associated with HS and the LOWEST with TO
+    with gait_profile.stage('find_peaks', sensor=config.sensor):
+        HS_inds, TO_inds = find_wavelet_events(cwt_row, prominence = config.prominence)
     
-    # Step 1: Define your data (time and linear acceleration)
-    # Same as step 1 for HS
+    if not return_diagnostics:
+        return HS_inds, TO_inds
     
-    # Step 2: Define a mother wavelet
-    mother_wavelet = signal.morlet2
+    diagnostics = {'sensor': config.sensor, 'time': time_data, 'signal': signal_data,
+                   'scale': config.scale, 'cwt_row': cwt_row}
     
-    # Step 3: Define a scale
-    scales = np.arange(1,65)  # range of scales (20)
+    return HS_inds, TO_inds, diagnostics
+
+
+#%% Detect HS and TOs from Cranial-Caudal Chest Acceleration
+
+
+def detect_chest_accel_events(data_chest_accel, return_diagnostics=False, config=chest_accel_config, chunk_size=None):
+    
+    """
+    Identifies HS and TO indices from chest acceleration walking data without creating
+    any figures. The input data is not modified.
+
+    Parameters
+    ----------
+    data_chest_accel : length of sample x 4 Array of float
+        Column 1: Time (seconds)
+        Column 2: Accel_x(g), Anterior-Posterior
+        Column 3: Accel_y (g), Cranial-Caudal
+        Column 4: Accel_z (g), Medial - Lateral 
+    return_diagnostics : bool, optional
+        If True, also return a dict with the time, signal and wavelet arrays used for
+        detection (see gait_plots). The default is False.
+    config : DetectorConfig, optional
+        Detector settings. The default is chest_accel_config (CC accel, scale 20).
+    chunk_size : int, optional
+        Process the signal in blocks of this many samples to bound memory on long
+        recordings (see detect_sensor_events). The default is None.
+
+    Returns
+    -------
+    HS_inds : tuple of size 2
+        First tuple element is array of int representing the indices where HS is detected
+    TO_inds : tuple of size 2
+        First tuple element is array of int representing the indices where TO is detected.
+    diagnostics : dict
+        Only returned if return_diagnostics is True.
+
+    """
+    return detect_sensor_events(data_chest_accel, config, return_diagnostics, chunk_size)
+
+
+def get_chest_accel_events(data_chest_accel, subject_id, config=chest_accel_config):
     
-    # Step 4: Apply Cont. Wavelet Transformation
-    cwt_to = abs(signal.cwt(signal_accel, mother_wavelet, widths=scales))
+    """
+    This function uses wavelet transformation to identify indices that indicate
+    heal strike and toe off events from chest acceleration walking data.
+    Draws the raw signal, wavelet trace, events and contour plot for the subject,
+    use detect_chest_accel_events for detection without figures. The input data is
+    not modified.
+
+    Parameters
+    ----------
+    data_chest_accel : length of sample x 4 Array of float
+        Column 1: Time (seconds)
+        Column 2: Accel_x(g), Anterior-Posterior
+        Column 3: Accel_y (g), Cranial-Caudal
+        Column 4: Accel_z (g), Medial - Lateral 
+    config : DetectorConfig, optional
+        Detector settings. The default is chest_accel_config (CC accel, scale 20).
+
+    Returns
+    -------
+    HS_inds : tuple of size 2
+        First tuple element is array of int representing the indices where HS is detected
+    TO_inds : tuple of size 2
+        First tuple element is array of int representing the indices where TO is detected.
 
-    # Step 5: Plot Contour Plot for toe-offs to determine which scale is best 
-    fig_to, ax_to = plt.subplots()  
-    ax_to.clear()
-    im_to = ax_to.contourf(np.arange(len(signal_accel)), scales, cwt_to, cmap='viridis')
-    ax_to.set_ylabel('Scale')
-    ax_to.set_xlabel('Data Point')
-    ax_to.set_title(f'Contour Plot for Accel Toe-Offs - Subject {subject_id}')
-    fig_to.colorbar(im_to)
-    fig_to.tight_layout()
+    """
+    import gait_plots
+    
+    HS_inds, TO_inds, diagnostics = detect_chest_accel_events(data_chest_accel, return_diagnostics=True, config=config)
     
-    # Step 6: Plot wavlet transformation ontop of raw accel signal 
     # goal: select a scale that allows wavelet transform peaks to allign with heel strikes
-    # Using the same as HS, so no need to replot
-    # plt.figure(2)
-    # plt.plot(time_chest, abs(cwt_hs[20,:]), label = 'morlet scale 20'))
-    # plt.title('Morlet Scale 20')
-    # plt.legend('Chest Accel', 'Wavelet at scale = 20')
-    # The LOWEST peaks from cwt_to are associated TO as can be seen above
-    
-    
-    # Find Peaks for HS
-    HS_inds = signal.find_peaks(cwt_hs[scale,:], prominence = 0.19 )
-    plt.figure(subject_id)
-    plt.plot(time_chest.iloc[HS_inds[0]], abs(cwt_hs[scale, HS_inds[0]]), 'v', label='HS Events')
-    plt.legend()
-    
-    # Find Throughts for TO (not always peaks or troughs-- whatever 
-    #consistent element you can find that aligns with your events of interest)
-    TO_inds = signal.find_peaks(-cwt_hs[scale,:], prominence = 0.19 )
-    plt.plot(time_chest.iloc[TO_inds[0]], abs(cwt_hs[scale, TO_inds[0]]), 's', label='TO Events')
-    plt.legend()
-             
+    gait_plots.plot_events(diagnostics, HS_inds, TO_inds, subject_id)
+    gait_plots.plot_scalogram(diagnostics, subject_id)
              
     return HS_inds, TO_inds
 
 
+#%% Detect HS and TOs from Medial-Lateral Shank Angular Velocity
+
+
+def detect_shank_gyro_events(data_shank_gyro, return_diagnostics=False, config=shank_gyro_config, chunk_size=None):
+    '''
+    Identifies HS and TO indices from shank gyroscope walking data without creating
+    any figures. The input data is not modified.
+
+    Parameters
+    ----------
+    data_shank_gyro : length of sample x 4 Array of float
+        Column 1: Timestamps (microseconds) in POSIXTIME
+        Column 2: Gyro_x(deg/s), Anterior-Posterior
+        Column 3: Gyro_y (deg/s), Cranial-Caudal
+        Column 4: Gyro_z (deg/s), Medial - Lateral 
+    return_diagnostics : bool, optional
+        If True, also return a dict with the time, signal and wavelet arrays used for
+        detection (see gait_plots). The default is False.
+    config : DetectorConfig, optional
+        Detector settings. The default is shank_gyro_config (ML gyro, scale 25).
+    chunk_size : int, optional
+        Process the signal in blocks of this many samples to bound memory on long
+        recordings (see detect_sensor_events). The default is None.
+
+    Returns
+    -------
+    HS_inds : tuple of size 2
+        First tuple element is array of int representing the indices where HS is detected
+    TO_inds : tuple of size 2
+        First tuple element is array of int representing the indices where TO is detected.
+    diagnostics : dict
+        Only returned if return_diagnostics is True.
+
+    '''
+    return detect_sensor_events(data_shank_gyro, config, return_diagnostics, chunk_size)
+
 
-def get_shank_gyro_events(data_shank_gyro, subject_id):
+def get_shank_gyro_events(data_shank_gyro, subject_id, config=shank_gyro_config):
     '''
     Performs wavelet transformation on parameter data to identify points that indicate
     heal strike and toe off events from shank gyroscope walking data.
+    Draws the raw signal, wavelet trace, events and contour plot for the subject,
+    use detect_shank_gyro_events for detection without figures. The input data is
+    not modified.
 
     Parameters
     ----------
@@ -151,6 +571,8 @@ def get_shank_gyro_events(data_shank_gyro, subject_id):
         Column 2: Gyro_x(deg/s), Anterior-Posterior
         Column 3: Gyro_y (deg/s), Cranial-Caudal
         Column 4: Gyro_z (deg/s), Medial - Lateral 
+    config : DetectorConfig, optional
+        Detector settings. The default is shank_gyro_config (ML gyro, scale 25).
 
     Returns
     -------
@@ -160,71 +582,263 @@ def get_shank_gyro_events(data_shank_gyro, subject_id):
         First tuple element is array of int representing the indices where TO is detected.
 
     '''
-   
-    # define scale
-    gyro_scale = 25
-    
-    # define data
-    time_shank = data_shank_gyro.iloc[:, 0] # time array from dictionary -- already in s
-    signal_gyro = data_shank_gyro.iloc[:, 3] # ML gyro data
-    
-    # check match
-    data_shank_gyro.set_index(time_shank, inplace=True)
-    
-    # plot raw data
-    plt.figure(int(subject_id)+30, clear=True)
-    plt.plot(time_shank, signal_gyro, label='raw_data')
-    plt.title(f'Shank Gyro - Subject {subject_id}')
-    plt.ylabel('ML Gyro. (deg/s)')
-    plt.xlabel('Time (seconds)')
-    
-    # define mother wavelet
-    mother_wavelet_gyro = signal.morlet2
-    
-    # define a scale
-    gyro_scales = np.arange(1,65)  
-    
-    # apply transformation
-    gyro_cwt_hs = abs(signal.cwt(signal_gyro, mother_wavelet_gyro, widths=gyro_scales))   
-
-    # contour plot, HS
-    gyro_fig_hs, gyro_ax_hs = plt.subplots()  
-    gyro_ax_hs.clear()
-    gyro_im_hs = gyro_ax_hs.contourf(np.arange(len(signal_gyro)), gyro_scales, gyro_cwt_hs, cmap='viridis')
-    gyro_ax_hs.set_ylabel('Scale')
-    gyro_ax_hs.set_xlabel('Data Point')
-    gyro_ax_hs.set_title(f'Contour Plot for Gyro Heel Strikes - Subject {subject_id}')
-    gyro_fig_hs.colorbar(gyro_im_hs)
-    gyro_fig_hs.tight_layout()
-    
-    # add morlet scale to raw data
-    plt.figure(int(subject_id)+30)
-    plt.plot(time_shank, abs(gyro_cwt_hs[gyro_scale,:]), label = f'morlet scale {gyro_scale}')
-    plt.legend()
-    
-    # apply transformation
-    gyro_cwt_to = abs(signal.cwt(signal_gyro, mother_wavelet_gyro, widths=gyro_scales))
-
-    # Step 5: Plot Contour Plot for toe-offs to determine which scale is best 
-    gyro_fig_to, gyro_ax_to = plt.subplots()  
-    gyro_ax_to.clear()
-    gyro_im_to = gyro_ax_to.contourf(np.arange(len(signal_gyro)), gyro_scales, gyro_cwt_to, cmap='viridis')
-    gyro_ax_to.set_ylabel('Scale')
-    gyro_ax_to.set_xlabel('Data Point')
-    gyro_ax_to.set_title(f'Contour Plot for Gyro Toe-Offs - Subject {subject_id}')
-    gyro_fig_to.colorbar(gyro_im_to)
-    gyro_fig_to.tight_layout()
-    
-    # Find Peaks for HS
-    gyro_HS_inds = signal.find_peaks(gyro_cwt_hs[gyro_scale,:], prominence = 0.19 )
-    plt.figure(int(subject_id)+30)
-    plt.plot(time_shank.iloc[gyro_HS_inds[0]], abs(gyro_cwt_hs[gyro_scale, gyro_HS_inds[0]]), 'v', label='HS Events')
-    plt.legend()
-    
-    # Find Throughts for TO (not always peaks or troughs-- whatever 
-    #consistent element you can find that aligns with your events of interest)
-    gyro_TO_inds = signal.find_peaks(-gyro_cwt_hs[gyro_scale,:], prominence = 0.19 )
-    plt.plot(time_shank.iloc[gyro_TO_inds[0]], abs(gyro_cwt_hs[gyro_scale, gyro_TO_inds[0]]), 's', label='TO Events')
-    plt.legend()
-    
-    return gyro_HS_inds, gyro_TO_inds
\ No newline at end of file
+    import gait_plots
+    
+    gyro_HS_inds, gyro_TO_inds, diagnostics = detect_shank_gyro_events(data_shank_gyro, return_diagnostics=True, config=config)
+    
+    # plot raw data, morlet scale, events and contour plot
+    gait_plots.plot_events(diagnostics, gyro_HS_inds, gyro_TO_inds, subject_id)
+    gait_plots.plot_scalogram(diagnostics, subject_id)
+    
+    return gyro_HS_inds, gyro_TO_inds
+
+
+#%% Gait Cycle Metrics
+
+
+def _event_indices(inds):
+    """
+    Returns the event indices as an array of int, from either the find_peaks tuple
+    returned by the detectors or an array of indices.
+    """
+    if isinstance(inds, tuple):
+        inds = inds[0]
+    
+    return np.asarray(inds, dtype=np.int64)
+
+
+# fields of the cycle table returned by get_cycle_metrics
+cycle_dtype = np.dtype([('HS', np.int64), ('TO', np.int64), ('prev_TO', np.int64), ('next_HS', np.int64),
+                        ('stance', np.float64), ('swing', np.float64), ('stride', np.float64)])
+
+
+def get_cycle_metrics(HS_inds, TO_inds, fs=125, num_cycles=None, step=1):
+    """
+    Computes stance, swing and stride time of every gait cycle with array differencing.
+    TO is detected first, so for cycle i:
+        stance = HS-->TO = TO[i+1] - HS[i]
+        swing = TO-->HS = HS[i+1] - TO[i]
+        stride = HS-->HS = HS[i+1] - HS[i]
+
+    Parameters
+    ----------
+    HS_inds : tuple of size 2 or array of int
+        HS events, as returned by the detectors or as indices.
+    TO_inds : tuple of size 2 or array of int
+        TO events, as returned by the detectors or as indices.
+    fs : float, optional
+        Sampling frequency used to convert samples to seconds. The default is 125.
+    num_cycles : int, optional
+        Number of gait cycles to use, e.g. the minimum over several sensors so that they
+        give the same number of cycles. The default is min(len(HS_inds), len(TO_inds)).
+    step : int, optional
+        Keep every step-th cycle, 2 keeps the cycles of only one foot for the chest
+        accelerometer (which detects both feet). The default is 1.
+
+    Returns
+    -------
+    stance_times : array of float
+        Stance time of each cycle (seconds).
+    swing_times : array of float
+        Swing time of each cycle (seconds).
+    stride_times : array of float
+        Stride time of each cycle (seconds).
+    cycle_table : structured array
+        One row per cycle with the event indices (HS, TO, prev_TO, next_HS) and the
+        stance, swing and stride times, see cycle_dtype.
+
+    """
+    HS = _event_indices(HS_inds)
+    TO = _event_indices(TO_inds)
+    
+    # get number of gait cycles in order to get parameters for each
+    if num_cycles is None:
+        num_cycles = min(len(HS), len(TO))
+    n = max(min(num_cycles, len(HS), len(TO)) - 1, 0)
+    
+    cycle_table = np.empty(n, dtype=cycle_dtype)
+    cycle_table['HS'] = HS[:n]
+    cycle_table['TO'] = TO[1:n+1]
+    cycle_table['prev_TO'] = TO[:n]
+    cycle_table['next_HS'] = HS[1:n+1]
+    cycle_table['stance'] = (cycle_table['TO'] - cycle_table['HS']) / fs
+    cycle_table['swing'] = (cycle_table['next_HS'] - cycle_table['prev_TO']) / fs
+    cycle_table['stride'] = (cycle_table['next_HS'] - cycle_table['HS']) / fs
+    
+    # keep one foot
+    cycle_table = cycle_table[::step]
+    
+    return cycle_table['stance'], cycle_table['swing'], cycle_table['stride'], cycle_table
+
+
+#%% Robust Event Pairing
+
+# fields of the cycle table returned by pair_gait_events
+paired_cycle_dtype = np.dtype([('HS', np.int64), ('TO', np.int64), ('next_HS', np.int64), ('n_TO', np.int64),
+                               ('stance', np.float64), ('swing', np.float64), ('stride', np.float64),
+                               ('valid', np.bool_)])
+
+
+def pair_gait_events(HS_inds, TO_inds, fs=125, stride_tolerance=0.5):
+    """
+    Pairs HS and TO events by time instead of by position, so a missed or spurious
+    event only affects the cycles around it. Each HS starts a cycle that ends at the
+    next HS, and is paired with the first TO after it:
+        stance = TO - HS, swing = next_HS - TO, stride = next_HS - HS
+    
+    A cycle is flagged as not valid if it does not contain exactly one TO (missed or
+    spurious TO), or if its stride differs from the median stride of the cycles with a
+    TO by more than stride_tolerance (missed or spurious HS).
+    
+    Runs in O(n log n) with np.searchsorted.
+
+    Parameters
+    ----------
+    HS_inds : tuple of size 2 or array of int
+        HS events, as returned by the detectors or as indices.
+    TO_inds : tuple of size 2 or array of int
+        TO events, as returned by the detectors or as indices.
+    fs : float, optional
+        Sampling frequency used to convert samples to seconds. The default is 125.
+    stride_tolerance : float, optional
+        Allowed relative deviation of the stride from the median stride. The default is 0.5.
+
+    Returns
+    -------
+    cycle_table : structured array
+        One row per pair of consecutive HS, see paired_cycle_dtype. TO is -1 and stance
+        and swing are nan for cycles without a TO.
+
+    """
+    HS = np.sort(_event_indices(HS_inds))
+    TO = np.sort(_event_indices(TO_inds))
+    n = max(len(HS) - 1, 0)
+    
+    cycle_table = np.zeros(n, dtype=paired_cycle_dtype)
+    cycle_table['HS'] = HS[:n]
+    cycle_table['next_HS'] = HS[1:]
+    
+    # first TO after each HS, and number of TOs before the next HS
+    first_TO = np.searchsorted(TO, cycle_table['HS'], side='right')
+    cycle_table['n_TO'] = np.searchsorted(TO, cycle_table['next_HS'], side='left') - first_TO
+    has_TO = cycle_table['n_TO'] > 0
+    cycle_table['TO'] = np.where(has_TO, TO[np.minimum(first_TO, len(TO) - 1)] if len(TO) else -1, -1)
+    
+    cycle_table['stride'] = (cycle_table['next_HS'] - cycle_table['HS']) / fs
+    cycle_table['stance'] = np.where(has_TO, (cycle_table['TO'] - cycle_table['HS']) / fs, np.nan)
+    cycle_table['swing'] = np.where(has_TO, (cycle_table['next_HS'] - cycle_table['TO']) / fs, np.nan)
+    
+    # flag outlier cycles
+    valid = cycle_table['n_TO'] == 1
+    if np.any(has_TO):
+        median_stride = np.median(cycle_table['stride'][has_TO])
+        valid &= np.abs(cycle_table['stride'] - median_stride) <= stride_tolerance * median_stride
+    cycle_table['valid'] = valid
+    
+    return cycle_table
+
+
+#%% Cross-Sensor Event Matching
+
+
+def _nearest(sorted_values, values):
+    """
+    Returns the position in sorted_values of the element nearest to each of values.
+    """
+    right = np.clip(np.searchsorted(sorted_values, values), 1, len(sorted_values) - 1)
+    left = right - 1
+    
+    return np.where(np.abs(values - sorted_values[left]) <= np.abs(sorted_values[right] - values), left, right)
+
+
+def match_events(times_a, times_b, tolerance):
+    """
+    Matches two event streams one-to-one by nearest timestamp. Two events are matched
+    if each is the nearest event of the other stream to the other one, and they are at
+    most tolerance apart. Uses a sorted-index join (np.searchsorted), O(n log n).
+
+    Parameters
+    ----------
+    times_a : array of float
+        Event times of the first stream.
+    times_b : array of float
+        Event times of the second stream.
+    tolerance : float
+        Largest allowed time difference, same unit as the times.
+
+    Returns
+    -------
+    inds_a : array of int
+        Positions in times_a of the matched events.
+    inds_b : array of int
+        Positions in times_b of the matched events, inds_b[k] is matched with inds_a[k].
+
+    """
+    times_a = np.asarray(times_a, dtype=float)
+    times_b = np.asarray(times_b, dtype=float)
+    if len(times_a) == 0 or len(times_b) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    
+    order_a = np.argsort(times_a, kind='stable')
+    order_b = np.argsort(times_b, kind='stable')
+    sorted_a = times_a[order_a]
+    sorted_b = times_b[order_b]
+    
+    if len(sorted_b) == 1:
+        nearest_b = np.zeros(len(sorted_a), dtype=np.int64)
+    else:
+        nearest_b = _nearest(sorted_b, sorted_a)
+    if len(sorted_a) == 1:
+        nearest_a = np.zeros(len(sorted_b), dtype=np.int64)
+    else:
+        nearest_a = _nearest(sorted_a, sorted_b)
+    
+    # keep mutual nearest neighbours within the tolerance
+    positions_a = np.arange(len(sorted_a))
+    matched = (nearest_a[nearest_b] == positions_a) & (np.abs(sorted_b[nearest_b] - sorted_a) <= tolerance)
+    
+    return order_a[matched], order_b[nearest_b[matched]]
+
+
+def match_cycles(cycles_a, cycles_b, fs=125, tolerance=0.2, time_a=None, time_b=None, valid_only=True):
+    """
+    Matches the gait cycles of two sensors by the time of their HS, e.g. chest accel and
+    shank gyro cycles from pair_gait_events. Extra or missing cycles in one sensor only
+    leave those cycles unmatched.
+
+    Parameters
+    ----------
+    cycles_a : structured array
+        Cycle table of the first sensor (from pair_gait_events).
+    cycles_b : structured array
+        Cycle table of the second sensor.
+    fs : float, optional
+        Sampling frequency, used to convert indices to seconds if no time arrays are
+        given. The default is 125.
+    tolerance : float, optional
+        Largest allowed difference between matched HS (seconds). The default is 0.2.
+    time_a : array of float, optional
+        Time (seconds) of each sample of the first sensor. The default is None.
+    time_b : array of float, optional
+        Time (seconds) of each sample of the second sensor. The default is None.
+    valid_only : bool, optional
+        Only match cycles flagged as valid. The default is True.
+
+    Returns
+    -------
+    matched_a : structured array
+        Matched cycles of the first sensor.
+    matched_b : structured array
+        Matched cycles of the second sensor, matched_b[k] is the same cycle as matched_a[k].
+
+    """
+    if valid_only:
+        cycles_a = cycles_a[cycles_a['valid']]
+        cycles_b = cycles_b[cycles_b['valid']]
+    
+    HS_times_a = cycles_a['HS'] / fs if time_a is None else np.asarray(time_a)[cycles_a['HS']]
+    HS_times_b = cycles_b['HS'] / fs if time_b is None else np.asarray(time_b)[cycles_b['HS']]
+    
+    inds_a, inds_b = match_events(HS_times_a, HS_times_b, tolerance)
+    
+    return cycles_a[inds_a], cycles_b[inds_b]
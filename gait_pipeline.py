@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prefetching pipeline that overlaps loading the recordings with event detection.
+
+A reader thread loads the subjects in order and puts them on a bounded queue. While
+the queue is full the reader waits, so at most `prefetch` loaded subjects wait for
+the consumer and the cohort is never held in memory at once. The consumer (the loop
+over prefetch_subjects, or the detection workers of run_pipeline) works on the
+current subject meanwhile, and every subject is released as soon as it has been
+handed on. Reading the csv files (pandas) and the FFTs release the GIL, so threads
+are enough to keep the disk and the CPU busy at the same time.
+"""
+
+#%% Import Libraries
+
+import queue
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import gait_batch
+import gait_data
+import gait_io
+
+
+#%% Prefetching Reader
+
+# marks the end of the items on the queue
+_done = object()
+
+
+def _put(buffer, entry, stop):
+    """
+    Puts entry on the bounded buffer, waiting while it is full. Returns False if the
+    consumer stopped in the meantime.
+    """
+    while not stop.is_set():
+        try:
+            buffer.put(entry, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+
+def _read(load, items, buffer, stop):
+    """
+    Reader thread: loads every item in order and puts (item, value, error) on the buffer.
+    """
+    for item in items:
+        if stop.is_set():
+            return
+        try:
+            entry = (item, load(item), None)
+        except Exception as error:
+            entry = (item, None, error)
+        if not _put(buffer, entry, stop):
+            return
+
+    _put(buffer, (_done, None, None), stop)
+
+
+def prefetch_items(load, items, prefetch=2):
+    """
+    Yields (item, load(item)) for every item in order, while a reader thread already
+    loads the next items. An exception of load is raised when the consumer reaches
+    that item. Leaving the loop early stops the reader.
+
+    Parameters
+    ----------
+    load : function
+        Called as load(item) on the reader thread.
+    items : iterable
+        Items to load, e.g. subject numbers.
+    prefetch : int, optional
+        Size of the queue, i.e. the largest number of loaded items waiting for the
+        consumer. The default is 2.
+
+    Yields
+    ------
+    item : object
+        Next item.
+    value : object
+        load(item).
+
+    """
+    buffer = queue.Queue(maxsize=max(int(prefetch), 1))
+    stop = threading.Event()
+    reader = threading.Thread(target=_read, args=(load, list(items), buffer, stop), name='gait-prefetch', daemon=True)
+    reader.start()
+
+    try:
+        while True:
+            item, value, error = buffer.get()
+            if item is _done:
+                return
+            if error is not None:
+                raise error
+            yield item, value
+            # release the subject before waiting for the next one
+            value = None
+    finally:
+        stop.set()
+        reader.join()
+
+
+def prefetch_subjects(subject_range, data_types=gait_io.data_types, prefetch=2, **load_kwargs):
+    """
+    Yields (subject, SubjectData) in subject order, loading the next subjects on a
+    reader thread while the caller works on the current one, e.g.
+
+        for subject, subject_data in prefetch_subjects(subject_range):
+            gm.get_shank_gyro_events(subject_data.recordings['shank_gyro'], subject)
+
+    The loop body runs in the calling thread, so it may draw pyplot figures.
+
+    Parameters
+    ----------
+    subject_range : iterable of int
+        Subject numbers.
+    data_types : list of str, optional
+        Data types to load. The default is gait_io.data_types.
+    prefetch : int, optional
+        Largest number of loaded subjects waiting for the loop. The default is 2.
+    **load_kwargs
+        Passed to gait_data.load_subject_data (dtype, data_dir, crop_start_time, ...).
+
+    """
+    def load(subject):
+        return gait_data.load_subject_data(subject, data_types, **load_kwargs)
+
+    return prefetch_items(load, subject_range, prefetch)
+
+
+#%% Detection Pipeline
+
+
+def _load_subject(subject, data_types, sensor_configs, load_kwargs):
+    """
+    Loads one subject, each sensor at its config rate, returning (subject_data, None)
+    or (None, traceback).
+    """
+    try:
+        return gait_data.load_subject_data(subject, data_types, sensor_configs=sensor_configs, **load_kwargs), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def _detect_subject(subject, loaded, sensor_configs, bouts=False):
+    """
+    Detects the events and cycles of one loaded subject and returns its result dict.
+    """
+    subject_data, error = loaded
+    if error is None:
+        try:
+            subject_data = gait_data.detect_subject(subject_data, sensor_configs, bouts)
+        except Exception:
+            subject_data, error = None, traceback.format_exc()
+
+    return {'subject': subject, 'subject_data': subject_data, 'error': error}
+
+
+def run_pipeline(subject_range, sensors=tuple(gait_batch.configs), sensor_configs=None, data_types=None,
+                 prefetch=2, workers=1, bouts=False, **load_kwargs):
+    """
+    Loads and detects every subject with loading overlapped with detection, and yields
+    each subject's result as soon as it is done, in subject order. Peak memory is
+    about prefetch + workers + 1 subjects, whatever the size of the cohort.
+
+    Parameters
+    ----------
+    subject_range : iterable of int
+        Subject numbers.
+    sensors : iterable of str, optional
+        Sensors to detect. The default is ('chest_accel', 'shank_gyro').
+    sensor_configs : dict, optional
+        DetectorConfig per sensor, overriding gait_batch.configs. The default is None.
+    data_types : list of str, optional
+        Data types to load. The default is None (only the detected sensors).
+    prefetch : int, optional
+        Largest number of loaded subjects waiting for a worker. The default is 2.
+    workers : int, optional
+        Detection threads. 1 detects in the consuming thread. The default is 1.
+    bouts : bool, optional
+        Detect only in the walking bouts of each recording (see gait_batch.run_task),
+        the crop then defaults to the whole recording. The default is False.
+    **load_kwargs
+        Passed to gait_data.load_subject_data (dtype, data_dir, crop_start_time,
+        resample, ...). The detected sensors are loaded at the fs of their config.
+
+    Yields
+    ------
+    result : dict
+        'subject', 'subject_data' (SubjectData with the events and cycles of every
+        sensor, None on failure) and 'error' (None on success, otherwise the formatted
+        traceback). A failing subject does not stop the pipeline.
+
+    """
+    sensor_configs = {**gait_batch.configs, **(sensor_configs or {})}
+    sensor_configs = {sensor: sensor_configs[sensor] for sensor in sensors}
+    data_types = list(sensor_configs) if data_types is None else data_types
+    if bouts:
+        load_kwargs = {**gait_batch.bout_load_kwargs, **load_kwargs}
+
+    def load(subject):
+        return _load_subject(subject, data_types, sensor_configs, load_kwargs)
+
+    loaded_subjects = prefetch_items(load, subject_range, prefetch)
+    try:
+        if workers <= 1:
+            for subject, loaded in loaded_subjects:
+                yield _detect_subject(subject, loaded, sensor_configs, bouts)
+            return
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # at most `workers` subjects in detection, results handed on in subject order
+            running = deque()
+            for subject, loaded in loaded_subjects:
+                running.append(executor.submit(_detect_subject, subject, loaded, sensor_configs, bouts))
+                loaded = None
+                if len(running) >= workers:
+                    yield running.popleft().result()
+            while running:
+                yield running.popleft().result()
+    finally:
+        # stops the reader if the caller leaves the loop early
+        loaded_subjects.close()
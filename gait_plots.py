@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Plotting layer for the gait event detectors.
+
+The detectors in gait_metrics only compute. These functions take the diagnostics dict
+returned by detect_chest_accel_events / detect_shank_gyro_events(..., return_diagnostics=True)
+and draw it, either on numbered pyplot figures (interactive use) or on standalone figures
+that are written to file and released (batch use, no pyplot state).
+
+Scalograms are max-pooled along time to display resolution and drawn as one raster
+image, so the peaks survive and the files stay small. export_reports writes a QC
+report per subject from a process pool.
+"""
+
+#%% Import Libraries
+
+import os
+from functools import partial
+
+import numpy as np
+from matplotlib.figure import Figure
+
+import gait_batch
+import gait_io
+import gait_metrics as gm
+import gait_profile
+
+
+#%% Sensor Labels
+
+# titles, axis labels and figure number offset for each detector
+sensor_labels = {
+    'chest_accel': {'title': 'Chest Accel', 'short': 'Accel', 'ylabel': 'CC Accel. (g)', 'fig_offset': 0},
+    'shank_gyro': {'title': 'Shank Gyro', 'short': 'Gyro', 'ylabel': 'ML Gyro. (deg/s)', 'fig_offset': 30},
+    }
+
+# columns of a drawn scalogram and bins of a decimated trace
+display_columns = 2000
+
+
+#%% Figure Helpers
+
+
+def _new_figure(num=None, to_file=False):
+    """
+    Returns a cleared pyplot figure with number num, or a standalone Figure that is not
+    registered with pyplot if to_file is True.
+    """
+    if to_file:
+        return Figure()
+
+    # only touch pyplot (and its GUI backend) when drawing interactively
+    from matplotlib import pyplot as plt
+
+    return plt.figure(num, clear=True)
+
+
+def _save_figure(fig, path):
+    """
+    Writes a standalone figure to path. The figure is dropped by the caller afterwards.
+    """
+    with gait_profile.stage('savefig', file=path):
+        fig.tight_layout()
+        fig.savefig(path)
+
+
+#%% Display Resolution
+
+
+def _bin_starts(n, columns):
+    """
+    Returns the first sample of each of at most columns equal bins of n samples.
+    """
+    return np.unique(np.linspace(0, n, min(columns, n), endpoint=False).astype(np.int64))
+
+
+def pool_scalogram(cwt, columns=display_columns):
+    """
+    Reduces a scalogram to at most columns time bins, keeping the maximum of each bin
+    so that no peak is lost.
+
+    Parameters
+    ----------
+    cwt : scales x samples array of float
+        Magnitude of the wavelet transform, e.g. from gm.scalogram.
+    columns : int, optional
+        Largest number of time bins. The default is display_columns.
+
+    Returns
+    -------
+    pooled : scales x bins array of float
+        Maximum of each scale over each bin.
+    starts : array of int
+        First sample of each bin.
+
+    """
+    starts = _bin_starts(cwt.shape[1], columns)
+
+    return np.maximum.reduceat(cwt, starts, axis=1), starts
+
+
+def pooled_scalogram(signal_data, columns=display_columns):
+    """
+    Computes the scalogram of signal_data already max-pooled to at most columns time
+    bins. Each block of rows from gm.cwt_blocks is pooled as soon as it is transformed,
+    so the full scales x samples scalogram is never held. Gives the same values as
+    pool_scalogram(gm.scalogram(signal_data), columns).
+
+    Returns
+    -------
+    pooled : scales x bins array of float32
+        Maximum of each scale over each bin.
+    starts : array of int
+        First sample of each bin.
+
+    """
+    starts = _bin_starts(len(signal_data), columns)
+    pooled = np.empty((len(gm.scales), len(starts)), dtype=np.float32)
+
+    with gait_profile.stage('scalogram', samples=len(signal_data)):
+        for start, block in gm.cwt_blocks(signal_data):
+            pooled[start:start + len(block)] = np.maximum.reduceat(block, starts, axis=1)
+
+    return pooled, starts
+
+
+def decimate_trace(time_data, values, bins=display_columns):
+    """
+    Reduces a trace to the minimum and maximum of each of at most bins time bins, so
+    the drawn line keeps every peak and trough.
+
+    Returns
+    -------
+    time_data : array of float
+        Start time of each bin, twice.
+    values : array of float
+        Minimum and maximum of each bin, interleaved.
+
+    """
+    values = np.asarray(values)
+    starts = _bin_starts(len(values), bins)
+    envelope = np.column_stack([np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)])
+
+    return np.repeat(np.asarray(time_data)[starts], 2), envelope.ravel()
+
+
+#%% Plot Events
+
+
+def _draw_events(ax, diagnostics, HS_inds, TO_inds, subject_id, bins=None):
+    """
+    Draws the raw signal, the wavelet trace and the HS/TO events on ax. With bins, the
+    two traces are decimated (decimate_trace), the events are always exact.
+    """
+    labels = sensor_labels[diagnostics['sensor']]
+    time_data = diagnostics['time']
+    cwt_row = diagnostics['cwt_row']
+    scale = diagnostics['scale']
+
+    def trace(values):
+        return (time_data, values) if bins is None else decimate_trace(time_data, values, bins)
+
+    # raw data
+    ax.plot(*trace(diagnostics['signal']), label='raw_data')
+    ax.set_title(f'{labels["title"]} - Subject {subject_id}')
+    ax.set_ylabel(labels['ylabel'])
+    ax.set_xlabel('Time (seconds)')
+
+    # wavelet transformation ontop of raw signal
+    ax.plot(*trace(cwt_row), label = f'morlet scale {scale}')
+
+    # events
+    ax.plot(time_data[HS_inds[0]], cwt_row[HS_inds[0]], 'v', label='HS Events')
+    ax.plot(time_data[TO_inds[0]], cwt_row[TO_inds[0]], 's', label='TO Events')
+    ax.legend()
+
+
+def plot_events(diagnostics, HS_inds, TO_inds, subject_id, path=None, bins=None):
+    """
+    Plots the raw signal, the wavelet trace at the detection scale and the HS/TO events.
+
+    Parameters
+    ----------
+    diagnostics : dict
+        Diagnostics returned by the gait_metrics detect_* functions.
+    HS_inds : tuple of size 2
+        HS events returned by the detector.
+    TO_inds : tuple of size 2
+        TO events returned by the detector.
+    subject_id : int
+        Subject number, used for the title and the figure number.
+    path : str, optional
+        If given, the figure is written to this file instead of being drawn with pyplot.
+        The default is None.
+    bins : int, optional
+        Draw the traces as the min/max of this many time bins. The default is None
+        (every sample).
+
+    Returns
+    -------
+    fig : Figure
+        The figure, or None if it was written to path.
+
+    """
+    labels = sensor_labels[diagnostics['sensor']]
+    fig = _new_figure(int(subject_id) + labels['fig_offset'], to_file=path is not None)
+    _draw_events(fig.gca(), diagnostics, HS_inds, TO_inds, subject_id, bins)
+
+    if path is None:
+        return fig
+
+    _save_figure(fig, path)
+
+
+#%% Plot Scalogram
+
+
+def _draw_scalogram(fig, ax, diagnostics, subject_id, columns=display_columns):
+    """
+    Draws the max-pooled scalogram of diagnostics['signal'] as an image on ax.
+    """
+    labels = sensor_labels[diagnostics['sensor']]
+    pooled, _ = pooled_scalogram(diagnostics['signal'], columns)
+
+    with gait_profile.stage('imshow', sensor=diagnostics['sensor'], subject=subject_id):
+        # one pixel row per scale, the image spans every data point
+        im = ax.imshow(pooled, aspect='auto', origin='lower', cmap='viridis', interpolation='nearest',
+                       extent=(0, len(diagnostics['signal']), gm.scales[0] - 0.5, gm.scales[-1] + 0.5))
+    ax.set_ylabel('Scale')
+    ax.set_xlabel('Data Point')
+    ax.set_title(f'Scalogram for {labels["short"]} Heel Strikes and Toe-Offs - Subject {subject_id}')
+    fig.colorbar(im, ax=ax)
+
+
+def plot_scalogram(diagnostics, subject_id, path=None, columns=display_columns):
+    """
+    Draws the full 64-scale wavelet transform as an image, used to determine which scale
+    is best for HS and TO detection. The scalogram is only computed here, and is
+    max-pooled to at most columns time bins before drawing.
+
+    Parameters
+    ----------
+    diagnostics : dict
+        Diagnostics returned by the gait_metrics detect_* functions.
+    subject_id : int
+        Subject number, used for the title.
+    path : str, optional
+        If given, the figure is written to this file instead of being drawn with pyplot.
+        The default is None.
+    columns : int, optional
+        Largest number of drawn time bins. The default is display_columns.
+
+    Returns
+    -------
+    fig : Figure
+        The figure, or None if it was written to path.
+
+    """
+    fig = _new_figure(to_file=path is not None)
+    _draw_scalogram(fig, fig.gca(), diagnostics, subject_id, columns)
+
+    if path is None:
+        fig.tight_layout()
+        return fig
+
+    _save_figure(fig, path)
+
+
+#%% Save Plots
+
+
+def save_event_plots(diagnostics, HS_inds, TO_inds, subject_id, path_prefix, scalogram=False, file_format='png'):
+    """
+    Writes the event plot (and optionally the scalogram plot) of one detector run to files
+    named {path_prefix}_{sensor}_events.{file_format} and {path_prefix}_{sensor}_scalogram.{file_format}.
+    No pyplot figures are created, so this is safe to call from batch runs.
+
+    Parameters
+    ----------
+    diagnostics : dict
+        Diagnostics returned by the gait_metrics detect_* functions.
+    HS_inds : tuple of size 2
+        HS events returned by the detector.
+    TO_inds : tuple of size 2
+        TO events returned by the detector.
+    subject_id : int
+        Subject number, used for the titles.
+    path_prefix : str
+        Path prefix of the files.
+    scalogram : bool, optional
+        Also compute and save the scalogram plot. The default is False.
+    file_format : str, optional
+        Extension of the files, e.g. 'png' or 'pdf'. The default is 'png'.
+
+    Returns
+    -------
+    paths : list of str
+        Paths of the written files.
+
+    """
+    sensor = diagnostics['sensor']
+    paths = [f'{path_prefix}_{sensor}_events.{file_format}']
+    plot_events(diagnostics, HS_inds, TO_inds, subject_id, path=paths[0], bins=display_columns)
+
+    if scalogram:
+        paths.append(f'{path_prefix}_{sensor}_scalogram.{file_format}')
+        plot_scalogram(diagnostics, subject_id, path=paths[-1])
+
+    return paths
+
+
+#%% QC Reports
+
+
+def plot_report(runs, subject_id, path, columns=display_columns):
+    """
+    Writes one report of a subject: the decimated event plot and the pooled scalogram
+    of every detector run, one row per sensor.
+
+    Parameters
+    ----------
+    runs : list of tuple
+        (diagnostics, HS_inds, TO_inds) of each detector run.
+    subject_id : int
+        Subject number, used for the titles.
+    path : str
+        File to write, the extension selects the format (e.g. png or pdf).
+    columns : int, optional
+        Time bins of the traces and the scalograms. The default is display_columns.
+
+    """
+    fig = Figure(figsize=(14, 4 * len(runs)))
+    axes = fig.subplots(len(runs), 2, squeeze=False)
+    for (diagnostics, HS_inds, TO_inds), (events_ax, scalogram_ax) in zip(runs, axes):
+        _draw_events(events_ax, diagnostics, HS_inds, TO_inds, subject_id, columns)
+        _draw_scalogram(fig, scalogram_ax, diagnostics, subject_id, columns)
+
+    # fixed margins, tight_layout would measure every tick label once more
+    fig.subplots_adjust(left=0.06, right=0.97, bottom=0.08, top=0.94, wspace=0.2, hspace=0.45)
+    with gait_profile.stage('savefig', file=path):
+        fig.savefig(path)
+
+
+def report_task(subject, sensor_configs, report_dir, file_format='png', columns=display_columns, **load_kwargs):
+    """
+    Loads, detects and writes the report of one subject (see plot_report) to
+    {report_dir}/s{subject}_report.{file_format}. Runs in the export_reports workers.
+
+    Returns
+    -------
+    path : str
+        Path of the written report.
+
+    """
+    runs = []
+    for sensor, config in sensor_configs.items():
+        data = gait_io.load_recording(subject, sensor, **{**load_kwargs, 'fs': config.fs})
+        HS_inds, TO_inds, diagnostics = gm.detect_sensor_events(data, config, return_diagnostics=True)
+        runs.append((diagnostics, HS_inds, TO_inds))
+
+    path = os.path.join(report_dir, f's{subject}_report.{file_format}')
+    plot_report(runs, subject, path, columns)
+
+    return path
+
+
+def export_reports(subject_range, report_dir='reports', sensors=tuple(gait_batch.configs), file_format='png',
+                   max_workers=None, sensor_configs=None, columns=display_columns, **load_kwargs):
+    """
+    Writes the QC report of every subject, one subject per task on a process pool
+    (gait_batch.map_tasks). Workers only build standalone Figures, which are rendered
+    by the non-interactive Agg (png) or pdf canvas, so pyplot is never imported.
+
+    Parameters
+    ----------
+    subject_range : iterable of int
+        Subject numbers.
+    report_dir : str, optional
+        Folder of the reports, created if needed. The default is 'reports'.
+    sensors : iterable of str, optional
+        Sensors drawn in each report. The default is ('chest_accel', 'shank_gyro').
+    file_format : str, optional
+        'png' or 'pdf'. The default is 'png'.
+    max_workers : int, optional
+        Number of worker processes, see gait_batch.map_tasks. The default is None.
+    sensor_configs : dict, optional
+        DetectorConfig per sensor, overriding gait_batch.configs. The default is None.
+    columns : int, optional
+        Time bins of the traces and the scalograms. The default is display_columns.
+    **load_kwargs
+        Passed to gait_io.load_recording (data_dir, crop_start_time, crop_stop_time,
+        resample). fs is always the config rate.
+
+    Returns
+    -------
+    paths : list of str
+        Paths of the written reports, in subject order.
+    errors : dict
+        Traceback of each failed subject, keyed by subject.
+
+    """
+    subject_range = list(subject_range)
+    sensor_configs = {**gait_batch.configs, **(sensor_configs or {})}
+    sensor_configs = {sensor: sensor_configs[sensor] for sensor in sensors}
+    os.makedirs(report_dir, exist_ok=True)
+
+    outputs = gait_batch.map_tasks(partial(report_task, file_format=file_format, columns=columns, **load_kwargs),
+                                   [(subject, sensor_configs, report_dir) for subject in subject_range],
+                                   max_workers)
+
+    paths = []
+    errors = {}
+    for subject, (path, error) in zip(subject_range, outputs):
+        if error is not None:
+            errors[subject] = error
+        else:
+            paths.append(path)
+
+    return paths, errors
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Power analysis and sample size planning for the sensor agreement study.
+
+Every function broadcasts its arguments, so a whole grid of effect sizes, alphas and
+sample sizes is evaluated in one call, e.g.
+    correlation_power(r[:, None, None], n[None, :, None], alpha[None, None, :])
+Correlation power uses the Fisher z approximation (closed form). Paired t-test power
+uses the noncentral t distribution, and its sample sizes come from a vectorized
+bisection over the integers instead of a root-finder per grid point.
+simulate_power checks the analytic power by resampling detected cycles.
+"""
+
+#%% Import Libraries
+
+import numpy as np
+from scipy import stats
+
+import gait_stats
+
+
+#%% Correlation
+
+
+def _z_critical(alpha, alternative):
+    """
+    Critical standard normal value of a one- or two-sided test.
+    """
+    alpha = np.asarray(alpha, dtype=np.float64)
+
+    return stats.norm.isf(alpha / 2 if alternative == 'two-sided' else alpha)
+
+
+def correlation_power(r, n, alpha=0.05, alternative='two-sided'):
+    """
+    Power of the test of zero correlation (Pearson) with the Fisher z approximation.
+
+    Parameters
+    ----------
+    r : float or array of float
+        True correlation (effect size).
+    n : int or array of int
+        Number of paired observations (cycles).
+    alpha : float or array of float, optional
+        Significance level. The default is 0.05.
+    alternative : str, optional
+        'two-sided' or 'larger' (r > 0). The default is 'two-sided'.
+
+    Returns
+    -------
+    power : array of float
+        Power for every broadcast combination of r, n and alpha (nan for n <= 3).
+
+    """
+    r = np.asarray(r, dtype=np.float64)
+    n = np.asarray(n, dtype=np.float64)
+    z_alpha = _z_critical(alpha, alternative)
+
+    with np.errstate(invalid='ignore'):
+        shift = np.arctanh(r) * np.sqrt(n - 3)
+    power = stats.norm.sf(z_alpha - shift)
+    if alternative == 'two-sided':
+        power = power + stats.norm.cdf(-z_alpha - shift)
+
+    return np.where(n > 3, power, np.nan)
+
+
+def correlation_sample_size(r, power=0.8, alpha=0.05, alternative='two-sided'):
+    """
+    Smallest number of cycles that detects correlation r with the given power, in
+    closed form from the Fisher z approximation (ignoring the opposite tail of a
+    two-sided test, which is negligible for the powers of interest).
+
+    Returns
+    -------
+    n : array of int
+        Sample size for every broadcast combination of r, power and alpha.
+
+    """
+    z_alpha = _z_critical(alpha, alternative)
+    z_power = stats.norm.ppf(np.asarray(power, dtype=np.float64))
+    with np.errstate(divide='ignore'):
+        n = ((z_alpha + z_power) / np.arctanh(np.abs(np.asarray(r, dtype=np.float64)))) ** 2 + 3
+
+    return np.ceil(n).astype(np.int64)
+
+
+#%% Paired Test
+
+
+def paired_power(d, n, alpha=0.05, alternative='two-sided'):
+    """
+    Power of the paired t-test of a mean difference between the two sensors.
+
+    Parameters
+    ----------
+    d : float or array of float
+        Standardized mean difference (mean of a - b over the SD of a - b).
+    n : int or array of int
+        Number of pairs (cycles).
+    alpha : float or array of float, optional
+        Significance level. The default is 0.05.
+    alternative : str, optional
+        'two-sided' or 'larger' (d > 0). The default is 'two-sided'.
+
+    Returns
+    -------
+    power : array of float
+        Power for every broadcast combination of d, n and alpha (nan for n < 2).
+
+    """
+    d = np.asarray(d, dtype=np.float64)
+    n = np.asarray(n, dtype=np.float64)
+    alpha = np.asarray(alpha, dtype=np.float64)
+    df = np.maximum(n - 1, 1)
+    nc = d * np.sqrt(n)
+
+    t_critical = stats.t.isf(alpha / 2 if alternative == 'two-sided' else alpha, df)
+    power = stats.nct.sf(t_critical, df, nc)
+    if alternative == 'two-sided':
+        power = power + stats.nct.cdf(-t_critical, df, nc)
+
+    return np.where(n >= 2, power, np.nan)
+
+
+def paired_sample_size(d, power=0.8, alpha=0.05, alternative='two-sided', max_n=100000):
+    """
+    Smallest number of pairs that detects a standardized difference d with the given
+    power. All grid points are solved together by bisection over the integers, about
+    log2(max_n) evaluations of paired_power.
+
+    Returns
+    -------
+    n : array of int
+        Sample size for every broadcast combination of d, power and alpha, max_n + 1
+        if max_n pairs are not enough.
+
+    """
+    d, power, alpha = np.broadcast_arrays(np.abs(np.asarray(d, dtype=np.float64)),
+                                          np.asarray(power, dtype=np.float64),
+                                          np.asarray(alpha, dtype=np.float64))
+    low = np.full(d.shape, 1, dtype=np.int64)     # power(low) < target
+    high = np.full(d.shape, max_n + 1, dtype=np.int64)     # power(high) >= target, or unreachable
+
+    while np.any(high - low > 1):
+        middle = (low + high) // 2
+        reached = paired_power(d, middle, alpha, alternative) >= power
+        high = np.where(reached, middle, high)
+        low = np.where(reached, low, middle)
+
+    return high
+
+
+#%% Power Surfaces
+
+
+def power_grid(effect_sizes, sample_sizes, alphas=0.05, test='correlation', alternative='two-sided'):
+    """
+    Power over the full grid of effect sizes, sample sizes and alphas.
+
+    Parameters
+    ----------
+    effect_sizes : array of float
+        Correlations (test='correlation') or standardized differences (test='paired').
+    sample_sizes : array of int
+        Numbers of cycles.
+    alphas : float or array of float, optional
+        Significance levels. The default is 0.05.
+    test : str, optional
+        'correlation' or 'paired'. The default is 'correlation'.
+    alternative : str, optional
+        'two-sided' or 'larger'. The default is 'two-sided'.
+
+    Returns
+    -------
+    power : 3D array of float
+        power[i, j, k] for effect_sizes[i], sample_sizes[j] and alphas[k].
+
+    """
+    function = {'correlation': correlation_power, 'paired': paired_power}[test]
+
+    return function(np.asarray(effect_sizes, dtype=np.float64)[:, None, None],
+                    np.asarray(sample_sizes)[None, :, None],
+                    np.atleast_1d(np.asarray(alphas, dtype=np.float64))[None, None, :], alternative)
+
+
+#%% Simulation Check
+
+
+def simulate_power(a, b, sample_sizes, alpha=0.05, test='correlation', n_sim=2000, seed=0):
+    """
+    Power at the effect size of the detected cycles, by drawing n_sim samples of each
+    size (with replacement) from the matched cycle values and counting significant
+    tests. All samples of one size are tested at once.
+
+    Parameters
+    ----------
+    a : array of float
+        Metric of the matched cycles of the first sensor (e.g. gyro stance times).
+    b : array of float
+        Same metric of the second sensor, b[i] is the same cycle as a[i].
+    sample_sizes : iterable of int
+        Numbers of cycles to simulate.
+    alpha : float, optional
+        Significance level. The default is 0.05.
+    test : str, optional
+        'correlation' (Pearson, two-sided) or 'paired' (paired t-test, two-sided).
+        The default is 'correlation'.
+    n_sim : int, optional
+        Simulated samples per size. The default is 2000.
+    seed : int, optional
+        Seed of the generator. The default is 0.
+
+    Returns
+    -------
+    result : dict
+        'effect_size' : observed r or d of all cycles
+        'simulated' : simulated power of each sample size
+        'analytic' : power of each sample size from correlation_power / paired_power
+
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    sample_sizes = np.asarray(list(sample_sizes))
+    rng = np.random.default_rng(seed)
+
+    if test == 'correlation':
+        effect_size = np.corrcoef(a, b)[0, 1]
+        analytic = correlation_power(effect_size, sample_sizes, alpha)
+    else:
+        difference = a - b
+        effect_size = difference.mean() / difference.std(ddof=1)
+        analytic = paired_power(effect_size, sample_sizes, alpha)
+
+    simulated = np.empty(len(sample_sizes))
+    for i, n in enumerate(sample_sizes):
+        draws = rng.integers(0, len(a), (n_sim, n))
+        sample_a, sample_b = a[draws], b[draws]
+
+        if test == 'correlation':
+            da = sample_a - sample_a.mean(axis=1, keepdims=True)
+            db = sample_b - sample_b.mean(axis=1, keepdims=True)
+            moments = {'saa': (da * da).sum(axis=1), 'sbb': (db * db).sum(axis=1), 'sab': (da * db).sum(axis=1)}
+            p = gait_stats._correlation_p(gait_stats._correlation(moments), n)
+        else:
+            difference = sample_a - sample_b
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = difference.mean(axis=1) / (difference.std(axis=1, ddof=1) / np.sqrt(n))
+            p = 2 * stats.t.sf(np.abs(t), max(n - 1, 1))
+
+        # samples with no variance have no p-value and count as not significant
+        simulated[i] = np.mean(np.nan_to_num(p, nan=1.0) <= alpha)
+
+    return {'effect_size': effect_size, 'simulated': simulated, 'analytic': analytic}
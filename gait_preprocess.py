@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Preprocessing ahead of detection: timestamp checks and resampling to the rate the
+detector scales were chosen for.
+
+The wavelet scales in gait_metrics are in samples at DetectorConfig.fs (125 Hz), which
+is DetectorConfig.width_seconds in time. gait_io.load_recording (and the csv reader of
+gait_cli) infer the rate of every recording from its timestamps, crop it by time and
+pass it to prepare_recording: a recording at another rate is an error unless resampling
+was asked for, in which case a 1000 Hz device is decimated to config.fs before the
+wavelet transform instead of being transformed at the full rate. Recordings at the
+expected rate are never re-gridded unless asked, so event indices keep pointing at the
+recorded rows.
+
+Recordings are DataFrames or samples x columns arrays (column 0 is time); pandas is
+only imported to resample a DataFrame.
+"""
+
+#%% Import Libraries
+
+import warnings
+from fractions import Fraction
+
+import numpy as np
+from scipy import signal
+
+
+#%% Define Parameters
+
+# plausible sampling rates (Hz), a rate outside them means the time column is not in
+# seconds (e.g. milliseconds or microseconds)
+min_fs = 1.0
+max_fs = 10000.0
+# largest factor by which resampling may change the number of samples
+max_resample_ratio = 100
+# relative difference from the expected rate that is still treated as the same rate
+rate_tolerance = 0.01
+# first rows of a recording whose timestamps give its rate for the crop
+rate_rows = 1000
+
+
+#%% Timestamp Checks
+
+
+def check_timestamps(time_s, gap_factor=1.5, jitter_tolerance=0.01):
+    """
+    Estimates the sampling rate and checks that the timestamps are regular.
+
+    Parameters
+    ----------
+    time_s : array of float
+        Timestamps (seconds).
+    gap_factor : float, optional
+        A step longer than gap_factor times the median step is a gap (dropout).
+        The default is 1.5.
+    jitter_tolerance : float, optional
+        Largest relative standard deviation of the steps (outside of gaps) for the
+        timestamps to count as regular. The default is 0.01.
+
+    Returns
+    -------
+    timing : dict
+        'fs' : sampling rate from the median step (Hz)
+        'jitter' : relative standard deviation of the steps outside of gaps
+        'gaps' : array of int, index of the sample before each gap
+        'regular' : True if there are no gaps or backwards steps and the jitter is
+        within jitter_tolerance
+
+    """
+    time_s = np.asarray(time_s, dtype=np.float64)
+    dt = np.diff(time_s)
+    if len(dt) == 0:
+        return {'fs': np.nan, 'jitter': np.nan, 'gaps': np.array([], dtype=np.int64), 'regular': False}
+
+    median_dt = np.median(dt)
+    gaps = np.flatnonzero(dt > gap_factor * median_dt)
+    in_gap = np.zeros(len(dt), dtype=bool)
+    in_gap[gaps] = True
+    steady_dt = dt[~in_gap]
+    jitter = np.std(steady_dt) / median_dt if len(steady_dt) else np.nan
+
+    regular = len(gaps) == 0 and np.all(dt > 0) and jitter <= jitter_tolerance
+
+    return {'fs': 1 / median_dt, 'jitter': jitter, 'gaps': gaps, 'regular': bool(regular)}
+
+
+def check_rate(fs, target_fs=None):
+    """
+    Raises ValueError if the sampling rate inferred from the timestamps is outside
+    min_fs to max_fs, or if resampling it to target_fs would change the number of
+    samples by more than max_resample_ratio.
+
+    Parameters
+    ----------
+    fs : float
+        Sampling rate of the recording, e.g. check_timestamps(time_s)['fs'] (Hz).
+    target_fs : float, optional
+        Rate the recording is resampled to (Hz). The default is None (not resampled).
+
+    """
+    if not (np.isfinite(fs) and min_fs <= fs <= max_fs):
+        raise ValueError(f'the timestamps give a sampling rate of {fs:.4g} Hz, outside {min_fs:g} to {max_fs:g} Hz; '
+                         f'the time column must be in seconds (not milliseconds or microseconds)')
+
+    if target_fs is not None and max(target_fs / fs, fs / target_fs) > max_resample_ratio:
+        raise ValueError(f'resampling from {fs:.4g} Hz to {target_fs:.4g} Hz changes the number of samples by more '
+                         f'than {max_resample_ratio}x')
+
+
+def plausible_rate(rate, fs):
+    """
+    Returns the sampling rate inferred from the timestamps, or the nominal fs if the
+    inferred rate is outside min_fs to max_fs. The sensor files may store POSIX time in
+    microseconds (or milliseconds), which gives a rate of about 1e-4 Hz; such
+    recordings are taken to be at fs, as recorded, with a warning.
+
+    Parameters
+    ----------
+    rate : float
+        Rate inferred from the timestamps, check_timestamps(time_s)['fs'] (Hz).
+    fs : float
+        Nominal sampling rate (Hz).
+
+    Returns
+    -------
+    rate : float
+        Inferred rate, or fs (Hz).
+    plausible : bool
+        False if the inferred rate was replaced by fs.
+
+    """
+    if np.isfinite(rate) and min_fs <= rate <= max_fs:
+        return rate, True
+
+    warnings.warn(f'the timestamps give a sampling rate of {rate:.4g} Hz, outside {min_fs:g} to {max_fs:g} Hz '
+                  f'(time not in seconds?); the recording is taken to be at {fs:g} Hz as recorded', stacklevel=3)
+
+    return fs, False
+
+
+#%% Cropping
+
+
+def crop_rows(head_time, crop_start_time, crop_stop_time, fs):
+    """
+    Converts a crop in seconds to rows, at the rate inferred from the first timestamps
+    of the recording (see plausible_rate). A rate within rate_tolerance of fs, or an
+    implausible rate, is taken as fs, so the rows are crop_time * fs as in the csv
+    files with microsecond timestamps.
+
+    Parameters
+    ----------
+    head_time : array of float
+        First timestamps of the recording (seconds), e.g. its first 1000 rows.
+    crop_start_time : float
+        Start of the section in seconds. None is the first row.
+    crop_stop_time : float
+        End of the section in seconds. None is the last row.
+    fs : float
+        Expected sampling rate (Hz).
+
+    Returns
+    -------
+    start : int
+        First row of the section.
+    stop : int
+        One past the last row of the section, None for the last row.
+
+    """
+    rate = fs
+    if crop_start_time is not None or crop_stop_time is not None:
+        recorded_fs, _ = plausible_rate(check_timestamps(head_time)['fs'], fs)
+        if abs(recorded_fs - fs) > rate_tolerance * fs:
+            rate = recorded_fs
+
+    # the small offset keeps int() from rounding 7499.999... down
+    start = 0 if crop_start_time is None else int(crop_start_time * rate + 1e-6)
+    stop = None if crop_stop_time is None else max(int(crop_stop_time * rate + 1e-6), start)
+
+    return start, stop
+
+
+#%% Resampling
+
+
+def _time_column(data):
+    """
+    Returns column 0 (time) of a DataFrame or array as float64.
+    """
+    return np.asarray(data[:, 0] if isinstance(data, np.ndarray) else data.iloc[:, 0], dtype=np.float64)
+
+
+def resample_recording(data, target_fs, timing=None, max_denominator=1000):
+    """
+    Resamples every column of a recording to target_fs. Regular recordings use a
+    polyphase filter (signal.resample_poly, with anti-aliasing when decimating) on all
+    sensor columns at once. Recordings with gaps or jitter are linearly interpolated
+    onto a uniform time grid at a multiple of target_fs no lower than their own rate,
+    which is then low-pass filtered and decimated to target_fs the same way. Raises
+    ValueError if the rate or the resampling ratio is implausible (see check_rate).
+
+    Parameters
+    ----------
+    data : DataFrame or samples x columns array of float
+        Recording, column 0 is time (seconds).
+    target_fs : float
+        Sampling rate of the output (Hz).
+    timing : dict, optional
+        Output of check_timestamps for this recording. The default is None (computed).
+    max_denominator : int, optional
+        Largest down factor of the polyphase ratio. The default is 1000.
+
+    Returns
+    -------
+    resampled : DataFrame or array of float
+        Recording on a uniform time grid at target_fs, same columns (and type) as data.
+
+    """
+    time_s = _time_column(data)
+    values = np.asarray(data[:, 1:] if isinstance(data, np.ndarray) else data.iloc[:, 1:], dtype=np.float64)
+    if timing is None:
+        timing = check_timestamps(time_s)
+    check_rate(timing['fs'], target_fs)
+
+    if timing['regular']:
+        # polyphase filter on every sensor column in one call
+        ratio = Fraction(target_fs / timing['fs']).limit_denominator(max_denominator)
+        resampled_values = signal.resample_poly(values, ratio.numerator, ratio.denominator, axis=0)
+        new_time = time_s[0] + np.arange(len(resampled_values)) / target_fs
+    else:
+        # uniform grid over the recorded span, interpolated across jitter and gaps at
+        # factor x target_fs so that interpolation itself does not decimate
+        factor = max(int(np.ceil(timing['fs'] / target_fs)), 1)
+        n_samples = int(np.floor((time_s[-1] - time_s[0]) * target_fs)) + 1
+        fine_time = time_s[0] + np.arange((n_samples - 1) * factor + 1) / (target_fs * factor)
+        order = np.argsort(time_s, kind='stable')
+        resampled_values = np.column_stack([np.interp(fine_time, time_s[order], values[order, i])
+                                            for i in range(values.shape[1])])
+        if factor > 1:
+            # anti-aliasing low-pass and decimation to target_fs, n_samples rows
+            resampled_values = signal.resample_poly(resampled_values, 1, factor, axis=0)
+        new_time = time_s[0] + np.arange(n_samples) / target_fs
+
+    if isinstance(data, np.ndarray):
+        return np.column_stack([new_time, resampled_values])
+
+    import pandas as pd
+
+    resampled = pd.DataFrame(resampled_values, columns=data.columns[1:])
+    resampled.insert(0, data.columns[0], new_time)
+
+    return resampled
+
+
+def prepare_recording(data, fs, resample=False):
+    """
+    Checks the timestamps of a recording against the expected rate fs and resamples
+    it to fs if asked. Recordings are only re-gridded when resample is True, so without
+    it the rows are always the recorded rows.
+
+    Parameters
+    ----------
+    data : DataFrame or samples x columns array of float
+        Recording, column 0 is time (seconds).
+    fs : float
+        Expected sampling rate, e.g. DetectorConfig.fs (Hz).
+    resample : bool, optional
+        Resample to fs recordings at another rate or with irregular timestamps (jitter
+        or gaps). If False, a recording at another rate raises ValueError and irregular
+        timestamps are kept as recorded. The default is False. Recordings whose
+        timestamps give an implausible rate (see plausible_rate) are never resampled.
+
+    Returns
+    -------
+    data : DataFrame or array of float
+        The recording, unchanged (no copy) unless it was resampled.
+    timing : dict
+        Output of check_timestamps for the input recording.
+
+    """
+    timing = check_timestamps(_time_column(data))
+    if len(data) < 2:
+        # no step to check or resample
+        return data, timing
+
+    if not plausible_rate(timing['fs'], fs)[1]:
+        return data, timing
+
+    check_rate(timing['fs'], fs if resample else None)
+    same_rate = abs(timing['fs'] - fs) <= rate_tolerance * fs
+
+    if same_rate and (timing['regular'] or not resample):
+        return data, timing
+
+    if not resample:
+        raise ValueError(f'the recording is at {timing["fs"]:.4g} Hz, not {fs:g} Hz; load it with resample=True '
+                         f'to resample it to {fs:g} Hz')
+
+    return resample_recording(data, fs, timing), timing
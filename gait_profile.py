@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stage timing for the gait pipeline.
+
+The loaders, detectors and plotting functions wrap their expensive steps in
+gait_profile.stage('name'). While no reporter is registered, stage returns a shared
+no-op context manager, so the instrumentation costs one function call. Registering a
+reporter (any callable taking an event dict) turns the timers on:
+
+    with gait_profile.profiling() as recorder:
+        gm.detect_shank_gyro_events(data)
+    recorder.to_chrome_trace('trace.json')   # open in chrome://tracing or Perfetto
+
+Each event is a dict with 'name', 'start' (wall clock, seconds), 'duration' (seconds),
+'pid', 'thread', 'metadata' and, if allocation tracking is on, 'alloc_bytes' (change in
+memory traced by tracemalloc over the stage).
+"""
+
+#%% Import Libraries
+
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+#%% Reporters
+
+_reporters = []
+_track_allocations = False
+_started_tracemalloc = False
+_null_stage = contextlib.nullcontext()
+
+
+def enable(reporter, track_allocations=False):
+    """
+    Registers a reporter, called with every finished stage event.
+
+    Parameters
+    ----------
+    reporter : function
+        Called as reporter(event).
+    track_allocations : bool, optional
+        Also record the memory allocated in each stage (starts tracemalloc, which slows
+        down allocations). The default is False.
+
+    """
+    global _track_allocations, _started_tracemalloc
+
+    _reporters.append(reporter)
+    if track_allocations:
+        _track_allocations = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracemalloc = True
+
+
+def disable(reporter=None):
+    """
+    Removes a reporter, or all of them if reporter is None. Allocation tracking stops
+    when no reporter is left.
+    """
+    global _track_allocations, _started_tracemalloc
+
+    if reporter is None:
+        _reporters.clear()
+    elif reporter in _reporters:
+        _reporters.remove(reporter)
+
+    if not _reporters:
+        _track_allocations = False
+        if _started_tracemalloc:
+            _started_tracemalloc = False
+            tracemalloc.stop()
+
+
+def enabled():
+    """
+    Returns True if any reporter is registered.
+    """
+    return bool(_reporters)
+
+
+#%% Stages
+
+
+class _Stage:
+    """
+    Timer of one stage, reports its event to every reporter on exit.
+    """
+    __slots__ = ('name', 'metadata', 'start', 'start_counter', 'start_memory')
+
+    def __init__(self, name, metadata):
+        self.name = name
+        self.metadata = metadata
+
+    def __enter__(self):
+        self.start_memory = tracemalloc.get_traced_memory()[0] if _track_allocations else None
+        self.start = time.time()
+        self.start_counter = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start_counter
+        event = {'name': self.name, 'start': self.start, 'duration': duration, 'pid': os.getpid(),
+                 'thread': threading.get_ident(), 'metadata': self.metadata}
+        if self.start_memory is not None and tracemalloc.is_tracing():
+            event['alloc_bytes'] = tracemalloc.get_traced_memory()[0] - self.start_memory
+
+        for reporter in list(_reporters):
+            reporter(event)
+
+        return False
+
+
+def stage(name, **metadata):
+    """
+    Context manager timing one stage of the pipeline.
+
+    Parameters
+    ----------
+    name : str
+        Stage name, e.g. 'read_csv', 'wavelet' or 'find_peaks'.
+    **metadata
+        Extra values stored with the event (e.g. file name, subject).
+
+    Returns
+    -------
+    timer : context manager
+        A no-op if profiling is disabled.
+
+    """
+    if not _reporters:
+        return _null_stage
+
+    return _Stage(name, metadata)
+
+
+#%% Recorder
+
+
+class Recorder:
+    """
+    Reporter that keeps every event, with summaries and JSON / Chrome trace export.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def extend(self, events):
+        """
+        Adds events recorded elsewhere, e.g. returned by worker processes.
+        """
+        self.events.extend(events)
+
+    def summary(self):
+        """
+        Returns count, total, mean and max duration (seconds), and total allocated
+        bytes if tracked, of every stage name.
+        """
+        return summarize(self.events)
+
+    def to_json(self, path=None):
+        """
+        Returns the events as a JSON string, and writes it to path if given.
+        """
+        return _dump({'events': self.events, 'summary': self.summary()}, path)
+
+    def to_chrome_trace(self, path=None):
+        """
+        Returns the events in Chrome trace event format, and writes them to path if given.
+        """
+        return _dump(chrome_trace(self.events), path)
+
+
+def summarize(events):
+    """
+    Aggregates events by stage name (see Recorder.summary).
+    """
+    summary = {}
+    for event in events:
+        stage_summary = summary.setdefault(event['name'], {'count': 0, 'total': 0.0, 'max': 0.0})
+        stage_summary['count'] += 1
+        stage_summary['total'] += event['duration']
+        stage_summary['max'] = max(stage_summary['max'], event['duration'])
+        if 'alloc_bytes' in event:
+            stage_summary['alloc_bytes'] = stage_summary.get('alloc_bytes', 0) + event['alloc_bytes']
+
+    for stage_summary in summary.values():
+        stage_summary['mean'] = stage_summary['total'] / stage_summary['count']
+
+    return summary
+
+
+def chrome_trace(events):
+    """
+    Converts events to the Chrome trace event format (complete 'X' events, microseconds).
+    """
+    trace_events = []
+    for event in events:
+        args = dict(event['metadata'])
+        if 'alloc_bytes' in event:
+            args['alloc_bytes'] = event['alloc_bytes']
+        trace_events.append({'name': event['name'], 'ph': 'X', 'ts': event['start'] * 1e6,
+                             'dur': event['duration'] * 1e6, 'pid': event['pid'], 'tid': event['thread'],
+                             'args': args})
+
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+def _dump(content, path):
+    """
+    Serializes content to JSON, writing it to path if given.
+    """
+    text = json.dumps(content, default=str)
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(text)
+
+    return text
+
+
+@contextlib.contextmanager
+def profiling(reporter=None, track_allocations=False):
+    """
+    Enables profiling inside a with block.
+
+    Parameters
+    ----------
+    reporter : function, optional
+        Reporter to register. The default is a new Recorder.
+    track_allocations : bool, optional
+        Also record allocated memory per stage. The default is False.
+
+    Yields
+    ------
+    reporter : function
+        The registered reporter.
+
+    """
+    if reporter is None:
+        reporter = Recorder()
+
+    enable(reporter, track_allocations)
+    try:
+        yield reporter
+    finally:
+        disable(reporter)
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Agreement statistics between two sensors over the matched gait cycles of many subjects.
+
+Every statistic is computed from grouped sums (np.add.reduceat over cycles sorted by
+group), so one pass gives the Pearson and Spearman correlations, Bland-Altman limits
+and ICC of every subject and of the pooled cohort, for every metric at once. Bootstrap
+replicates are multinomial counts of the distinct (a, b) pairs, so each batch of
+replicates is a few matrix products instead of a loop over resampled copies.
+"""
+
+#%% Import Libraries
+
+import numpy as np
+from scipy import stats
+
+import gait_metrics as gm
+
+
+#%% Define Parameters
+
+metrics = ('stance', 'swing', 'stride')    # cycle durations compared between sensors
+pooled = -1     # subject number of the pooled rows of agreement tables
+_max_bootstrap_elements = 2 ** 20    # replicates x value pairs per bootstrap batch, bounds memory
+
+# fields of the table returned by cycle_agreement
+agreement_dtype = np.dtype([('subject', np.int64), ('metric', 'U16'), ('n', np.int64),
+                            ('mean_a', np.float64), ('mean_b', np.float64),
+                            ('pearson_r', np.float64), ('pearson_p', np.float64),
+                            ('pearson_low', np.float64), ('pearson_high', np.float64),
+                            ('spearman_r', np.float64), ('spearman_p', np.float64),
+                            ('spearman_low', np.float64), ('spearman_high', np.float64),
+                            ('bias', np.float64), ('loa_lower', np.float64), ('loa_upper', np.float64),
+                            ('bias_low', np.float64), ('bias_high', np.float64),
+                            ('icc', np.float64), ('icc_low', np.float64), ('icc_high', np.float64)])
+
+
+#%% Grouped Statistics
+
+
+def _group_starts(groups):
+    """
+    Returns the start of each run of equal values in sorted groups.
+    """
+    return np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+
+
+def _group_ranks(groups, values):
+    """
+    Ranks values within each group (average rank for ties), for every column.
+
+    Parameters
+    ----------
+    groups : array of int
+        Group of each row, sorted.
+    values : n x k array of float
+        Values to rank.
+
+    Returns
+    -------
+    ranks : n x k array of float
+        Rank of each value in its group, starting at 1.
+
+    """
+    n = len(groups)
+    starts = _group_starts(groups)
+    group_start = np.repeat(starts, np.diff(np.r_[starts, n]))
+    ranks = np.empty(values.shape)
+
+    for j in range(values.shape[1]):
+        order = np.lexsort((values[:, j], groups))
+        sorted_values = values[order, j]
+        ordinal = np.arange(n) - group_start + 1.0
+
+        # runs of tied values within a group share their mean ordinal rank
+        tie_starts = np.flatnonzero(np.r_[True, (groups[order][1:] != groups[order][:-1]) |
+                                          (sorted_values[1:] != sorted_values[:-1])])
+        tie_lengths = np.diff(np.r_[tie_starts, n])
+        mean_rank = np.add.reduceat(ordinal, tie_starts) / tie_lengths
+        ranks[order, j] = np.repeat(mean_rank, tie_lengths)
+
+    return ranks
+
+
+def _group_moments(groups, a, b):
+    """
+    Returns the count, means and centred sums of squares and products of a and b in
+    each group (rows sorted by group), every moment a (groups x k) array.
+    """
+    starts = _group_starts(groups)
+    counts = np.diff(np.r_[starts, len(groups)])[:, None]
+    mean_a = np.add.reduceat(a, starts, axis=0) / counts
+    mean_b = np.add.reduceat(b, starts, axis=0) / counts
+
+    # centre on the group means before the products, for numerical stability
+    da = a - np.repeat(mean_a, counts[:, 0], axis=0)
+    db = b - np.repeat(mean_b, counts[:, 0], axis=0)
+
+    return {'n': counts, 'mean_a': mean_a, 'mean_b': mean_b,
+            'saa': np.add.reduceat(da * da, starts, axis=0),
+            'sbb': np.add.reduceat(db * db, starts, axis=0),
+            'sab': np.add.reduceat(da * db, starts, axis=0)}
+
+
+def _correlation(moments):
+    """
+    Pearson correlation of every group and column.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return moments['sab'] / np.sqrt(moments['saa'] * moments['sbb'])
+
+
+def _correlation_p(r, n):
+    """
+    Two-sided p-value of a correlation with the t distribution (as scipy.stats.pearsonr
+    and spearmanr).
+    """
+    df = n - 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = r * np.sqrt(df / ((1 - r) * (1 + r)))
+
+    return np.where(df > 0, 2 * stats.t.sf(np.abs(t), np.maximum(df, 1)), np.nan)
+
+
+def _bland_altman(moments, z=1.96):
+    """
+    Bias (mean of a - b) and limits of agreement (bias +- z SD of a - b) of every group
+    and column.
+    """
+    bias = moments['mean_a'] - moments['mean_b']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sd = np.sqrt((moments['saa'] + moments['sbb'] - 2 * moments['sab']) / (moments['n'] - 1))
+
+    return bias, bias - z * sd, bias + z * sd
+
+
+def _icc(moments):
+    """
+    ICC(2,1), two-way random effects, absolute agreement, of the two sensors (raters)
+    over the cycles (targets) of every group and column.
+    """
+    n = moments['n']
+    # two-way ANOVA sums of squares from the centred moments
+    ss_rows = (moments['saa'] + 2 * moments['sab'] + moments['sbb']) / 2
+    ss_raters = n * (moments['mean_a'] - moments['mean_b']) ** 2 / 2
+    ss_error = (moments['saa'] + moments['sbb']) / 2 - moments['sab']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ms_rows = ss_rows / (n - 1)
+        ms_error = ss_error / (n - 1)
+        return (ms_rows - ms_error) / (ms_rows + ms_error + 2 * (ss_raters - ms_error) / n)
+
+
+def _statistics(groups, a, b):
+    """
+    Point estimates of every statistic of every group (rows sorted by group).
+    """
+    moments = _group_moments(groups, a, b)
+    rank_moments = _group_moments(groups, _group_ranks(groups, a), _group_ranks(groups, b))
+    bias, loa_lower, loa_upper = _bland_altman(moments)
+
+    return {'n': moments['n'], 'mean_a': moments['mean_a'], 'mean_b': moments['mean_b'],
+            'pearson_r': _correlation(moments), 'spearman_r': _correlation(rank_moments),
+            'bias': bias, 'loa_lower': loa_lower, 'loa_upper': loa_upper, 'icc': _icc(moments)}
+
+
+#%% Bootstrap
+
+
+def _run_ranks(counts, starts):
+    """
+    Average ranks of sorted values drawn counts times (R x cells), where starts are the
+    first cells of each run of equal values: a value takes the mean of the ranks after
+    every smaller drawn value.
+    """
+    cumulative = np.cumsum(counts, axis=1)
+    before = cumulative[:, starts] - counts[:, starts]
+    totals = np.add.reduceat(counts, starts, axis=1)
+
+    return np.repeat(before + (totals + 1) / 2, np.diff(np.r_[starts, counts.shape[1]]), axis=1)
+
+
+def _pair_moments(counts, a, b):
+    """
+    Moments of a and b (as _group_moments) in every bootstrap replicate, where counts
+    (R x cells) holds the number of draws of each (a, b) pair.
+    """
+    n = counts.sum(axis=1)
+    mean_a = counts @ a / n
+    mean_b = counts @ b / n
+
+    return {'n': n, 'mean_a': mean_a, 'mean_b': mean_b,
+            'saa': counts @ (a * a) - n * mean_a ** 2,
+            'sbb': counts @ (b * b) - n * mean_b ** 2,
+            'sab': counts @ (a * b) - n * mean_a * mean_b}
+
+
+def _bootstrap_metric(a, b, n_boot, rng):
+    """
+    Bootstrap replicates of pearson_r, spearman_r, bias and icc of one metric.
+
+    Every statistic depends on the cycles only through their (a, b) values, so the
+    cycles are collapsed to their distinct (a, b) pairs and a replicate is a
+    multinomial draw of pair counts. Durations are multiples of 1 / fs, so there are
+    far fewer pairs than cycles and a batch of replicates is a few matrix products.
+
+    Returns
+    -------
+    replicates : dict
+        Array of n_boot values keyed by statistic.
+
+    """
+    m = len(a)
+    # a shift common to both sensors leaves every statistic unchanged and keeps the
+    # uncentred sums well conditioned
+    shift = (a.mean() + b.mean()) / 2
+    pairs, pair_counts = np.unique(np.column_stack([a - shift, b - shift]), axis=0, return_counts=True)
+    pair_a, pair_b = pairs[:, 0], pairs[:, 1]
+
+    # pairs are sorted by a, and order_b sorts them by b
+    starts_a = _group_starts(pair_a)
+    order_b = np.argsort(pair_b, kind='stable')
+    starts_b = _group_starts(pair_b[order_b])
+
+    names = ('pearson_r', 'spearman_r', 'bias', 'icc')
+    replicates = {name: [] for name in names}
+    batch = max(1, _max_bootstrap_elements // len(pairs))
+    for first in range(0, n_boot, batch):
+        counts = rng.multinomial(m, pair_counts / m, size=min(batch, n_boot - first)).astype(np.float64)
+
+        rank_a = _run_ranks(counts, starts_a) - (m + 1) / 2
+        rank_b = np.empty_like(rank_a)
+        rank_b[:, order_b] = _run_ranks(counts[:, order_b], starts_b) - (m + 1) / 2
+
+        moments = _pair_moments(counts, pair_a, pair_b)
+        rank_moments = {'saa': np.einsum('rc,rc->r', counts, rank_a * rank_a),
+                        'sbb': np.einsum('rc,rc->r', counts, rank_b * rank_b),
+                        'sab': np.einsum('rc,rc->r', counts, rank_a * rank_b)}
+        replicates['pearson_r'].append(_correlation(moments))
+        replicates['spearman_r'].append(_correlation(rank_moments))
+        replicates['bias'].append(_bland_altman(moments)[0])
+        replicates['icc'].append(_icc(moments))
+
+    return {name: np.concatenate(values) for name, values in replicates.items()}
+
+
+def _bootstrap(groups, a, b, n_boot, ci, rng):
+    """
+    Percentile bootstrap intervals of pearson_r, spearman_r, bias and icc of every
+    group and metric, resampling cycles within each group (each metric is resampled
+    on its own, the intervals are marginal).
+
+    Returns
+    -------
+    intervals : dict
+        (low, high) arrays (groups x k) keyed by statistic.
+
+    """
+    starts = _group_starts(groups)
+    stops = np.r_[starts[1:], len(groups)]
+    alpha = (1 - ci) / 2
+    intervals = {name: (np.empty((len(starts), a.shape[1])), np.empty((len(starts), a.shape[1])))
+                 for name in ('pearson_r', 'spearman_r', 'bias', 'icc')}
+
+    for g, (start, stop) in enumerate(zip(starts, stops)):
+        for j in range(a.shape[1]):
+            replicates = _bootstrap_metric(a[start:stop, j], b[start:stop, j], n_boot, rng)
+            for name, values in replicates.items():
+                with np.errstate(invalid='ignore'):
+                    low, high = np.nanquantile(values, [alpha, 1 - alpha]) if np.any(np.isfinite(values)) \
+                        else (np.nan, np.nan)
+                intervals[name][0][g, j] = low
+                intervals[name][1][g, j] = high
+
+    return intervals
+
+
+#%% Agreement Table
+
+
+def cycle_agreement(cycles_a, cycles_b, metrics=metrics, n_boot=1000, ci=0.95, per_subject=True, seed=0):
+    """
+    Agreement between two sensors on matched cycles, per subject and pooled over the
+    cohort, for every metric.
+
+    Parameters
+    ----------
+    cycles_a : structured array
+        Matched cycles of the first sensor, with a 'subject' field and one field per
+        metric (e.g. from match_subject_cycles).
+    cycles_b : structured array
+        Matched cycles of the second sensor, cycles_b[i] is the same cycle as cycles_a[i].
+    metrics : iterable of str, optional
+        Fields to compare. The default is ('stance', 'swing', 'stride').
+    n_boot : int, optional
+        Bootstrap replicates for the confidence intervals, 0 skips them (nan). The
+        default is 1000.
+    ci : float, optional
+        Confidence level of the intervals. The default is 0.95.
+    per_subject : bool, optional
+        Also compute a row per subject. The default is True.
+    seed : int, optional
+        Seed of the bootstrap. The default is 0.
+
+    Returns
+    -------
+    table : structured array
+        One row per (subject, metric), pooled rows first with subject == pooled (-1),
+        see agreement_dtype. bias and the limits of agreement are of a - b.
+
+    """
+    metrics = list(metrics)
+    a = np.column_stack([np.asarray(cycles_a[metric], dtype=np.float64) for metric in metrics])
+    b = np.column_stack([np.asarray(cycles_b[metric], dtype=np.float64) for metric in metrics])
+
+    # pooled cohort, then every subject, as groups of one computation
+    subjects = np.asarray(cycles_a['subject'])
+    labels = [np.full(len(subjects), pooled)]
+    if per_subject:
+        labels.append(subjects)
+    labels = np.concatenate(labels)
+    rows = np.tile(np.arange(len(subjects)), len(labels) // max(len(subjects), 1))
+    order = np.argsort(labels, kind='stable')
+    labels, rows = labels[order], rows[order]
+
+    group_labels = labels[_group_starts(labels)] if len(labels) else labels
+    table = np.zeros((len(group_labels), len(metrics)), dtype=agreement_dtype)
+    table['subject'] = group_labels[:, None]
+    table['metric'] = metrics
+    for name in agreement_dtype.names[3:]:
+        table[name] = np.nan
+
+    if len(labels) == 0:
+        return table.ravel()
+
+    point = _statistics(labels, a[rows], b[rows])
+    for name, value in point.items():
+        table[name] = value
+    table['pearson_p'] = _correlation_p(point['pearson_r'], point['n'])
+    table['spearman_p'] = _correlation_p(point['spearman_r'], point['n'])
+
+    if n_boot:
+        intervals = _bootstrap(labels, a[rows], b[rows], n_boot, ci, np.random.default_rng(seed))
+        for name, prefix in [('pearson_r', 'pearson'), ('spearman_r', 'spearman'), ('bias', 'bias'), ('icc', 'icc')]:
+            table[f'{prefix}_low'], table[f'{prefix}_high'] = intervals[name]
+
+    return table.ravel()
+
+
+def match_subject_cycles(cycles_a, cycles_b, fs=125, tolerance=0.2, valid_only=True):
+    """
+    Matches the cycles of two sensors by HS time within each subject (see gm.match_cycles).
+
+    Parameters
+    ----------
+    cycles_a : structured array
+        Cycles of the first sensor with a 'subject' field, e.g. gait_store.load_cycles.
+    cycles_b : structured array
+        Cycles of the second sensor with a 'subject' field.
+    fs : float, optional
+        Sampling frequency. The default is 125.
+    tolerance : float, optional
+        Largest allowed difference between matched HS (seconds). The default is 0.2.
+    valid_only : bool, optional
+        Only match cycles flagged as valid. The default is True.
+
+    Returns
+    -------
+    matched_a : structured array
+        Matched cycles of the first sensor, in subject order.
+    matched_b : structured array
+        Matched cycles of the second sensor, matched_b[i] is the same cycle as matched_a[i].
+
+    """
+    # sort by subject once (stable, cycles keep their order), then match slice by slice
+    cycles_a = cycles_a[np.argsort(cycles_a['subject'], kind='stable')]
+    cycles_b = cycles_b[np.argsort(cycles_b['subject'], kind='stable')]
+    subjects, starts_a = np.unique(cycles_a['subject'], return_index=True)
+    stops_a = np.append(starts_a[1:], len(cycles_a))
+    starts_b = np.searchsorted(cycles_b['subject'], subjects, side='left')
+    stops_b = np.searchsorted(cycles_b['subject'], subjects, side='right')
+
+    matched_a = []
+    matched_b = []
+    for start_a, stop_a, start_b, stop_b in zip(starts_a, stops_a, starts_b, stops_b):
+        subject_a, subject_b = gm.match_cycles(cycles_a[start_a:stop_a], cycles_b[start_b:stop_b],
+                                               fs=fs, tolerance=tolerance, valid_only=valid_only)
+        matched_a.append(subject_a)
+        matched_b.append(subject_b)
+
+    if not matched_a:
+        return cycles_a[:0], cycles_b[:0]
+
+    return np.concatenate(matched_a), np.concatenate(matched_b)
+
+
+def correlation_strength(r, moderate=0.3, strong=0.6):
+    """
+    Labels correlation coefficients as 'weak' (r <= moderate), 'moderate' or 'strong'
+    (r > strong).
+    """
+    r = np.asarray(r)
+
+    return np.select([r > strong, r > moderate], ['strong', 'moderate'], 'weak')
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent store of detected events and gait cycles.
+
+Each (subject, sensor, detector config) has one entry, {store_dir}/s{subject}_{sensor}_{config hash}.npz,
+holding the HS and TO indices and one array per column of the pair_gait_events cycle
+table. Every entry records the key of its inputs (csv file path, size and mtime, load
+parameters, config), so update_store only reruns the subjects whose files or
+parameters changed, and the statistics read the cycles back with load_cycles.
+
+Reading the store needs only numpy: gait_batch and gait_io (and with them pandas) are
+imported only when recordings are loaded or a default config is looked up, so gait_cli
+stats without --update stays light.
+"""
+
+#%% Import Libraries
+
+import dataclasses
+import glob
+import hashlib
+import inspect
+import json
+import os
+import traceback
+from functools import partial
+
+import numpy as np
+
+import gait_metrics as gm
+
+
+#%% Define Parameters
+
+store_dir = 'results'   # folder of the result store
+store_version = 1   # bump when detection or pairing changes, so every entry is recomputed
+
+# fields of the table returned by load_cycles
+stored_cycle_dtype = np.dtype([('subject', np.int64)] + gm.paired_cycle_dtype.descr)
+
+# load_recording arguments that do not change the loaded rows
+_ignored_load_args = ('subject', 'file_type', 'cache_dir')
+
+
+#%% Keys
+
+
+def config_hash(config):
+    """
+    Returns a short hash of every field of a DetectorConfig. The mother wavelet is
+    hashed by its qualified name.
+    """
+    fields = {}
+    for field in dataclasses.fields(config):
+        value = getattr(config, field.name)
+        if callable(value):
+            value = f'{value.__module__}.{value.__qualname__}'
+        fields[field.name] = value
+    source = json.dumps(fields, sort_keys=True, default=str)
+
+    return hashlib.sha1(source.encode()).hexdigest()[:12]
+
+
+def input_key(subject, sensor, config, bouts=False, **load_kwargs):
+    """
+    Returns a key that changes whenever the recording (path, size, mtime), the load
+    parameters (with the load_recording defaults filled in), the config, the bout
+    detection or store_version change.
+    """
+    import gait_batch
+    import gait_io
+
+    # gait_batch.run_task loads at the config rate, and the whole recording for bouts
+    if bouts:
+        load_kwargs = {**gait_batch.bout_load_kwargs, **load_kwargs}
+    arguments = inspect.signature(gait_io.load_recording).bind(subject, sensor, **{**load_kwargs, 'fs': config.fs})
+    arguments.apply_defaults()
+    load_args = {name: value for name, value in arguments.arguments.items() if name not in _ignored_load_args}
+
+    file_path = gait_io.get_file_path(subject, sensor, load_args['data_dir'])
+    file_key = gait_io._cache_key(file_path, load_args['dtype'])
+    source = json.dumps([store_version, file_key, config_hash(config), load_args, bouts], sort_keys=True, default=str)
+
+    return hashlib.sha1(source.encode()).hexdigest()[:16]
+
+
+def entry_path(subject, sensor, config, store_dir=store_dir):
+    """
+    Returns the path of the store entry of one subject, sensor and config.
+    """
+    return os.path.join(store_dir, f's{subject}_{sensor}_{config_hash(config)}.npz')
+
+
+#%% Read and Write Entries
+
+
+def write_entry(subject, sensor, config, key, HS_inds, TO_inds, store_dir=store_dir):
+    """
+    Pairs the events into cycles and writes the entry. The file is written under a
+    temporary name and renamed, so readers never see a half written entry.
+
+    Returns
+    -------
+    cycle_table : structured array
+        Cycles of the events, see gm.paired_cycle_dtype.
+
+    """
+    HS = gm._event_indices(HS_inds)
+    TO = gm._event_indices(TO_inds)
+    cycle_table = gm.pair_gait_events(HS, TO, fs=config.fs)
+
+    path = entry_path(subject, sensor, config, store_dir)
+    os.makedirs(store_dir, exist_ok=True)
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    # one array per column
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, key=np.array(key), HS=HS, TO=TO,
+                 **{f'cycle_{name}': cycle_table[name] for name in cycle_table.dtype.names})
+    os.replace(tmp_path, path)
+
+    return cycle_table
+
+
+def read_entry(subject, sensor, config, store_dir=store_dir, key=None):
+    """
+    Reads one entry of the store.
+
+    Parameters
+    ----------
+    subject : int
+        Subject number.
+    sensor : str
+        Sensor name, e.g. 'chest_accel'.
+    config : DetectorConfig
+        Detector settings the entry was computed with.
+    store_dir : str, optional
+        Folder of the store. The default is 'results'.
+    key : str, optional
+        Expected input_key. If given, an entry with another key counts as missing.
+        The default is None (any stored entry).
+
+    Returns
+    -------
+    entry : dict
+        'key', 'HS' and 'TO' (event indices) and 'cycles' (see gm.paired_cycle_dtype),
+        or None if there is no (current) entry.
+
+    """
+    path = entry_path(subject, sensor, config, store_dir)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as npz:
+        entry_key = str(npz['key'])
+        if key is not None and entry_key != key:
+            return None
+
+        cycle_table = np.empty(len(npz['cycle_HS']), dtype=gm.paired_cycle_dtype)
+        for name in cycle_table.dtype.names:
+            cycle_table[name] = npz[f'cycle_{name}']
+
+        return {'key': entry_key, 'HS': npz['HS'], 'TO': npz['TO'], 'cycles': cycle_table}
+
+
+#%% Update Store
+
+
+def update_store(subject_range, sensors=None, store_dir=store_dir, sensor_configs=None,
+                 max_workers=None, force=False, bouts=False, **load_kwargs):
+    """
+    Brings the store up to date: detects events only for the (subject, sensor) pairs
+    whose entry is missing or whose input_key changed, on a process pool, and writes
+    their events and cycles.
+
+    Parameters
+    ----------
+    subject_range : iterable of int
+        Subject numbers.
+    sensors : iterable of str, optional
+        Sensors to process. The default is None (every sensor of gait_batch.configs).
+    store_dir : str, optional
+        Folder of the store. The default is 'results'.
+    sensor_configs : dict, optional
+        DetectorConfig per sensor, overriding gait_batch.configs. The default is None.
+    max_workers : int, optional
+        Number of worker processes, see gait_batch.map_tasks. The default is None.
+    force : bool, optional
+        Recompute every entry. The default is False.
+    bouts : bool, optional
+        Detect only in the walking bouts of each recording (see gait_batch.run_task).
+        The default is False.
+    **load_kwargs
+        Passed to gait_io.load_recording (data_dir, crop_start_time, crop_stop_time,
+        resample). fs is always the config rate.
+
+    Returns
+    -------
+    updated : list of tuple
+        (subject, sensor) pairs that were recomputed.
+    errors : dict
+        Traceback of each failed pair, keyed by (subject, sensor). Failed pairs keep
+        their previous entry, if any.
+
+    """
+    import gait_batch
+
+    sensor_configs = {**gait_batch.configs, **(sensor_configs or {})}
+    if sensors is None:
+        sensors = tuple(gait_batch.configs)
+
+    stale = []
+    errors = {}
+    for subject in subject_range:
+        for sensor in sensors:
+            config = sensor_configs[sensor]
+            try:
+                key = input_key(subject, sensor, config, bouts, **load_kwargs)
+            except OSError:
+                errors[(subject, sensor)] = traceback.format_exc()
+                continue
+            if force or read_entry(subject, sensor, config, store_dir, key) is None:
+                stale.append((subject, sensor, config, key))
+
+    outputs = gait_batch.map_tasks(partial(gait_batch.run_task, bouts=bouts, **load_kwargs),
+                                   [(subject, sensor, config) for subject, sensor, config, _ in stale],
+                                   max_workers)
+
+    updated = []
+    for (subject, sensor, config, key), (result, error) in zip(stale, outputs):
+        error = error or result['error']
+        if error is not None:
+            errors[(subject, sensor)] = error
+            continue
+        write_entry(subject, sensor, config, key, result['HS_inds'], result['TO_inds'], store_dir)
+        updated.append((subject, sensor))
+
+    return updated, errors
+
+
+def write_subject(subject_data, sensor_configs, store_dir=store_dir, bouts=False, **load_kwargs):
+    """
+    Writes the events already detected for one subject (e.g. by gait_data.detect_subject
+    or the figure drawing detectors) to the store, without detecting them again.
+
+    Parameters
+    ----------
+    subject_data : SubjectData
+        Subject with the Events of every sensor in sensor_configs.
+    sensor_configs : dict
+        DetectorConfig the events of each sensor were detected with.
+    store_dir : str, optional
+        Folder of the store. The default is 'results'.
+    bouts : bool, optional
+        Whether the events were detected in the walking bouts only. The default is False.
+    **load_kwargs
+        Arguments the recordings were loaded with, as for update_store. They are part
+        of the entry keys, e.g. dtype=np.float32 for gait_data.load_subject_data.
+
+    Returns
+    -------
+    cycle_tables : dict
+        Cycles written for each sensor, see gm.paired_cycle_dtype.
+
+    """
+    subject = subject_data.subject
+    cycle_tables = {}
+    for sensor, config in sensor_configs.items():
+        events = subject_data.events[sensor]
+        key = input_key(subject, sensor, config, bouts, **load_kwargs)
+        cycle_tables[sensor] = write_entry(subject, sensor, config, key, events.HS, events.TO, store_dir)
+
+    return cycle_tables
+
+
+#%% Load Results
+
+
+def load_cycles(sensor, config=None, subject_range=None, store_dir=store_dir, valid_only=False):
+    """
+    Reads the stored cycles of one sensor for many subjects into one table.
+
+    Parameters
+    ----------
+    sensor : str
+        Sensor name, e.g. 'chest_accel'.
+    config : DetectorConfig, optional
+        Detector settings. The default is gait_batch.configs[sensor].
+    subject_range : iterable of int, optional
+        Subjects to read. The default is None (every subject in the store).
+    store_dir : str, optional
+        Folder of the store. The default is 'results'.
+    valid_only : bool, optional
+        Keep only the cycles flagged as valid. The default is False.
+
+    Returns
+    -------
+    table : structured array
+        Cycles of every subject in subject order, see stored_cycle_dtype.
+
+    """
+    if config is None:
+        import gait_batch
+
+        config = gait_batch.configs[sensor]
+
+    if subject_range is None:
+        pattern = os.path.join(store_dir, f's*_{sensor}_{config_hash(config)}.npz')
+        subject_range = sorted(int(os.path.basename(path)[1:].split('_', 1)[0]) for path in glob.glob(pattern))
+
+    tables = []
+    for subject in subject_range:
+        entry = read_entry(subject, sensor, config, store_dir)
+        if entry is None:
+            continue
+        table = np.empty(len(entry['cycles']), dtype=stored_cycle_dtype)
+        table['subject'] = subject
+        for name in gm.paired_cycle_dtype.names:
+            table[name] = entry['cycles'][name]
+        tables.append(table)
+
+    table = np.concatenate(tables) if tables else np.array([], dtype=stored_cycle_dtype)
+    if valid_only:
+        table = table[table['valid']]
+
+    return table
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming HS and TO detection for live IMU feeds.
+
+StreamingDetector takes chunks of one axis (CC chest accel or ML shank gyro) and emits
+events as soon as they are certain. It gives the same indices as the batch detectors in
+gait_metrics on the same samples, up to floating point rounding of the convolution:
+
+- the wavelet row is computed with overlap-save, keeping only the last kernel length
+  of samples, and
+- peaks are picked by an incremental version of signal.find_peaks(x, prominence=p) that
+  decides each peak once the wavelet trace has fallen p below it (or risen above it).
+
+Memory per stream is the kernel overlap plus the few unresolved peaks, independent of
+how long the stream runs.
+"""
+
+#%% Import Libraries
+
+import numpy as np
+from scipy import signal
+
+import gait_metrics as gm
+
+
+#%% Incremental Peak Picking
+
+
+class StreamingPeaks:
+    """
+    Incremental signal.find_peaks(x, prominence=prominence) that returns the indices of
+    the peaks of x, fed one chunk at a time.
+
+    A peak is kept by find_peaks if the signal drops at least `prominence` below it on
+    both sides before rising above it. The left side is known when the peak is found
+    (tracked with a stack of previous higher samples), the right side is watched on the
+    following samples, so each peak is emitted as soon as it is decided.
+    """
+
+    def __init__(self, prominence):
+        self.prominence = prominence
+        self.n = 0              # index of the next sample
+        self.prev = None        # previous sample
+        self.plateau = None     # [start index, value] of a plateau after a rise
+        self.plateau_left_ok = False
+        # previous higher samples, [value, min of the samples since the entry below]
+        # values decrease from the bottom, the bottom entry may be a floor
+        self.stack = []
+        self.floor = False      # any sample that pops the bottom entry has enough left prominence
+        # peaks waiting for their right side, [index, value, min since the peak]
+        self.pending = []
+
+    def update(self, x):
+        """
+        Feeds the next samples and returns the indices of the peaks decided by them.
+        """
+        prominence = self.prominence
+        stack = self.stack
+        pending = self.pending
+        peaks = []
+
+        for x_n in np.asarray(x, dtype=float).tolist():
+            n = self.n
+
+            # right side of the waiting peaks
+            if pending:
+                still_pending = []
+                for peak in pending:
+                    if x_n > peak[1]:
+                        continue
+                    if x_n < peak[2]:
+                        peak[2] = x_n
+                    if peak[1] - peak[2] >= prominence:
+                        peaks.append(peak[0])
+                    else:
+                        still_pending.append(peak)
+                self.pending = pending = still_pending
+
+            # local maximum (find_peaks midpoint of a rise - plateau - fall)
+            prev = self.prev
+            if prev is not None:
+                if prev < x_n:
+                    self.plateau = [n, x_n]
+                elif x_n < prev and self.plateau is not None:
+                    start, value = self.plateau
+                    if self.plateau_left_ok:
+                        peak = [(start + n - 1) // 2, value, x_n]
+                        if value - x_n >= prominence:
+                            peaks.append(peak[0])
+                        else:
+                            pending.append(peak)
+                    self.plateau = None
+
+            # left side: min of the samples since the last higher one
+            left_min = x_n
+            reached_floor = False
+            while stack and stack[-1][0] <= x_n:
+                entry = stack.pop()
+                if entry[1] < left_min:
+                    left_min = entry[1]
+                if not stack and self.floor:
+                    reached_floor = True
+            stack.append([x_n, left_min])
+            if reached_floor:
+                self.floor = True
+            elif len(stack) == 1:
+                self.floor = False
+            self.plateau_left_ok = reached_floor or x_n - left_min >= prominence
+
+            # entries this sample is prominent enough below are floors for later
+            # peaks, so anything under the highest of them is no longer needed
+            if stack[0][0] - x_n >= prominence:
+                k = 0
+                while k + 2 < len(stack) and stack[k + 1][0] - x_n >= prominence:
+                    k += 1
+                del stack[:k]
+                self.floor = True
+
+            self.prev = x_n
+            self.n = n + 1
+
+        peaks.sort()
+        return peaks
+
+
+#%% Streaming Detector
+
+
+class StreamingDetector:
+    """
+    Streaming version of gait_metrics.detect_events for one signal axis.
+
+    Parameters
+    ----------
+    scale : int
+        Row of the scalogram used for peak picking (20 for chest accel, 25 for shank gyro).
+    prominence : float, optional
+        Required prominence of peaks and troughs. The default is 0.19.
+    mother_wavelet : function, optional
+        Mother wavelet. The default is gm.morlet2.
+
+    Events are reported with an index into the whole stream. The latency of an event is
+    half the kernel length (5 widths) plus the time the wavelet trace takes to move
+    `prominence` away from it.
+    """
+
+    def __init__(self, scale, prominence=0.19, mother_wavelet=gm.morlet2):
+        self.scale = scale
+        self.mother_wavelet = mother_wavelet
+        # kernel for streams at least 10 widths long, shorter ones are redone at finish
+        self.kernel_length = 10 * gm.scales[scale]
+        self.wavelet_data = gm.wavelet_kernel(scale, self.kernel_length, mother_wavelet)
+        self.hs_peaks = StreamingPeaks(prominence)
+        self.to_peaks = StreamingPeaks(prominence)
+        self.n_samples = 0
+        self.startup = []        # samples held until the stream is one kernel long
+        self.overlap = None      # last kernel_length - 1 samples
+        # 'same' convolution drops the first (kernel_length - 1) // 2 outputs
+        self.skip = (self.kernel_length - 1) // 2
+        self.finished = False
+
+    def _filter(self, samples):
+        """
+        Overlap-save convolution of the next samples, returns the new wavelet magnitudes.
+        """
+        buffer = np.concatenate((self.overlap, samples))
+        full = signal.convolve(buffer, self.wavelet_data, mode='valid')
+        self.overlap = buffer[len(buffer) - (self.kernel_length - 1):]
+
+        if self.skip:
+            dropped = min(self.skip, len(full))
+            full = full[dropped:]
+            self.skip -= dropped
+
+        return abs(full)
+
+    def _pick(self, cwt_row):
+        """
+        Returns the HS and TO decided by the next wavelet magnitudes.
+        """
+        HS_inds = np.array(self.hs_peaks.update(cwt_row), dtype=int)
+        TO_inds = np.array(self.to_peaks.update(-cwt_row), dtype=int)
+
+        return HS_inds, TO_inds
+
+    def update(self, samples):
+        """
+        Feeds the next chunk of samples.
+
+        Parameters
+        ----------
+        samples : array of float
+            Next samples of the stream, any length.
+
+        Returns
+        -------
+        HS_inds : array of int
+            Stream indices of the HS decided by this chunk.
+        TO_inds : array of int
+            Stream indices of the TO decided by this chunk.
+
+        """
+        if self.finished:
+            raise ValueError('update called after finish')
+
+        samples = np.asarray(samples, dtype=float).ravel()
+        self.n_samples += len(samples)
+
+        if self.overlap is None:
+            # the kernel is only known once the stream is at least one kernel long
+            self.startup.append(samples)
+            if self.n_samples < self.kernel_length:
+                return np.array([], dtype=int), np.array([], dtype=int)
+            samples = np.concatenate(self.startup)
+            self.startup = None
+            self.overlap = np.zeros(self.kernel_length - 1)
+
+        return self._pick(self._filter(samples))
+
+    def finish(self):
+        """
+        Ends the stream and returns the remaining events.
+
+        Returns
+        -------
+        HS_inds : array of int
+            Stream indices of the remaining HS.
+        TO_inds : array of int
+            Stream indices of the remaining TO.
+
+        """
+        if self.finished:
+            raise ValueError('finish called twice')
+        self.finished = True
+
+        if self.overlap is None:
+            # shorter than one kernel: same truncated kernel as the batch path
+            samples = np.concatenate(self.startup) if self.startup else np.array([])
+            if len(samples) == 0:
+                return np.array([], dtype=int), np.array([], dtype=int)
+            return self._pick(gm.wavelet_scale(samples, self.scale, self.mother_wavelet))
+
+        # zero padding at the end of the 'same' convolution
+        return self._pick(self._filter(np.zeros((self.kernel_length - 1) // 2)))
+
+
+def detect_chunks(chunks, config):
+    """
+    Detects HS and TO over a long recording given as consecutive blocks of one signal
+    axis, e.g. from gait_io.iter_recording. Blocks are filtered with overlap-save and
+    peaks are picked across the seams, so every event is reported once and memory stays
+    bounded by the block size however long the recording is.
+
+    Parameters
+    ----------
+    chunks : iterable of array of float
+        Consecutive blocks of the signal.
+    config : DetectorConfig
+        Detector settings.
+
+    Returns
+    -------
+    HS_inds : tuple of size 2
+        First tuple element is array of int representing the indices where HS is detected
+        (the second is an empty dict, find_peaks properties are not kept).
+    TO_inds : tuple of size 2
+        First tuple element is array of int representing the indices where TO is detected.
+
+    """
+    detector = detector_from_config(config)
+    HS_blocks = []
+    TO_blocks = []
+
+    for chunk in chunks:
+        HS_inds, TO_inds = detector.update(chunk)
+        HS_blocks.append(HS_inds)
+        TO_blocks.append(TO_inds)
+
+    HS_inds, TO_inds = detector.finish()
+    HS_blocks.append(HS_inds)
+    TO_blocks.append(TO_inds)
+
+    return (np.concatenate(HS_blocks), {}), (np.concatenate(TO_blocks), {})
+
+
+def detector_from_config(config):
+    """
+    Returns a StreamingDetector with the scale, prominence and wavelet of a
+    gait_metrics.DetectorConfig. The kernel is shared with the batch detectors.
+    """
+    return StreamingDetector(config.scale, config.prominence, config.mother_wavelet)
+
+
+def chest_accel_detector(config=gm.chest_accel_config):
+    """
+    Returns a StreamingDetector for CC chest acceleration samples (scale 20).
+    """
+    return detector_from_config(config)
+
+
+def shank_gyro_detector(config=gm.shank_gyro_config):
+    """
+    Returns a StreamingDetector for ML shank angular velocity samples (scale 25).
+    """
+    return detector_from_config(config)
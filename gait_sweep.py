@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps over (scale, prominence) grids for the HS/TO detectors.
+
+Instead of running the detector once per grid point, each scale in the grid is
+transformed once per signal and find_peaks is run once per scale with no prominence
+limit. The peaks for every prominence are then the peaks whose prominence reaches it,
+which are the same indices find_peaks(x, prominence=p) returns.
+"""
+
+#%% Import Libraries
+
+from functools import partial
+
+import numpy as np
+from scipy import signal
+
+import gait_batch
+import gait_io
+import gait_metrics as gm
+
+
+#%% Define Parameters
+
+# fields of the table returned by sweep_subjects
+sweep_dtype = np.dtype([('subject', np.int64), ('sensor', 'U16'), ('scale', np.int64), ('prominence', np.float64),
+                        ('n_HS', np.int64), ('n_TO', np.int64),
+                        ('HS_precision', np.float64), ('HS_recall', np.float64),
+                        ('TO_precision', np.float64), ('TO_recall', np.float64)])
+
+
+#%% Sweep One Signal
+
+
+def sweep_signal(signal_data, scale_grid, prominence_grid, mother_wavelet=gm.morlet2):
+    """
+    Detects HS and TO for every (scale, prominence) pair of the grids.
+
+    Parameters
+    ----------
+    signal_data : array of float
+        Signal to analyze.
+    scale_grid : iterable of int
+        Scalogram rows to try (width = gm.scales[scale]).
+    prominence_grid : iterable of float
+        Prominences to try.
+    mother_wavelet : function, optional
+        Mother wavelet. The default is gm.morlet2.
+
+    Returns
+    -------
+    events : dict
+        (HS indices, TO indices) arrays keyed by (scale, prominence).
+
+    """
+    events = {}
+
+    for scale in dict.fromkeys(scale_grid):
+        # one transform and one peak search per scale
+        cwt_row = gm.wavelet_scale(signal_data, scale, mother_wavelet)
+        HS_all, HS_properties = signal.find_peaks(cwt_row, prominence=0)
+        TO_all, TO_properties = signal.find_peaks(-cwt_row, prominence=0)
+
+        for prominence in prominence_grid:
+            events[(scale, prominence)] = (HS_all[HS_properties['prominences'] >= prominence],
+                                           TO_all[TO_properties['prominences'] >= prominence])
+
+    return events
+
+
+#%% Agreement
+
+
+def event_agreement(detected_times, reference_times, tolerance=0.1):
+    """
+    Compares detected events with reference events, matched one-to-one by nearest time.
+
+    Parameters
+    ----------
+    detected_times : array of float
+        Times of the detected events (seconds).
+    reference_times : array of float
+        Times of the reference events, e.g. labels or the other sensor (seconds).
+    tolerance : float, optional
+        Largest time difference of a match (seconds). The default is 0.1.
+
+    Returns
+    -------
+    precision : float
+        Fraction of detected events that match a reference event (nan if none detected).
+    recall : float
+        Fraction of reference events that match a detected event (nan if no reference).
+
+    """
+    n_matched = len(gm.match_events(detected_times, reference_times, tolerance)[0])
+    precision = n_matched / len(detected_times) if len(detected_times) else np.nan
+    recall = n_matched / len(reference_times) if len(reference_times) else np.nan
+
+    return precision, recall
+
+
+#%% Sweep Subjects
+
+
+def sweep_subject(subject, scale_grid, prominence_grid, sensor_configs=None, reference=None,
+                  tolerance=0.1, **load_kwargs):
+    """
+    Sweeps the grids for every sensor of one subject. Each sensor is compared with the
+    reference labels if given, otherwise with the events of the other sensor detected
+    with its own config.
+
+    Parameters
+    ----------
+    subject : int
+        Subject number.
+    scale_grid : iterable of int
+        Scalogram rows to try.
+    prominence_grid : iterable of float
+        Prominences to try.
+    sensor_configs : dict, optional
+        DetectorConfig per sensor. The default is gait_batch.configs.
+    reference : dict, optional
+        Reference 'HS' and 'TO' times (seconds) of this subject. The default is None.
+    tolerance : float, optional
+        Largest time difference of a match (seconds). The default is 0.1.
+    **load_kwargs
+        Passed to gait_io.load_recording (data_dir, crop_start_time, crop_stop_time,
+        resample). fs is always the config rate of each sensor.
+
+    Returns
+    -------
+    table : structured array
+        One row per sensor and grid point, see sweep_dtype.
+
+    """
+    if sensor_configs is None:
+        sensor_configs = gait_batch.configs
+
+    recordings = {sensor: gait_io.load_recording(subject, sensor, **{**load_kwargs, 'fs': config.fs})
+                  for sensor, config in sensor_configs.items()}
+    times = {sensor: np.asarray(data.iloc[:, 0]) for sensor, data in recordings.items()}
+
+    # events of each sensor with its own config, reference for the other sensors
+    default_events = {}
+    for sensor, config in sensor_configs.items():
+        HS_inds, TO_inds = gm.detect_sensor_events(recordings[sensor], config)
+        default_events[sensor] = {'HS': times[sensor][HS_inds[0]], 'TO': times[sensor][TO_inds[0]]}
+
+    rows = []
+    for sensor, config in sensor_configs.items():
+        if reference is not None:
+            sensor_reference = reference
+        else:
+            others = [default_events[other] for other in sensor_configs if other != sensor]
+            sensor_reference = others[0] if others else None
+
+        signal_data = recordings[sensor].iloc[:, config.column]
+        for (scale, prominence), (HS, TO) in sweep_signal(signal_data, scale_grid, prominence_grid,
+                                                          config.mother_wavelet).items():
+            HS_agreement = TO_agreement = (np.nan, np.nan)
+            if sensor_reference is not None:
+                HS_agreement = event_agreement(times[sensor][HS], sensor_reference['HS'], tolerance)
+                TO_agreement = event_agreement(times[sensor][TO], sensor_reference['TO'], tolerance)
+            rows.append((subject, sensor, scale, prominence, len(HS), len(TO)) + HS_agreement + TO_agreement)
+
+    return np.array(rows, dtype=sweep_dtype)
+
+
+def sweep_subjects(subject_range, scale_grid, prominence_grid, sensor_configs=None, references=None,
+                   tolerance=0.1, max_workers=None, **load_kwargs):
+    """
+    Sweeps the grids for every subject on a process pool (see sweep_subject).
+
+    Parameters
+    ----------
+    subject_range : iterable of int
+        Subject numbers.
+    scale_grid : iterable of int
+        Scalogram rows to try.
+    prominence_grid : iterable of float
+        Prominences to try.
+    sensor_configs : dict, optional
+        DetectorConfig per sensor. The default is gait_batch.configs.
+    references : dict, optional
+        Reference 'HS' and 'TO' times keyed by subject. The default is None (compare
+        the sensors with each other).
+    tolerance : float, optional
+        Largest time difference of a match (seconds). The default is 0.1.
+    max_workers : int, optional
+        Number of worker processes, see gait_batch.map_tasks. The default is None.
+    **load_kwargs
+        Passed to gait_io.load_recording.
+
+    Returns
+    -------
+    table : structured array
+        Rows of every subject that succeeded, see sweep_dtype.
+    errors : dict
+        Traceback of each subject that failed, keyed by subject.
+
+    """
+    subject_range = list(subject_range)
+    references = references or {}
+    function = partial(sweep_subject, scale_grid=list(scale_grid), prominence_grid=list(prominence_grid),
+                       sensor_configs=sensor_configs, tolerance=tolerance, **load_kwargs)
+
+    outputs = gait_batch.map_tasks(_sweep_task, [(function, subject, references.get(subject))
+                                                 for subject in subject_range], max_workers)
+
+    tables = [table for table, error in outputs if error is None]
+    errors = {subject: error for subject, (table, error) in zip(subject_range, outputs) if error is not None}
+    table = np.concatenate(tables) if tables else np.array([], dtype=sweep_dtype)
+
+    return table, errors
+
+
+def _sweep_task(function, subject, reference):
+    """
+    Runs one subject of sweep_subjects (module level so it can be sent to a worker).
+    """
+    return function(subject, reference=reference)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures of the tests. The modules live at the top of the repository and the
+recordings are synthetic (gait_bench.synthetic_gait), so no RawData is needed.
+"""
+
+#%% Import Libraries
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gait_bench  # noqa: E402
+
+
+#%% Fixtures
+
+
+@pytest.fixture(scope='session')
+def synthetic_recordings():
+    """
+    Synthetic chest accel and shank gyro recordings of 90 s at 125 Hz with their true
+    events (see gait_bench.synthetic_gait).
+    """
+    return gait_bench.synthetic_gait(duration=90, fs=125, seed=1)
+
+
+@pytest.fixture
+def data_dir(tmp_path, synthetic_recordings):
+    """
+    Folder with the synthetic recordings of subject 1 as csv files (gait_io layout).
+    """
+    for sensor in ('chest_accel', 'shank_gyro'):
+        synthetic_recordings[sensor].to_csv(tmp_path / f's1_{sensor}.csv', index=False)
+
+    return str(tmp_path)
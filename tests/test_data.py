@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The typed subject containers (gait_data): float32 recordings give the events of the
+float64 recordings, and detection returns a new SubjectData.
+"""
+
+#%% Import Libraries
+
+import numpy as np
+import pytest
+
+import gait_bench
+import gait_data
+import gait_metrics as gm
+
+
+#%% Define Parameters
+
+sensor_configs = {'chest_accel': gm.chest_accel_config, 'shank_gyro': gm.shank_gyro_config}
+
+
+#%% Tests
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_float32_events_match_float64(tmp_path, seed):
+    recordings = gait_bench.synthetic_gait(duration=90, fs=125, seed=seed)
+    for sensor in sensor_configs:
+        recordings[sensor].to_csv(tmp_path / f's1_{sensor}.csv', index=False)
+
+    subjects = {dtype: gait_data.detect_subject(gait_data.load_subject_data(1, list(sensor_configs), dtype=dtype,
+                                                                             sensor_configs=sensor_configs,
+                                                                             data_dir=str(tmp_path)),
+                                                sensor_configs)
+                for dtype in (np.float32, np.float64)}
+
+    for sensor in sensor_configs:
+        single, double = (subjects[dtype].events[sensor] for dtype in (np.float32, np.float64))
+        assert len(double.HS) and len(double.TO)
+        np.testing.assert_array_equal(single.HS, double.HS)
+        np.testing.assert_array_equal(single.TO, double.TO)
+
+
+def test_detect_subject_returns_a_copy(data_dir):
+    subject_data = gait_data.load_subject_data(1, list(sensor_configs), sensor_configs=sensor_configs,
+                                               data_dir=data_dir)
+    detected = gait_data.detect_subject(subject_data, sensor_configs)
+
+    assert subject_data.events == {} and subject_data.cycles == {}
+    assert set(detected.events) == set(detected.cycles) == set(sensor_configs)
+    assert detected.recordings is subject_data.recordings
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The fusion detector (gait_fusion) reduces to the single-sensor detector and its
+batched wavelet pass matches gait_metrics.wavelet_scale.
+"""
+
+#%% Import Libraries
+
+import numpy as np
+import pytest
+
+import gait_fusion
+import gait_metrics as gm
+
+
+#%% Tests
+
+
+def test_batched_wavelet_matches_single_scale():
+    stack = np.random.default_rng(0).standard_normal((4, 1875)).astype(np.float32)
+    channel_scales = [20, 25, 20, 25]
+    magnitudes = gait_fusion.wavelet_channels(stack, channel_scales)
+
+    for channel, scale in enumerate(channel_scales):
+        np.testing.assert_allclose(magnitudes[channel], gm.wavelet_scale(stack[channel], scale), atol=1e-4)
+
+
+def test_reference_channel_only_matches_detector(synthetic_recordings):
+    # every other axis is flat, so only the reference channel carries weight
+    shank_gyro = synthetic_recordings['shank_gyro'].astype(np.float32)
+    shank_gyro['x'] = 0.0
+    shank_gyro['y'] = 0.0
+    HS_fused, TO_fused = gait_fusion.detect_fused_events({'shank_gyro': shank_gyro})
+    HS_inds, TO_inds = gm.detect_sensor_events(shank_gyro, gm.shank_gyro_config)
+
+    np.testing.assert_array_equal(HS_fused[0], HS_inds[0])
+    np.testing.assert_array_equal(TO_fused[0], TO_inds[0])
+    assert np.all(HS_fused[1]['confidence'] == 1)
+
+
+def test_missing_reference_raises(synthetic_recordings):
+    with pytest.raises(ValueError):
+        gait_fusion.detect_fused_events({'chest_accel': synthetic_recordings['chest_accel']})
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Loading recordings (gait_io): the binary cache returns the csv rows and follows edits
+of the csv files, and the crop and resampling step gives the rows of the original
+data_file.iloc[crop_start_time*fs:crop_stop_time*fs] crop.
+"""
+
+#%% Import Libraries
+
+import os
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+import gait_bench
+import gait_io
+
+
+#%% Helpers
+
+
+def _entries(cache_dir):
+    """
+    Returns the sorted names of the cache entries.
+    """
+    return sorted(os.listdir(cache_dir))
+
+
+def _rewrite(file_path, data):
+    """
+    Writes data to file_path with an mtime one second later than the current file.
+    """
+    mtime_ns = os.stat(file_path).st_mtime_ns
+    data.to_csv(file_path, index=False)
+    os.utime(file_path, ns=(mtime_ns + 10 ** 9, mtime_ns + 10 ** 9))
+
+
+#%% Binary Cache
+
+
+def test_cache_round_trip(data_dir, tmp_path):
+    file_path = gait_io.get_file_path(1, 'shank_gyro', data_dir)
+    cache_dir = str(tmp_path / 'cache')
+
+    first = gait_io.load_cached(file_path, cache_dir)
+    second = gait_io.load_cached(file_path, cache_dir)
+
+    pdt.assert_frame_equal(first, pd.read_csv(file_path))
+    pdt.assert_frame_equal(second, first)
+    assert len(_entries(cache_dir)) == 1
+
+
+def test_cache_keeps_the_requested_dtypes(data_dir, tmp_path):
+    file_path = gait_io.get_file_path(1, 'shank_gyro', data_dir)
+    cache_dir = str(tmp_path / 'cache')
+
+    data = gait_io.load_cached(file_path, cache_dir, dtype=np.float32)
+
+    assert list(data.dtypes) == [np.float64, np.float32, np.float32, np.float32]
+    pdt.assert_frame_equal(data, pd.read_csv(file_path, dtype=gait_io._column_dtypes(file_path, np.float32)))
+
+
+def test_cache_invalidated_by_edit(data_dir, tmp_path):
+    file_path = gait_io.get_file_path(1, 'shank_gyro', data_dir)
+    cache_dir = str(tmp_path / 'cache')
+    gait_io.load_cached(file_path, cache_dir)
+    gait_io.load_cached(file_path, cache_dir, dtype=np.float32)
+    old_entries = _entries(cache_dir)
+
+    edited = pd.read_csv(file_path)
+    edited.iloc[:, 1:] *= 2
+    _rewrite(file_path, edited)
+    data = gait_io.load_cached(file_path, cache_dir)
+
+    pdt.assert_frame_equal(data, pd.read_csv(file_path))
+    # the float64 entry is replaced, the float32 entry of the old version is kept
+    new_entries = _entries(cache_dir)
+    assert len(new_entries) == 2
+    assert len(set(new_entries) & set(old_entries)) == 1
+
+
+def test_cached_load_matches_csv_load(data_dir, tmp_path):
+    for sensor in ('chest_accel', 'shank_gyro'):
+        from_csv = gait_io.load_recording(1, sensor, data_dir)
+        cached = gait_io.load_recording(1, sensor, data_dir, cache_dir=str(tmp_path / 'cache'))
+
+        pdt.assert_frame_equal(cached, from_csv)
+
+
+#%% Cropping and Resampling
+
+
+def test_crop_matches_baseline_rows(data_dir):
+    for sensor in ('chest_accel', 'shank_gyro'):
+        file_path = gait_io.get_file_path(1, sensor, data_dir)
+        data = gait_io.load_recording(1, sensor, data_dir, crop_start_time=60, crop_stop_time=75, fs=125)
+
+        pdt.assert_frame_equal(data, pd.read_csv(file_path).iloc[60 * 125:75 * 125])
+
+
+def test_whole_recording(data_dir):
+    file_path = gait_io.get_file_path(1, 'shank_gyro', data_dir)
+    data = gait_io.load_recording(1, 'shank_gyro', data_dir, crop_start_time=None, crop_stop_time=None)
+
+    pdt.assert_frame_equal(data, pd.read_csv(file_path))
+
+
+def test_microsecond_timestamps_use_nominal_rate(data_dir):
+    # POSIX time in microseconds: the rate is implausible, so the rows are taken at fs
+    file_path = gait_io.get_file_path(1, 'shank_gyro', data_dir)
+    data = pd.read_csv(file_path)
+    data['time'] = 1.6e15 + np.round(data['time'] * 1e6)
+    _rewrite(file_path, data)
+
+    with pytest.warns(UserWarning, match='time not in seconds'):
+        cropped = gait_io.load_recording(1, 'shank_gyro', data_dir, resample=True)
+
+    pdt.assert_frame_equal(cropped, pd.read_csv(file_path).iloc[60 * 125:75 * 125])
+
+
+def test_other_rate_needs_resample(tmp_path):
+    recordings = gait_bench.synthetic_gait(duration=90, fs=250, noise=0, seed=1)
+    recordings['shank_gyro'].to_csv(tmp_path / 's1_shank_gyro.csv', index=False)
+
+    with pytest.raises(ValueError, match='resample=True'):
+        gait_io.load_recording(1, 'shank_gyro', str(tmp_path), fs=125)
+
+    # the crop is in seconds, so the 250 Hz rows of 60-75 s give 15 s at 125 Hz
+    data = gait_io.load_recording(1, 'shank_gyro', str(tmp_path), fs=125, resample=True)
+    expected = gait_bench.synthetic_gait(duration=90, fs=125, noise=0, seed=1)['shank_gyro'].iloc[60 * 125:75 * 125]
+
+    assert len(data) == len(expected)
+    np.testing.assert_allclose(data['time'], expected['time'], atol=1e-9)
+    np.testing.assert_allclose(data.iloc[:, 1:], expected.iloc[:, 1:], atol=0.02 * 200)
+
+
+def test_resample_keeps_rows_at_the_config_rate(data_dir):
+    data = gait_io.load_recording(1, 'shank_gyro', data_dir)
+    resampled = gait_io.load_recording(1, 'shank_gyro', data_dir, resample=True)
+
+    pdt.assert_frame_equal(resampled, data)
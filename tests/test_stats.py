@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The grouped statistics of gait_stats match direct reference computations (scipy and
+the textbook ICC, Bland-Altman and bootstrap formulas).
+"""
+
+#%% Import Libraries
+
+import numpy as np
+import pytest
+from scipy import stats
+
+import gait_metrics as gm
+import gait_stats
+
+
+#%% Helpers
+
+
+def _cycles(seed=0, n_subjects=4):
+    """
+    Matched cycle tables of two sensors, durations on a 1 / 125 s grid as in the data.
+    """
+    rng = np.random.default_rng(seed)
+    n = rng.integers(8, 30, n_subjects)
+    subjects = np.repeat(np.arange(1, n_subjects + 1), n)
+    dtype = [('subject', np.int64), ('stance', np.float64), ('swing', np.float64), ('stride', np.float64)]
+    cycles_a = np.zeros(len(subjects), dtype=dtype)
+    cycles_b = np.zeros(len(subjects), dtype=dtype)
+    cycles_a['subject'] = cycles_b['subject'] = subjects
+    for metric, mean in [('stance', 0.65), ('swing', 0.45), ('stride', 1.1)]:
+        true = mean + 0.05 * rng.standard_normal(len(subjects))
+        cycles_a[metric] = np.round((true + 0.02 * rng.standard_normal(len(subjects))) * 125) / 125
+        cycles_b[metric] = np.round((true + 0.01 + 0.02 * rng.standard_normal(len(subjects))) * 125) / 125
+
+    return cycles_a, cycles_b
+
+
+def _icc_reference(a, b):
+    """
+    ICC(2,1) of Shrout and Fleiss from the two-way ANOVA table of the n x 2 ratings.
+    """
+    ratings = np.column_stack([a, b])
+    n, k = ratings.shape
+    grand_mean = ratings.mean()
+    ss_rows = k * ((ratings.mean(axis=1) - grand_mean) ** 2).sum()
+    ss_raters = n * ((ratings.mean(axis=0) - grand_mean) ** 2).sum()
+    ss_error = ((ratings - grand_mean) ** 2).sum() - ss_rows - ss_raters
+    ms_rows = ss_rows / (n - 1)
+    ms_raters = ss_raters / (k - 1)
+    ms_error = ss_error / ((n - 1) * (k - 1))
+
+    return (ms_rows - ms_error) / (ms_rows + (k - 1) * ms_error + k * (ms_raters - ms_error) / n)
+
+
+#%% Tests
+
+
+def test_point_estimates_match_reference():
+    cycles_a, cycles_b = _cycles()
+    table = gait_stats.cycle_agreement(cycles_a, cycles_b, n_boot=0)
+
+    for row in table:
+        keep = slice(None) if row['subject'] == gait_stats.pooled else cycles_a['subject'] == row['subject']
+        a = cycles_a[row['metric']][keep]
+        b = cycles_b[row['metric']][keep]
+        difference = a - b
+
+        assert row['n'] == len(a)
+        pearson = stats.pearsonr(a, b)
+        spearman = stats.spearmanr(a, b)
+        np.testing.assert_allclose([row['pearson_r'], row['pearson_p'], row['spearman_r'], row['spearman_p']],
+                                   [pearson[0], pearson[1], spearman[0], spearman[1]], rtol=1e-9, atol=1e-12)
+        sd = difference.std(ddof=1)
+        np.testing.assert_allclose([row['bias'], row['loa_lower'], row['loa_upper']],
+                                   [difference.mean(), difference.mean() - 1.96 * sd, difference.mean() + 1.96 * sd],
+                                   rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(row['icc'], _icc_reference(a, b), rtol=1e-9, atol=1e-12)
+
+    assert np.isnan(table['pearson_low']).all()
+
+
+def test_bootstrap_replicates_match_resampled_statistics():
+    # the replicates are multinomial pair counts, expanding them gives the resampled cycles
+    a, b = (cycles['stride'][:25] for cycles in _cycles(seed=1, n_subjects=1))
+    n_boot = 20
+    replicates = gait_stats._bootstrap_metric(a, b, n_boot, np.random.default_rng(3))
+
+    shift = (a.mean() + b.mean()) / 2
+    pairs, pair_counts = np.unique(np.column_stack([a - shift, b - shift]), axis=0, return_counts=True)
+    counts = np.random.default_rng(3).multinomial(len(a), pair_counts / len(a), size=n_boot)
+    for i, replicate_counts in enumerate(counts):
+        resampled_a, resampled_b = np.repeat(pairs, replicate_counts, axis=0).T + shift
+        np.testing.assert_allclose(replicates['pearson_r'][i], stats.pearsonr(resampled_a, resampled_b)[0],
+                                   rtol=1e-7)
+        np.testing.assert_allclose(replicates['spearman_r'][i], stats.spearmanr(resampled_a, resampled_b)[0],
+                                   rtol=1e-7)
+        np.testing.assert_allclose(replicates['bias'][i], (resampled_a - resampled_b).mean(), atol=1e-12)
+        np.testing.assert_allclose(replicates['icc'][i], _icc_reference(resampled_a, resampled_b), rtol=1e-7)
+
+
+def test_pearson_interval_matches_index_bootstrap():
+    a, b = (cycles['stance'] for cycles in _cycles(seed=2, n_subjects=1))
+    row = gait_stats.cycle_agreement({'subject': np.ones(len(a), dtype=int), 'stance': a},
+                                     {'subject': np.ones(len(b), dtype=int), 'stance': b},
+                                     metrics=['stance'], n_boot=4000, per_subject=False)[0]
+
+    # percentile interval of the plain bootstrap over resampled cycle indices
+    rng = np.random.default_rng(10)
+    samples = rng.integers(0, len(a), (4000, len(a)))
+    r = np.array([np.corrcoef(a[sample], b[sample])[0, 1] for sample in samples])
+    low, high = np.quantile(r, [0.025, 0.975])
+
+    assert row['pearson_low'] < row['pearson_r'] < row['pearson_high']
+    np.testing.assert_allclose([row['pearson_low'], row['pearson_high']], [low, high], atol=0.03)
+
+
+def test_match_subject_cycles_unsorted_input():
+    table = np.zeros(6, dtype=[('subject', np.int64)] + gm.paired_cycle_dtype.descr)
+    table['subject'] = [2, 1, 2, 1, 3, 1]
+    table['HS'] = [0, 0, 125, 125, 0, 250]
+    table['next_HS'] = table['HS'] + 125
+    table['stride'] = 1.0
+    table['valid'] = True
+    other = table[::-1].copy()
+    other['HS'] += 2
+
+    matched_a, matched_b = gait_stats.match_subject_cycles(table, other)
+
+    np.testing.assert_array_equal(matched_a['subject'], [1, 1, 1, 2, 2, 3])
+    np.testing.assert_array_equal(matched_a['subject'], matched_b['subject'])
+    np.testing.assert_array_equal(matched_b['HS'] - matched_a['HS'], 2)
+
+
+@pytest.mark.parametrize('n', [0, 1])
+def test_too_few_cycles_give_nan(n):
+    cycles_a, cycles_b = (cycles[:n] for cycles in _cycles())
+    table = gait_stats.cycle_agreement(cycles_a, cycles_b, n_boot=10, per_subject=False)
+
+    assert np.isnan(table['pearson_r']).all()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The streaming and chunked detectors (gait_stream) give the same events as the batch
+detector and signal.find_peaks.
+"""
+
+#%% Import Libraries
+
+import numpy as np
+import pytest
+from scipy import signal
+
+import gait_io
+import gait_metrics as gm
+import gait_stream
+
+
+#%% Tests
+
+
+@pytest.mark.parametrize('prominence', [0.05, 0.19, 1.0])
+def test_streaming_peaks_match_find_peaks(prominence):
+    rng = np.random.default_rng(0)
+    for trial in range(200):
+        n = rng.integers(1, 300)
+        if trial % 2:
+            x = np.cumsum(rng.standard_normal(n)) * 0.1
+        else:
+            # rounded values give plateaus and ties
+            x = np.round(rng.standard_normal(n), 1)
+
+        peaks = gait_stream.StreamingPeaks(prominence)
+        found = []
+        for start in range(0, n, 7):
+            found += peaks.update(x[start:start + 7])
+
+        assert found == signal.find_peaks(x, prominence=prominence)[0].tolist()
+
+
+@pytest.mark.parametrize('sensor', ['chest_accel', 'shank_gyro'])
+@pytest.mark.parametrize('chunk', [1, 50, 1000])
+def test_streaming_detector_matches_batch(synthetic_recordings, sensor, chunk):
+    config = {'chest_accel': gm.chest_accel_config, 'shank_gyro': gm.shank_gyro_config}[sensor]
+    signal_data = synthetic_recordings[sensor].iloc[:, config.column].to_numpy()
+    HS_inds, TO_inds = gm.detect_sensor_events(synthetic_recordings[sensor], config)
+
+    detector = gait_stream.detector_from_config(config)
+    HS, TO = [], []
+    for start in range(0, len(signal_data), chunk):
+        new_HS, new_TO = detector.update(signal_data[start:start + chunk])
+        HS.append(new_HS)
+        TO.append(new_TO)
+    new_HS, new_TO = detector.finish()
+
+    np.testing.assert_array_equal(np.concatenate(HS + [new_HS]), HS_inds[0])
+    np.testing.assert_array_equal(np.concatenate(TO + [new_TO]), TO_inds[0])
+
+
+@pytest.mark.parametrize('chunk_size', [100, 1875, 100000])
+def test_chunked_detection_matches_batch(synthetic_recordings, chunk_size):
+    data = synthetic_recordings['shank_gyro']
+    HS_inds, TO_inds = gm.detect_sensor_events(data, gm.shank_gyro_config)
+    HS_chunked, TO_chunked = gm.detect_sensor_events(data, gm.shank_gyro_config, chunk_size=chunk_size)
+
+    np.testing.assert_array_equal(HS_chunked[0], HS_inds[0])
+    np.testing.assert_array_equal(TO_chunked[0], TO_inds[0])
+
+
+def test_short_stream_matches_batch():
+    # shorter than one kernel, the detector falls back to the truncated batch kernel
+    x = 100 * np.sin(np.arange(250) / 12)
+    HS_inds, TO_inds = gm.detect_events(x, gm.shank_gyro_config.scale, gm.shank_gyro_config.prominence)
+
+    detector = gait_stream.detector_from_config(gm.shank_gyro_config)
+    assert [len(inds) for inds in detector.update(x)] == [0, 0]
+    HS, TO = detector.finish()
+
+    np.testing.assert_array_equal(HS, HS_inds[0])
+    np.testing.assert_array_equal(TO, TO_inds[0])
+
+
+def test_chunked_file_matches_batch(data_dir):
+    # long-recording mode: blocks read from the csv file, filtered with overlap-save
+    data = gait_io.load_recording(1, 'shank_gyro', data_dir, crop_start_time=None, crop_stop_time=None)
+    HS_inds, TO_inds = gm.detect_sensor_events(data, gm.shank_gyro_config)
+    blocks = gait_io.iter_recording(1, 'shank_gyro', gm.shank_gyro_config.column, chunk_rows=1000,
+                                    data_dir=data_dir)
+    HS_chunked, TO_chunked = gait_stream.detect_chunks(blocks, gm.shank_gyro_config)
+
+    np.testing.assert_array_equal(HS_chunked[0], HS_inds[0])
+    np.testing.assert_array_equal(TO_chunked[0], TO_inds[0])